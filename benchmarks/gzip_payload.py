@@ -0,0 +1,39 @@
+"""Bytes on the wire and CPU cost of gzip compressing notices of various sizes
+
+Run with: python -m benchmarks.gzip_payload
+"""
+import timeit
+
+from errbit_reporter import Configuration, Notice
+from errbit_reporter.formats import encode_notice
+
+NUMBER = 200
+LEVELS = (None, 1, 6, 9)
+
+
+def make_notice(config, params_count):
+    backtrace = [('/app/app/handlers.py', 10 + i, 'handler_%d' % i, None) for i in range(30)]
+    notice = Notice(config, 'ValueError', 'ValueError: invalid literal for int()', backtrace)
+    notice.params = dict(('field_%d' % i, {'value': 'x' * 40, 'ids': list(range(5))})
+                         for i in range(params_count))
+    notice.cgi_data = dict(('HTTP_X_HEADER_%d' % i, 'value-%d' % i) for i in range(params_count))
+    return notice
+
+
+def main():
+    print("%-8s %-6s %10s %10s %10s" % ('params', 'level', 'raw bytes', 'wire bytes', 'us/notice'))
+    for params_count in (0, 10, 100, 1000):
+        for level in LEVELS:
+            config = Configuration('491b8cbb777b051df1406ae0bcdbee2c', 'http://errbit.example.com',
+                                   project_root='/app', server_name='web1',
+                                   gzip_threshold=None if level is None else 0,
+                                   gzip_level=level or 6)
+            notice = make_notice(config, params_count)
+            raw = len(notice.serialize())
+            body, headers = encode_notice(config, notice)
+            seconds = min(timeit.repeat(lambda: encode_notice(config, notice), number=NUMBER, repeat=3)) / NUMBER
+            print("%-8d %-6s %10d %10d %10.1f" % (params_count, level or 'off', raw, len(body), seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
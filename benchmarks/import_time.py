@@ -0,0 +1,81 @@
+"""Startup cost of importing errbit_reporter and of a disabled client
+
+Importing the package should stay cheap for command line tools, and a
+client without an errbit_url should do no work when notified.
+
+Run with: python -m benchmarks.import_time
+"""
+import subprocess
+import sys
+import timeit
+
+from errbit_reporter import Client, Configuration
+
+REPEAT = 10
+NUMBER = 100000
+# modules that are slow to import, which shouldn't be needed until a notice
+# is actually serialized or sent
+HEAVY_MODULES = ('xml.etree.ElementTree', 'http.client', 'urllib.request', 'asyncio', 'socket')
+
+CHECK_MODULES = """
+import sys
+import errbit_reporter
+client = errbit_reporter.Client(errbit_reporter.Configuration('key', None))
+try:
+    int('a')
+except ValueError:
+    client.notify()
+print(' '.join(name for name in %r if name in sys.modules))
+""" % (HEAVY_MODULES,)
+
+
+def interpreter_seconds(code):
+    "Best wall time in seconds to run a fresh interpreter on code"
+    timer = timeit.Timer(lambda: subprocess.check_call([sys.executable, '-c', code]))
+    return min(timer.repeat(number=1, repeat=REPEAT))
+
+
+def heavy_modules_loaded():
+    return subprocess.check_output([sys.executable, '-c', CHECK_MODULES]).decode().split()
+
+
+def disabled_notify_seconds():
+    client = Client(Configuration('key', None))
+
+    def notify():
+        try:
+            raise ValueError("disabled")
+        except ValueError:
+            client.notify()
+
+    def baseline():
+        try:
+            raise ValueError("disabled")
+        except ValueError:
+            pass
+
+    notify_time = min(timeit.repeat(notify, number=NUMBER, repeat=3))
+    baseline_time = min(timeit.repeat(baseline, number=NUMBER, repeat=3))
+    return (notify_time - baseline_time) / NUMBER
+
+
+def run():
+    startup = interpreter_seconds('pass')
+    return {
+        'import_ms': (interpreter_seconds('import errbit_reporter') - startup) * 1e3,
+        'import_client_ms': (interpreter_seconds('import errbit_reporter; errbit_reporter.Client') - startup) * 1e3,
+        'disabled_notify_us': disabled_notify_seconds() * 1e6,
+        'heavy_modules_loaded': len(heavy_modules_loaded()),
+    }
+
+
+def main():
+    results = run()
+    print("import errbit_reporter:           %6.2f ms" % results['import_ms'])
+    print("import errbit_reporter.Client:    %6.2f ms" % results['import_client_ms'])
+    print("notify on a disabled client:      %6.3f us" % results['disabled_notify_us'])
+    print("slow modules imported when disabled: %s" % (' '.join(heavy_modules_loaded()) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
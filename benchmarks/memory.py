@@ -0,0 +1,99 @@
+"""Memory held by each notice waiting in a delivery queue
+
+Notices pile up in the queue while errbit is down or slow, so this
+measures the bytes allocated per notice with tracemalloc, for notices as
+they are queued by notify and once their backtrace has been built, along
+with the metadata parsed from errbit's response.
+
+Run with: python -m benchmarks.memory
+"""
+import gc
+import sys
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+from errbit_reporter import Configuration, Notice, NoticeMetadata
+
+from test.stub_server import RESPONSE_FILENAME
+
+NOTICES = 2000
+STACK_DEPTH = 20
+
+
+def raise_at_depth(depth, value):
+    if depth <= 1:
+        raise ValueError("invalid literal for int() with base 10: %r" % value)
+    raise_at_depth(depth - 1, value)
+
+
+def queued_notice(config, i):
+    "A notice like those notify queues, for an exception that is no longer being handled"
+    try:
+        raise_at_depth(STACK_DEPTH, 'abc%d' % i)
+    except ValueError:
+        notice = Notice.from_exception(config, sys.exc_info())
+    notice.request_url = 'http://example.com/users/%d' % i
+    notice.params = {'id': str(i), 'page': '2'}
+    notice._detach()
+    return notice
+
+
+def bytes_per_item(make):
+    "Average bytes allocated and still held per item from make(i)"
+    items = []
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(NOTICES):
+            items.append(make(i))
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return float(after - before) / len(items)
+
+
+def run():
+    "Returns the bytes per item, or None if tracemalloc isn't available"
+    if tracemalloc is None:
+        return None
+    config = Configuration('491b8cbb777b051df1406ae0bcdbee2c', 'http://errbit.example.com',
+                           project_root='/app', server_name='web1')
+    with open(RESPONSE_FILENAME, 'rb') as f:
+        response = f.read()
+
+    def with_backtrace(i):
+        notice = queued_notice(config, i)
+        notice.backtrace
+        return notice
+
+    def parsed_metadata(i):
+        metadata = NoticeMetadata.from_notice_xml(config, response)
+        metadata.id
+        return metadata
+
+    # warm the caches shared between notices, like the interned frames
+    with_backtrace(0)
+    return {
+        'queued_notice_bytes': bytes_per_item(lambda i: queued_notice(config, i)),
+        'notice_with_backtrace_bytes': bytes_per_item(with_backtrace),
+        'metadata_bytes': bytes_per_item(parsed_metadata),
+    }
+
+
+def main():
+    results = run()
+    if results is None:
+        print("tracemalloc isn't available on python %d.%d" % sys.version_info[:2])
+        return
+    print("queued notice:                 %8.0f bytes" % results['queued_notice_bytes'])
+    print("notice with built backtrace:   %8.0f bytes" % results['notice_with_backtrace_bytes'])
+    print("parsed notice metadata:        %8.0f bytes" % results['metadata_bytes'])
+
+
+if __name__ == '__main__':
+    main()
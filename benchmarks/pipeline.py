@@ -0,0 +1,223 @@
+"""Cost of each step from capturing an exception to sending it to errbit
+
+Covers Notice.from_exception at various stack depths, Notice.serialize and
+serialize_json with small, large and nested params, parsing errbit's xml
+and json responses into NoticeMetadata, and
+Client.notify against a local stub errbit with injected latency, from one
+and several threads, as well as the startup cost from
+benchmarks.import_time and, where tracemalloc is available, the memory
+per queued notice from benchmarks.memory. Results are written as json so
+that runs can be compared for regressions.
+
+Run with: python -m benchmarks.pipeline [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+import timeit
+
+from errbit_reporter import Client, Configuration, DeliveryQueue, Notice, NoticeMetadata, PooledTransport
+from errbit_reporter.version import VERSION
+
+from benchmarks import import_time, memory
+from test.stub_server import RESPONSE_FILENAME, StubServer
+
+REPEAT = 5
+STACK_DEPTHS = (1, 10, 50, 200)
+THREADS = (1, 4, 16)
+LATENCIES = (0, 0.005)
+NOTIFY_CALLS = 200
+
+
+def make_config(errbit_url='http://errbit.example.com'):
+    return Configuration('491b8cbb777b051df1406ae0bcdbee2c', errbit_url,
+                         project_root='/app', server_name='web1')
+
+
+def raise_at_depth(depth):
+    if depth <= 1:
+        raise ValueError("invalid literal for int() with base 10: 'abc'")
+    raise_at_depth(depth - 1)
+
+
+def exc_info_at_depth(depth):
+    try:
+        raise_at_depth(depth)
+    except ValueError:
+        return sys.exc_info()
+
+
+def params_cases():
+    return {
+        'small': {'id': '1', 'page': '2', 'q': 'search'},
+        'large': dict(('field_%d' % i, 'x' * 40) for i in range(1000)),
+        'nested': nested_params(6, 4),
+    }
+
+
+def nested_params(depth, width):
+    if depth == 0:
+        return 'leaf'
+    return dict(('key_%d' % i, nested_params(depth - 1, width)) for i in range(width))
+
+
+def per_call(func, number):
+    "Best time in seconds of a call to func over REPEAT runs"
+    return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def bench_capture(config):
+    results = {}
+    for depth in STACK_DEPTHS:
+        exc_info = exc_info_at_depth(depth)
+        results['depth_%d' % depth] = {
+            'capture_us': per_call(lambda: Notice.from_exception(config, exc_info), 2000) * 1e6,
+            'backtrace_us': per_call(lambda: Notice.from_exception(config, exc_info).backtrace, 500) * 1e6,
+        }
+    return results
+
+
+def bench_serialize(config):
+    results = {}
+    exc_info = exc_info_at_depth(20)
+    for name, params in sorted(params_cases().items()):
+        notice = Notice.from_exception(config, exc_info)
+        notice.params = params
+        results[name] = {
+            'serialize_us': per_call(notice.serialize, 200) * 1e6,
+            'bytes': len(notice.serialize()),
+            'serialize_json_us': per_call(notice.serialize_json, 200) * 1e6,
+            'json_bytes': len(notice.serialize_json()),
+        }
+    return results
+
+
+def bench_parse(config):
+    "Parsing of the responses, which is deferred until a field is used"
+    with open(RESPONSE_FILENAME, 'rb') as f:
+        body = f.read()
+    json_body = b'{"id":"87186dda0c1d88569a171698","url":"http://errbit.example.com/locate/87186dda0c1d88569a171698"}'
+    return {
+        'from_notice_xml_us': per_call(lambda: NoticeMetadata.from_notice_xml(config, body).id, 5000) * 1e6,
+        'from_notice_json_us': per_call(lambda: NoticeMetadata.from_notice_json(config, json_body).id, 5000) * 1e6,
+    }
+
+
+def bench_notify(server, threads, queued):
+    "Times each notify call on the calling threads and the overall throughput"
+    config = make_config(server.url)
+    delivery = DeliveryQueue(maxsize=NOTIFY_CALLS * threads, workers=4) if queued else None
+    client = Client(config, delivery=delivery, transport=PooledTransport(maxsize=max(threads, 4)))
+    exc_info = exc_info_at_depth(20)
+    params = params_cases()['small']
+    samples = []
+    lock = threading.Lock()
+
+    def work():
+        times = []
+        for i in range(NOTIFY_CALLS):
+            start = time.time()
+            client.notify(exc_info, params=params, timeout=10)
+            times.append(time.time() - start)
+        with lock:
+            samples.extend(times)
+
+    workers = [threading.Thread(target=work) for i in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    client.close(timeout=60)
+    elapsed = time.time() - start
+    return {
+        'notices_per_second': len(samples) / elapsed,
+        'caller_p50_us': percentile(samples, 0.5) * 1e6,
+        'caller_p99_us': percentile(samples, 0.99) * 1e6,
+    }
+
+
+def bench_end_to_end():
+    results = {}
+    server = StubServer()
+    try:
+        for latency in LATENCIES:
+            server.latency = latency
+            for queued in (False, True):
+                for threads in THREADS:
+                    name = 'latency_%gms_%s_%d_threads' % (latency * 1000, 'queued' if queued else 'sync', threads)
+                    results[name] = bench_notify(server, threads, queued)
+                    del server.requests[:]
+    finally:
+        server.stop()
+    return results
+
+
+def run():
+    config = make_config()
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'errbit_reporter': VERSION,
+        },
+        'results': {
+            'capture': bench_capture(config),
+            'serialize': bench_serialize(config),
+            'parse': bench_parse(config),
+            'notify': bench_end_to_end(),
+            'startup': import_time.run(),
+        },
+    }
+    memory_results = memory.run()
+    if memory_results is not None:
+        results['results']['memory'] = memory_results
+    return results
+
+
+def flatten(results, prefix=''):
+    for key, value in sorted(results.items()):
+        if isinstance(value, dict):
+            for item in flatten(value, prefix + key + '.'):
+                yield item
+        else:
+            yield prefix + key, value
+
+
+def report(results, baseline=None):
+    baseline = dict(flatten(baseline['results'])) if baseline else {}
+    for name, value in flatten(results['results']):
+        line = "%-60s %14.1f" % (name, value)
+        if baseline.get(name):
+            line += "  %+6.1f%%" % (100.0 * (value - baseline[name]) / baseline[name])
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help="write the results as json to this file")
+    parser.add_argument('--compare', help="json results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = run()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""Per-notice saving from caching the static xml fragments of a Configuration
+
+Run with: python -m benchmarks.static_fragments
+"""
+import timeit
+
+from errbit_reporter import Configuration, Notice
+
+NUMBER = 20000
+
+
+def main():
+    config = Configuration('491b8cbb777b051df1406ae0bcdbee2c', 'http://errbit.example.com',
+                           project_root='/app', environment_name='production', server_name='web1')
+    backtrace = [('/app/main.py', i, 'handler', None) for i in range(10)]
+    notice = Notice(config, 'ValueError', 'ValueError: oops', backtrace)
+    notice.params = {'id': 1, 'user': {'name': 'dylan'}}
+
+    def uncached():
+        config.api_key = config.api_key
+        return notice.serialize()
+
+    cached_time = min(timeit.repeat(notice.serialize, number=NUMBER, repeat=5)) / NUMBER
+    uncached_time = min(timeit.repeat(uncached, number=NUMBER, repeat=5)) / NUMBER
+    print("serialize with cached fragments:    %6.2f us" % (cached_time * 1e6))
+    print("serialize rebuilding the fragments: %6.2f us" % (uncached_time * 1e6))
+    print("saving per notice:                  %6.2f us (%.0f%%)" % (
+        (uncached_time - cached_time) * 1e6, 100 * (1 - cached_time / uncached_time)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,67 @@
-from errbit_reporter.version import VERSION
-from errbit_reporter.config import Configuration
-from errbit_reporter.notice import Notice, NoticeMetadata
-from errbit_reporter.client import Client
-
-__all__ = [
-    'VERSION',
-    'Configuration',
-    'Notice',
-    'NoticeMetadata',
-    'Client'
+import importlib
+import sys
+
+from errbit_reporter.version import VERSION  # noqa: F401
+
+# the module defining each public name, which is imported on first use on
+# python 3.7+ so that importing the package stays cheap. Older versions
+# import them in this order, which has each module after the ones it uses
+_EXPORTS = [
+    ('Configuration', 'errbit_reporter.config'),
+    ('Notice', 'errbit_reporter.notice'),
+    ('NoticeMetadata', 'errbit_reporter.notice'),
+    ('DeliveryQueue', 'errbit_reporter.delivery'),
+    ('NoticeFuture', 'errbit_reporter.delivery'),
+    ('NoticeDropped', 'errbit_reporter.delivery'),
+    ('UrllibTransport', 'errbit_reporter.transport'),
+    ('PooledTransport', 'errbit_reporter.transport'),
+    ('Deduplicator', 'errbit_reporter.dedup'),
+    ('Spool', 'errbit_reporter.spool'),
+    ('RateLimiter', 'errbit_reporter.ratelimit'),
+    ('CircuitBreaker', 'errbit_reporter.breaker'),
+    ('CircuitOpenError', 'errbit_reporter.breaker'),
+    ('RetryPolicy', 'errbit_reporter.retry'),
+    ('RetryScheduler', 'errbit_reporter.retry'),
+    ('Metrics', 'errbit_reporter.metrics'),
+    ('InMemoryMetrics', 'errbit_reporter.metrics'),
+    ('CallbackMetrics', 'errbit_reporter.metrics'),
+    ('Client', 'errbit_reporter.client'),
+    ('RelayClient', 'errbit_reporter.relay'),
+    ('ErrbitMiddleware', 'errbit_reporter.wsgi'),
+    ('ErrbitHandler', 'errbit_reporter.handlers'),
+    ('request_context', 'errbit_reporter.context'),
+    ('set_context', 'errbit_reporter.context'),
+    ('reset_context', 'errbit_reporter.context'),
 ]
+if sys.version_info >= (3, 5):
+    _EXPORTS += [('AsyncClient', 'errbit_reporter.async_client'), ('AsyncTransport', 'errbit_reporter.async_client')]
+_MODULES = dict(_EXPORTS)
+
+__all__ = ['VERSION'] + sorted(_MODULES)
+
+
+def _load(name):
+    value = getattr(importlib.import_module(_MODULES[name]), name)
+    globals()[name] = value
+    return value
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in _MODULES:
+            return _load(name)
+        # submodules, like errbit_reporter.delivery, as before the names were
+        # imported lazily
+        module = __name__ + '.' + name
+        try:
+            return importlib.import_module(module)
+        except ImportError as e:
+            if e.name != module:
+                raise
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(_MODULES))
+else:
+    for _name, _module in _EXPORTS:
+        _load(_name)
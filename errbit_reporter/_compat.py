@@ -0,0 +1,35 @@
+import os
+import time
+import weakref
+
+try:
+    monotonic = time.monotonic
+except AttributeError:  # python 2
+    monotonic = time.time
+
+try:
+    replace = os.replace
+except AttributeError:  # python 2, where rename replaces atomically on posix
+    replace = os.rename
+
+_fork_handlers = weakref.WeakSet()
+
+
+def reset_after_fork(obj):
+    """Have obj._after_fork() called in the child process after os.fork()
+
+    The child only has the thread that forked, so objects use this to
+    replace locks that another thread could have been holding and forget
+    threads, connections and pending work that belong to the parent.
+    Requires os.register_at_fork (python 3.7+).
+    """
+    _fork_handlers.add(obj)
+
+
+def _run_fork_handlers():
+    for obj in list(_fork_handlers):
+        obj._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_run_fork_handlers)
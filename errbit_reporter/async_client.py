@@ -0,0 +1,291 @@
+import asyncio
+import email.parser
+import io
+import time
+from http.client import HTTPMessage
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+
+from errbit_reporter import formats
+from errbit_reporter.context import apply_context
+from errbit_reporter.notice import Notice
+
+
+class AsyncTransport(object):
+    """HTTP/1.1 transport built on asyncio streams
+
+    Idle connections are kept per host for reuse, and a request that fails
+    on a reused connection which the server had already closed is retried
+    once on a new connection.
+
+    Parameters:
+        maxsize : int, optional
+            Maximum number of idle connections kept per host (the default is 4)
+        idle_timeout : float, optional
+            Seconds after which an idle connection is closed instead of being
+            reused (the default is 30 seconds)
+    """
+
+    def __init__(self, maxsize=4, idle_timeout=30.0):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._targets = {}
+
+    async def post(self, url, body, headers, timeout=None):
+        """POST body to url and return the response body
+
+        Raises urllib.error.HTTPError for an error response and
+        asyncio.TimeoutError if errbit doesn't respond within timeout seconds.
+        """
+        if timeout is None:
+            return await self._post(url, body, headers)
+        return await asyncio.wait_for(self._post(url, body, headers), timeout)
+
+    async def close(self):
+        "Close all the idle connections"
+        pools, self._idle = self._idle, {}
+        for pool in pools.values():
+            for reader, writer, last_used in pool:
+                writer.close()
+
+    async def _post(self, url, body, headers):
+        key, host, path = self._target(url)
+        reader, writer, reused = await self._acquire(key)
+        try:
+            response = await self._request(reader, writer, host, path, body, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if not reused:
+                raise
+            reader, writer = await self._connect(key)
+            try:
+                response = await self._request(reader, writer, host, path, body, headers)
+            except BaseException:
+                writer.close()
+                raise
+        except BaseException:
+            writer.close()
+            raise
+
+        status, reason, response_headers, data, keep_alive = response
+        if keep_alive:
+            self._release(key, reader, writer)
+        else:
+            writer.close()
+        if status >= 400:
+            raise HTTPError(url, status, reason, response_headers, io.BytesIO(data))
+        return data
+
+    def _target(self, url):
+        target = self._targets.get(url)
+        if target is None:
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise ValueError("unsupported url scheme %r" % (parts.scheme,))
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+            target = ((parts.scheme, parts.hostname, port), parts.netloc, path)
+            self._targets[url] = target
+        return target
+
+    async def _acquire(self, key):
+        now = time.monotonic()
+        pool = self._idle.get(key)
+        while pool:
+            reader, writer, last_used = pool.pop()
+            if now - last_used > self.idle_timeout or reader.at_eof():
+                writer.close()
+            else:
+                return reader, writer, True
+        reader, writer = await self._connect(key)
+        return reader, writer, False
+
+    def _release(self, key, reader, writer):
+        pool = self._idle.setdefault(key, [])
+        if len(pool) < self.maxsize:
+            pool.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    async def _connect(self, key):
+        scheme, hostname, port = key
+        return await asyncio.open_connection(hostname, port, ssl=(scheme == 'https') or None)
+
+    async def _request(self, reader, writer, host, path, body, headers):
+        lines = ['POST %s HTTP/1.1' % path, 'Host: %s' % host,
+                 'Content-Length: %d' % len(body)]
+        lines.extend('%s: %s' % header for header in headers)
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by errbit")
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(line.decode('latin-1'))
+        response_headers = email.parser.Parser(_class=HTTPMessage).parsestr(''.join(header_lines))
+
+        keep_alive = version != 'HTTP/1.0' and response_headers.get('Connection', '').lower() != 'close'
+        if response_headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            data = await self._read_chunked(reader)
+        elif response_headers.get('Content-Length') is not None:
+            data = await reader.readexactly(int(response_headers['Content-Length']))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return int(status), reason, response_headers, data, keep_alive
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';', 1)[0], 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        return b''.join(chunks)
+
+
+async def _nothing():
+    return None
+
+
+class _NotifyOnException(object):
+
+    def __init__(self, client, context, timeout):
+        self.client = client
+        self.context = context
+        self.timeout = timeout
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is not None and issubclass(exc_type, Exception) and self.client.config.errbit_url:
+            notice = Notice.from_exception(self.client.config, (exc_type, exc_value, exc_tb))
+            for name, value in self.context.items():
+                setattr(notice, name, value)
+            apply_context(notice)
+            await self.client.send_notice(notice, timeout=self.timeout)
+        return False
+
+
+class AsyncClient(object):
+    """Errbit client for asyncio applications
+
+    Notices are sent without blocking the event loop, so the coroutines
+    mirror the methods of errbit_reporter.Client.
+
+    Parameters:
+        config : errbit_reporter.Configuration
+            Used to build the notice and its errbit_url is used to send the notice.
+        transport : errbit_reporter.AsyncTransport, optional
+            Sends the serialized notices to errbit (the default is an
+            AsyncTransport with its default settings)
+        concurrency : int, optional
+            Maximum number of notices being sent at the same time, further
+            notices wait for one of them to finish (the default is 10)
+    """
+
+    def __init__(self, config, transport=None, concurrency=10):
+        self.config = config
+        self.transport = transport or AsyncTransport()
+        self.concurrency = concurrency
+        self._semaphore = None
+        self._notices_url = (None, None)
+
+    def notify_on_exception(self, request_url=None, component=None, action=None,
+                            params={}, session={}, cgi_data={}, timeout=None):
+        """Async context manager that notifies errbit of any exceptions.
+
+        The exception will be re-raised after notifying errbit. Takes the
+        same parameters as errbit_reporter.Client.notify_on_exception.
+
+        Usage:
+            async with client.notify_on_exception():
+                await your_code_here()
+        """
+        context = {
+            'request_url': request_url,
+            'component': component,
+            'action': action,
+            'params': params,
+            'session': session,
+            'cgi_data': cgi_data,
+        }
+        return _NotifyOnException(self, context, timeout)
+
+    def notify(self, exc_info=None, request_url=None, component=None,
+               action=None, params={}, session={}, cgi_data={}, timeout=None):
+        """Notify errbit of an exception
+
+        Takes the same parameters as errbit_reporter.Client.notify. The
+        exception is captured when notify is called, so the returned
+        awaitable can be scheduled as a task after leaving the except block.
+
+        Returns:
+            awaitable of errbit_reporter.NoticeMetadata
+                Identifiers to find the notice, error or problem in errbit
+        """
+        if not self.config.errbit_url:
+            return _nothing()
+        notice = Notice.from_exception(self.config, exc_info)
+        notice.request_url = request_url
+        notice.component = component
+        notice.action = action
+        notice.params = params
+        notice.session = session
+        notice.cgi_data = cgi_data
+        apply_context(notice)
+        return self.send_notice(notice, timeout=timeout)
+
+    async def send_notice(self, notice, timeout=None):
+        """Send a Notice to errbit for an error
+
+        Parameters:
+            notice : errbit_reporter.Notice
+                The notice to send to errbit that describes the error
+            timeout : int, optional
+                The timeout in seconds for the request to errbit, including
+                the time spent waiting for the concurrency limit (the default
+                is no timeout)
+        """
+        if not self.config.errbit_url:
+            return None
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        notice_format = formats.get(self.config.notice_format)
+        body, headers = formats.encode_notice(self.config, notice)
+        url = self._notices_url_for(notice_format)
+        if timeout is None:
+            response = await self._post(url, body, headers)
+        else:
+            response = await asyncio.wait_for(self._post(url, body, headers), timeout)
+        return notice_format.parse_response(self.config, response)
+
+    async def close(self):
+        "Close the transport's connections"
+        await self.transport.close()
+
+    async def _post(self, url, body, headers):
+        async with self._semaphore:
+            return await self.transport.post(url, body, headers)
+
+    def _notices_url_for(self, notice_format):
+        config = self.config
+        key = (config.errbit_url, notice_format.path(config.api_key, config.project_id))
+        cached_key, url = self._notices_url
+        if cached_key != key:
+            url = urljoin(*key)
+            self._notices_url = (key, url)
+        return url
@@ -0,0 +1,123 @@
+import threading
+
+from errbit_reporter._compat import monotonic, reset_after_fork
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    "The notice wasn't sent because errbit has been failing"
+
+
+class CircuitBreaker(object):
+    """Stops sending notices to errbit while it is failing
+
+    The circuit opens after failure_threshold consecutive failed or slow
+    requests, then requests are short-circuited until reset_timeout has
+    passed. A single probe request is then let through (half open), which
+    closes the circuit if it succeeds or opens it again if it fails.
+
+    Parameters:
+        failure_threshold : int, optional
+            Consecutive failures that open the circuit (the default is 5)
+        slow_threshold : float, optional
+            Seconds after which a successful request counts as a failure (the
+            default is to only count errors)
+        reset_timeout : float, optional
+            Seconds the circuit stays open before a probe request is let
+            through (the default is 30 seconds)
+        fallback : callable, optional
+            Called with the notice instead of sending it while the circuit is
+            open, e.g. to log it locally, with its return value returned by
+            send_notice (the default is to raise CircuitOpenError)
+    """
+
+    def __init__(self, failure_threshold=5, slow_threshold=None, reset_timeout=30.0, fallback=None):
+        self.failure_threshold = failure_threshold
+        self.slow_threshold = slow_threshold
+        self.reset_timeout = reset_timeout
+        self.fallback = fallback
+
+        self.trips = 0
+        self.short_circuited = 0
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        reset_after_fork(self)
+
+    @property
+    def state(self):
+        "CLOSED, OPEN or HALF_OPEN"
+        with self._lock:
+            if self._state == OPEN and monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def stats(self):
+        """The breaker's state and counters for monitoring
+
+        Returns:
+            dict
+                The 'state', 'consecutive_failures', number of 'trips' and
+                number of 'short_circuited' requests
+        """
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'trips': self.trips,
+                'short_circuited': self.short_circuited,
+            }
+
+    def allow(self, now=None):
+        "Returns whether a request may be sent now, which it must then record"
+        if now is None:
+            now = monotonic()
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def cancel(self):
+        "Record that a request allow let through won't be sent after all"
+        with self._lock:
+            self._probing = False
+
+    def record_success(self, duration=0.0, now=None):
+        "Record a request that errbit answered, which failed if it was slow"
+        if self.slow_threshold is not None and duration > self.slow_threshold:
+            self.record_failure(now)
+            return
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self, now=None):
+        "Record a request that errbit didn't answer successfully"
+        if now is None:
+            now = monotonic()
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.trips += 1
+                self._state = OPEN
+                self._opened_at = now
+            self._probing = False
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._probing = False
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Mapping that holds at most maxsize items, evicting the least recently used
+
+    It isn't thread-safe, so callers that share it between threads need to
+    hold a lock around its use.
+    """
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        "Returns the value for key and marks it as the most recently used"
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def peek(self, key, default=None):
+        "Returns the value for key without marking it as used"
+        return self._items.get(key, default)
+
+    def set(self, key, value):
+        """Stores value for key
+
+        Returns:
+            (key, value) pair that was evicted to make room, or None
+        """
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.maxsize:
+            return self._items.popitem(last=False)
+        return None
+
+    def pop(self, key, default=None):
+        return self._items.pop(key, default)
+
+    def items(self):
+        return list(self._items.items())
+
+    def clear(self):
+        self._items.clear()
@@ -1,8 +1,58 @@
+import functools
+import threading
 from contextlib import contextmanager
 
 from six.moves import urllib
 
-from errbit_reporter import Notice, NoticeMetadata
+from errbit_reporter import formats
+from errbit_reporter._compat import monotonic, reset_after_fork
+from errbit_reporter.context import apply_context
+from errbit_reporter.breaker import CircuitOpenError
+from errbit_reporter.delivery import DeliveryQueue, NoticeDropped, NoticeFuture
+from errbit_reporter.metrics import (
+    Metrics, CAPTURE_SECONDS, DEDUPLICATED, FAILED, PARSE_SECONDS, PAYLOAD_BYTES, QUEUE_DEPTH,
+    QUEUE_DROPPED, RATE_LIMITED, RETRIED, RETRY_PENDING, SEND_SECONDS, SENT, SERIALIZE_SECONDS,
+    SHORT_CIRCUITED, SPOOLED, SPOOL_BYTES, SPOOL_DROPPED)
+from errbit_reporter.notice import Notice
+from errbit_reporter.transport import UrllibTransport, PooledTransport, is_transient_error
+
+# timeout for the requests of spool replays and deduplicator follow-ups
+REPLAY_TIMEOUT = 10
+# workers sending retries for clients without a delivery queue
+RETRY_WORKERS = 2
+RETRY_QUEUE_SIZE = 1000
+NULL_METRICS = Metrics()
+
+
+def _remaining(deadline):
+    "Seconds left until deadline, or None for no deadline"
+    if deadline is None:
+        return None
+    return max(0, deadline - monotonic())
+
+
+def _circuit_open_error():
+    return CircuitOpenError("errbit has been failing, not sending the notice")
+
+
+class _Attempts(object):
+    "A serialized notice that is being sent, and retried if that fails"
+
+    __slots__ = ('notice', 'notice_format', 'body', 'headers', 'timeout', 'read_response',
+                 'count', 'started_at', 'error', 'future', 'timer')
+
+    def __init__(self, notice, notice_format, body, headers, timeout, read_response):
+        self.notice = notice
+        self.notice_format = notice_format
+        self.body = body
+        self.headers = headers
+        self.timeout = timeout
+        self.read_response = read_response
+        self.count = 0
+        self.started_at = monotonic()
+        self.error = None
+        self.future = None
+        self.timer = None
 
 
 class Client(object):
@@ -11,17 +61,77 @@ class Client(object):
     Parameters:
         config : errbit_reporter.Configuration
             Used to build the notice and its errbit_url is used to send the notice.
+        delivery : errbit_reporter.DeliveryQueue, optional
+            Queue used to send notices from background threads, in which case
+            notify returns a NoticeFuture instead of waiting for errbit (the
+            default is to send notices on the calling thread)
+        transport : object, optional
+            Sends the serialized notices to errbit with its
+            post(url, body, headers, timeout, read_response) method, e.g. a
+            errbit_reporter.PooledTransport to reuse connections (the default
+            opens a new connection for each notice with urllib)
+        deduplicator : errbit_reporter.Deduplicator, optional
+            Collapses repeats of the same error into a follow-up notice with
+            an occurrence count, sent when its window ends (the default is
+            to send every notice)
+        spool : errbit_reporter.Spool, optional
+            Stores notices that can't be delivered because errbit is down or
+            failing, and replays them from a background thread once it
+            recovers (the default is to raise the error)
+        rate_limiter : errbit_reporter.RateLimiter, optional
+            Samples and rate limits notices, which are dropped before being
+            serialized (the default is to send every notice)
+        circuit_breaker : errbit_reporter.CircuitBreaker, optional
+            Stops sending notices while errbit is failing, using its fallback
+            or the spool for them instead (the default is to always try)
+        metrics : errbit_reporter.Metrics, optional
+            Records the time spent capturing, serializing and sending notices
+            and parsing responses once the metadata is used, their sizes,
+            and counts of sent, failed and dropped notices, e.g. an
+            errbit_reporter.InMemoryMetrics (the default ignores them)
+        fire_and_forget : bool, optional
+            Don't read errbit's response to notices, so that notify and
+            send_notice return None instead of the notice metadata (the
+            default is False). notify_on_exception never reads the response.
+        retry_policy : errbit_reporter.RetryPolicy, optional
+            Sends notices again after transient failures, in which case the
+            outcome is reported through a NoticeFuture. Retries are sent by
+            the delivery queue's workers, or by a few worker threads of the
+            client's own without one. Notices are only spooled once the
+            policy gives up on them (the default is not to retry)
     """
 
-    def __init__(self, config):
+    def __init__(self, config, delivery=None, transport=None, deduplicator=None, spool=None,
+                 rate_limiter=None, circuit_breaker=None, metrics=None, fire_and_forget=False,
+                 retry_policy=None):
         self.config = config
+        self.delivery = delivery
+        self.transport = transport or UrllibTransport()
+        self.deduplicator = deduplicator
+        self.spool = spool
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics or NULL_METRICS
+        self.fire_and_forget = fire_and_forget
+        self.retry_policy = retry_policy
+        self._notices_url = (None, None)
+        self._retries_lock = threading.Lock()
+        self._retries = set()
+        self._retry_delivery = None
+        self._closed = False
+        reset_after_fork(self)
+        if spool is not None and config.errbit_url:
+            spool.start(self._replay)
+        if deduplicator is not None and config.errbit_url:
+            deduplicator.start(self._send_follow_up)
 
     @contextmanager
     def notify_on_exception(self, request_url=None, component=None, action=None,
                             params={}, session={}, cgi_data={}, timeout=None):
         """Context manager that notifies errbit of any exceptions.
 
-        The exception will be re-raised after notifying errbit.
+        The exception will be re-raised after notifying errbit. Fields that
+        aren't given are filled from the errbit_reporter.request_context.
 
         Parameters:
             request_url : str, optional
@@ -43,6 +153,9 @@ class Client(object):
         try:
             yield
         except Exception:
+            if not self.config.errbit_url:
+                raise
+            started = monotonic()
             notice = Notice.from_exception(self.config)
             notice.request_url = request_url
             notice.component = component
@@ -50,13 +163,18 @@ class Client(object):
             notice.params = params
             notice.session = session
             notice.cgi_data = cgi_data
-            self.send_notice(notice, timeout=timeout)
+            apply_context(notice)
+            self.metrics.observe(CAPTURE_SECONDS, monotonic() - started)
+            self._deliver(notice, timeout, read_response=False)
             raise
 
     def notify(self, exc_info=None, request_url=None, component=None,
                action=None, params={}, session={}, cgi_data={}, timeout=None):
         """Notify errbit of an exception
 
+        Fields that aren't given are filled from the
+        errbit_reporter.request_context.
+
         Parameters:
             exc_info : (type, Exception, traceback), optional
                 Information from sys.exc_info() to notify errbit about (the default
@@ -79,8 +197,17 @@ class Client(object):
 
         Returns:
             errbit_reporter.NoticeMetadata
-                Identifiers to find the notice, error or problem in errbit
+                Identifiers to find the notice, error or problem in errbit, or
+                an errbit_reporter.NoticeFuture for it when the client has a
+                delivery queue or a retry of the notice has been scheduled,
+                or None if the deduplicator held it back as a
+                repeat, the rate limiter dropped it or the client is fire and
+                forget or has no errbit_url
         """
+        if not self.config.errbit_url:
+            # nothing would be sent, so skip capturing the exception
+            return None
+        started = monotonic()
         notice = Notice.from_exception(self.config, exc_info)
         notice.request_url = request_url
         notice.component = component
@@ -88,7 +215,141 @@ class Client(object):
         notice.params = params
         notice.session = session
         notice.cgi_data = cgi_data
-        return self.send_notice(notice, timeout=timeout)
+        apply_context(notice)
+        self.metrics.observe(CAPTURE_SECONDS, monotonic() - started)
+        return self._deliver(notice, timeout, not self.fire_and_forget)
+
+    def queue_notice(self, notice, timeout=None):
+        """Deliver a notice built by the caller without waiting for room in the queue
+
+        The notice is rate limited and deduplicated like those of notify,
+        but errbit's response isn't read. A notice that finds the delivery
+        queue full is dropped, even with the BLOCK overflow policy, so this
+        can be called while holding a lock, e.g. from a logging handler.
+        Without a delivery queue, the notice is sent on the calling thread.
+
+        Parameters:
+            notice : errbit_reporter.Notice
+                The notice to send to errbit that describes the error
+            timeout : int, optional
+                The timeout in seconds for the request to errbit (the default is no
+                timeout)
+
+        Returns:
+            errbit_reporter.NoticeFuture
+                The outcome of sending the notice when the client has a
+                delivery queue or a retry of the notice has been scheduled,
+                otherwise None
+        """
+        if not self.config.errbit_url:
+            return None
+        return self._deliver(notice, timeout, False, block=False)
+
+    def flush(self, timeout=None):
+        """Send pending follow-up notices and wait for queued notices to be sent
+
+        Returns:
+            bool
+                False if notices were still pending after timeout seconds
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        self._send_follow_ups(deadline)
+        if self.delivery is None:
+            return True
+        return self.delivery.flush(_remaining(deadline))
+
+    def close(self, timeout=None):
+        """Send queued notices, stop the delivery workers and close connections
+
+        Notices waiting to be retried are spooled if there is a spool, and
+        otherwise fail with the error of their last attempt, as do notices
+        that fail once the client is closing instead of being retried.
+        Follow-up notices that can't be sent within the timeout are lost.
+
+        Returns:
+            bool
+                False if notices were still pending after timeout seconds
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._retries_lock:
+            # notices failing from now on are spooled or fail right away
+            self._closed = True
+        try:
+            if self.deduplicator is not None:
+                self.deduplicator.stop(_remaining(deadline))
+            self._send_follow_ups(deadline)
+        finally:
+            self._cancel_retries()
+            closed = True
+            if self.delivery is not None:
+                closed = self.delivery.close(_remaining(deadline))
+            with self._retries_lock:
+                retry_delivery = self._retry_delivery
+            if retry_delivery is not None:
+                closed = retry_delivery.close(_remaining(deadline)) and closed
+            if self.spool is not None:
+                self.spool.close(_remaining(deadline))
+            self.transport.close()
+        return closed
+
+    def _deliver(self, notice, timeout, read_response, block=True):
+        if self._rate_limited(notice):
+            return None
+        if self.deduplicator is None:
+            return self._dispatch(notice, timeout, read_response, block)
+        result = None
+        dispatched = False
+        for pending in self.deduplicator.filter(notice):
+            if pending is notice:
+                result = self._dispatch(notice, timeout, read_response, block)
+                dispatched = True
+            else:
+                self._dispatch(pending, timeout, False, block)
+        if not dispatched:
+            self.metrics.increment(DEDUPLICATED)
+        return result
+
+    def _rate_limited(self, notice):
+        if self.rate_limiter is None or self.rate_limiter.allow(notice):
+            return False
+        self.metrics.increment(RATE_LIMITED)
+        return True
+
+    def _dispatch(self, notice, timeout, read_response, block=True):
+        if self.delivery is None:
+            return self._send(notice, timeout, read_response)
+        notice._detach()
+        submit = self.delivery.submit if block else self.delivery.submit_nowait
+        future = submit(self._send, notice, timeout, read_response)
+        future.add_done_callback(self._count_queue_drop)
+        self.metrics.gauge(QUEUE_DEPTH, len(self.delivery))
+        return future
+
+    def _count_queue_drop(self, future):
+        if isinstance(future.exception(), NoticeDropped):
+            self.metrics.increment(QUEUE_DROPPED)
+
+    def _send_follow_up(self, notice):
+        # called from the deduplicator's thread when a window ends
+        self._dispatch(notice, REPLAY_TIMEOUT, False)
+
+    def _send_follow_ups(self, deadline):
+        if self.deduplicator is None:
+            return
+        for notice in self.deduplicator.drain():
+            timeout = REPLAY_TIMEOUT
+            if deadline is not None and self.delivery is None:
+                timeout = min(timeout, deadline - monotonic())
+                if timeout <= 0:
+                    # out of time, the follow-up is lost
+                    self.metrics.increment(FAILED)
+                    continue
+            try:
+                self._dispatch(notice, timeout, False)
+            except Exception:
+                # like the deduplicator's thread, keep sending the others;
+                # the failure has been counted by _post or spooled
+                pass
 
     def send_notice(self, notice, timeout=None):
         """Send a Notice to errbit for an error
@@ -99,12 +360,304 @@ class Client(object):
             timeout : int, optional
                 The timeout in seconds for the request to errbit (the default is no
                 timeout)
+
+        Returns:
+            errbit_reporter.NoticeMetadata
+                Identifiers to find the notice, error or problem in errbit,
+                None if the notice was dropped by the rate limiter or spooled
+                to be sent later, or the return value of the circuit breaker's
+                fallback while it is open, or None if the client is fire and
+                forget, or an errbit_reporter.NoticeFuture for the outcome if
+                a retry of the notice has been scheduled
         """
+        if self._rate_limited(notice):
+            return None
+        return self._send(notice, timeout, not self.fire_and_forget)
+
+    def _send(self, notice, timeout, read_response):
         if not self.config.errbit_url:
             return None
-        url = urllib.parse.urljoin(self.config.errbit_url, "/notifier_api/v2/notices/")
-        request = urllib.request.Request(url, notice.serialize())
-        request.add_header('Content-Type', 'text/xml')
-        request.add_header('Accept', 'text/xml, application/xml')
-        response = urllib.request.urlopen(request, timeout=timeout)
-        return NoticeMetadata.from_notice_xml(self.config, response.read())
+        # asked before serializing the notice, which is wasted while errbit
+        # is down unless the notice will be retried or spooled
+        allowed = self._allow()
+        if not allowed:
+            if self.circuit_breaker.fallback is not None:
+                return self.circuit_breaker.fallback(notice)
+            if self.retry_policy is None and self.spool is None:
+                raise _circuit_open_error()
+        notice_format, body, headers = self._encode_allowed(notice, allowed)
+        return self._attempt(_Attempts(notice, notice_format, body, headers, timeout, read_response), allowed)
+
+    def _attempt(self, attempts, allowed=None):
+        """Send the notice once
+
+        allowed is whether the circuit breaker has already been asked to let
+        the request through, and what it answered.
+
+        Returns the attempts' future if a retry has been scheduled.
+        """
+        attempts.count += 1
+        if allowed is None:
+            allowed = self._allow()
+        try:
+            if not allowed:
+                raise _circuit_open_error()
+            response = self._post(self.transport, attempts.notice_format, attempts.body, attempts.headers,
+                                  attempts.timeout, attempts.read_response)
+        except Exception as e:
+            if isinstance(e, CircuitOpenError) and self.circuit_breaker.fallback is not None:
+                return self.circuit_breaker.fallback(attempts.notice)
+            if self._schedule_retry(attempts, e):
+                return attempts.future
+            if self.spool is None or not is_transient_error(e):
+                raise
+            self._spool(attempts.body)
+            return None
+        return self._metadata(attempts.notice_format, response)
+
+    def _schedule_retry(self, attempts, error):
+        policy = self.retry_policy
+        if policy is None:
+            return False
+        delay = policy.delay(attempts.count, monotonic() - attempts.started_at, error)
+        if delay is None:
+            return False
+        if attempts.future is None:
+            attempts.future = NoticeFuture()
+        with self._retries_lock:
+            if self._closed:
+                return False
+            self._retries.add(attempts)
+            attempts.error = error
+            attempts.timer = policy.scheduler.call_later(delay, self._retry, attempts)
+        self.metrics.gauge(RETRY_PENDING, len(policy.scheduler))
+        return True
+
+    def _retry(self, attempts):
+        # called on the scheduler's thread, which is shared by every client,
+        # so the request is always handed to a delivery queue's workers
+        with self._retries_lock:
+            self._retries.discard(attempts)
+            closed = self._closed
+            delivery = self.delivery
+            if delivery is None and not closed:
+                if self._retry_delivery is None:
+                    self._retry_delivery = DeliveryQueue(maxsize=RETRY_QUEUE_SIZE, workers=RETRY_WORKERS)
+                delivery = self._retry_delivery
+        if closed:
+            # the timer fired as the client was being closed
+            self._abandon(attempts, attempts.error)
+            return
+        self.metrics.increment(RETRIED)
+        # a full queue mustn't hold up the scheduler's thread, even with the
+        # BLOCK overflow policy, and _retry_dropped spools what it drops
+        queued = delivery.submit_nowait(self._finish_attempt, attempts)
+        queued.add_done_callback(lambda future: self._retry_dropped(attempts, future))
+
+    def _retry_dropped(self, attempts, future):
+        error = future.exception()
+        if not isinstance(error, NoticeDropped):
+            return
+        self.metrics.increment(QUEUE_DROPPED)
+        self._abandon(attempts, error)
+
+    def _abandon(self, attempts, error):
+        "Spools a notice that won't be retried, or fails its future with error"
+        if self.spool is not None:
+            self._spool(attempts.body)
+            attempts.future.set_result(None)
+        else:
+            attempts.future.set_exception(error)
+
+    def _finish_attempt(self, attempts):
+        future = attempts.future
+        try:
+            result = self._attempt(attempts)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        if result is not future:
+            future.set_result(result)
+
+    def _after_fork(self):
+        # retries pending in the parent are sent or spooled by the parent
+        self._retries_lock = threading.Lock()
+        self._retries = set()
+        self._retry_delivery = None
+
+    def _cancel_retries(self):
+        with self._retries_lock:
+            pending = list(self._retries)
+            self._retries.clear()
+        for attempts in pending:
+            if not attempts.timer.cancel():
+                # already being retried
+                continue
+            self._abandon(attempts, attempts.error)
+
+    def send_notices(self, notices, concurrency=4, timeout=None):
+        """Send many notices to errbit over a few reused connections
+
+        Notices are serialized as they are taken from the iterable, and at
+        most concurrency requests are in flight at a time. The client's
+        transport is used if it reuses connections, otherwise a
+        errbit_reporter.PooledTransport is used for the batch.
+
+        Parameters:
+            notices : iterable of errbit_reporter.Notice
+                The notices to send to errbit
+            concurrency : int, optional
+                The maximum number of notices being sent at the same time (the
+                default is 4)
+            timeout : int, optional
+                The timeout in seconds for each request to errbit (the default
+                is no timeout)
+
+        Returns:
+            list of errbit_reporter.NoticeMetadata or Exception
+                The metadata for each notice, None for a notice dropped by
+                the rate limiter, or the exception raised while sending it,
+                in the order of the notices
+        """
+        if not self.config.errbit_url:
+            return [None for notice in notices]
+        read_response = not self.fire_and_forget
+        transport = self.transport
+        batch_transport = isinstance(transport, UrllibTransport)
+        if batch_transport:
+            transport = PooledTransport(maxsize=concurrency)
+
+        lock = threading.Lock()
+        pending = enumerate(notices)
+        results = []
+        errors = []
+
+        def work():
+            while True:
+                with lock:
+                    if errors:
+                        return
+                    try:
+                        index, notice = next(pending)
+                    except StopIteration:
+                        return
+                    except Exception as e:
+                        errors.append(e)
+                        return
+                    results.append(None)
+                if self._rate_limited(notice):
+                    continue
+                try:
+                    result = self._send_notice(transport, notice, timeout, read_response)
+                except Exception as e:
+                    result = e
+                results[index] = result
+
+        try:
+            if concurrency <= 1:
+                work()
+            else:
+                threads = [threading.Thread(target=work) for i in range(concurrency)]
+                for thread in threads:
+                    thread.daemon = True
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            if batch_transport:
+                transport.close()
+        if errors:
+            raise errors[0]
+        return results
+
+    def _send_notice(self, transport, notice, timeout, read_response):
+        if not self._allow():
+            raise _circuit_open_error()
+        notice_format, body, headers = self._encode_allowed(notice, True)
+        response = self._post(transport, notice_format, body, headers, timeout, read_response)
+        return self._metadata(notice_format, response)
+
+    def _encode_allowed(self, notice, allowed):
+        "_encode for a notice the circuit breaker has already been asked about"
+        try:
+            return self._encode(notice)
+        except Exception:
+            if allowed and self.circuit_breaker is not None:
+                # the request won't be sent, so it mustn't hold the probe
+                self.circuit_breaker.cancel()
+            raise
+
+    def _encode(self, notice):
+        started = monotonic()
+        notice_format = formats.get(self.config.notice_format)
+        body, headers = formats.encode_notice(self.config, notice)
+        self.metrics.observe(SERIALIZE_SECONDS, monotonic() - started)
+        self.metrics.observe(PAYLOAD_BYTES, len(body))
+        return notice_format, body, headers
+
+    def _spool(self, body):
+        if self.spool.append(body):
+            self.metrics.increment(SPOOLED)
+        else:
+            # the spool is full or closed
+            self.metrics.increment(SPOOL_DROPPED)
+        self.metrics.gauge(SPOOL_BYTES, self.spool.pending_bytes)
+
+    def _metadata(self, notice_format, response):
+        if response is None:
+            # the response wasn't read or the transport doesn't wait for it
+            return None
+        metadata = notice_format.parse_response(self.config, response)
+        # the response is parsed when a field is first used, if ever
+        metadata._on_parse = functools.partial(self.metrics.observe, PARSE_SECONDS)
+        return metadata
+
+    def _post(self, transport, notice_format, body, headers, timeout, read_response):
+        # the circuit breaker must have allowed the request, see _allow
+        url = self._notices_url_for(notice_format)
+        breaker = self.circuit_breaker
+        started = monotonic()
+        try:
+            response = transport.post(url, body, headers, timeout=timeout, read_response=read_response)
+        except Exception as e:
+            duration = monotonic() - started
+            self.metrics.observe(SEND_SECONDS, duration)
+            self.metrics.increment(FAILED)
+            if breaker is not None:
+                if is_transient_error(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success(duration)
+            raise
+        duration = monotonic() - started
+        self.metrics.observe(SEND_SECONDS, duration)
+        self.metrics.increment(SENT)
+        if breaker is not None:
+            breaker.record_success(duration)
+        return response
+
+    def _allow(self):
+        "Whether the circuit breaker lets a request through, counting those it doesn't"
+        breaker = self.circuit_breaker
+        if breaker is None or breaker.allow():
+            return True
+        self.metrics.increment(SHORT_CIRCUITED)
+        return False
+
+    def _replay(self, body):
+        notice_format = formats.for_payload(body)
+        headers = formats.payload_headers(notice_format, body)
+        if not self._allow():
+            raise _circuit_open_error()
+        self.metrics.increment(RETRIED)
+        self._post(self.transport, notice_format, body, headers, REPLAY_TIMEOUT, False)
+        self.metrics.gauge(SPOOL_BYTES, self.spool.pending_bytes)
+
+    def _notices_url_for(self, notice_format):
+        config = self.config
+        key = (config.errbit_url, notice_format.path(config.api_key, config.project_id))
+        cached_key, url = self._notices_url
+        if cached_key != key:
+            url = urllib.parse.urljoin(*key)
+            self._notices_url = (key, url)
+        return url
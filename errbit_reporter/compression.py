@@ -0,0 +1,41 @@
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def gzip_chunks(chunks, threshold, level=6):
+    """Gzip a payload given as chunks once it reaches threshold bytes
+
+    Chunks are only buffered until the threshold is reached, after which
+    they are fed to the compressor as they are produced.
+
+    Returns:
+        (bytes, bool)
+            The body, and whether it is gzip compressed
+    """
+    buffered = []
+    size = 0
+    chunks = iter(chunks)
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= threshold:
+            break
+    else:
+        return b''.join(buffered), False
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = [compressor.compress(b''.join(buffered))]
+    for chunk in chunks:
+        compressed.append(compressor.compress(chunk))
+    compressed.append(compressor.flush())
+    return b''.join(compressed), True
+
+
+def is_gzipped(body):
+    return body[:2] == GZIP_MAGIC
+
+
+def peek(body, size):
+    "The first size bytes of a gzip compressed body once decompressed"
+    return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(body, size)
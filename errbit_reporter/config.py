@@ -1,5 +1,14 @@
 import os
-import socket
+
+from errbit_reporter import xmlwriter
+
+
+def _hostname():
+    "socket.gethostname(), without importing socket where os.uname has it"
+    if hasattr(os, 'uname'):
+        return os.uname()[1]
+    import socket
+    return socket.gethostname()
 
 
 class Configuration(object):
@@ -18,9 +27,54 @@ class Configuration(object):
             Environment field on the error's page (the default is 'production')
         server_name : str
             App Server field on error's page (the default is the server's hostname)
+        gzip_threshold : int, optional
+            Size in bytes from which notices are sent gzip compressed (the
+            default is to never compress them)
+        gzip_level : int, optional
+            zlib compression level from 1 (fastest) to 9 (smallest) used for
+            compressed notices (the default is 6)
+        max_depth : int, optional
+            Nesting depth of dicts and lists in params, session and cgi_data
+            below which they are replaced by a marker (the default is 10)
+        max_keys : int, optional
+            Number of keys of a dict that are sent, with a marker for the rest
+            (the default is 200)
+        max_list_items : int, optional
+            Number of items of a list that are sent, with a marker for the rest
+            (the default is 200)
+        max_string_length : int, optional
+            Length at which values are truncated (the default is 4096)
+        max_payload_bytes : int, optional
+            Approximate total size of params, session and cgi_data, beyond
+            which the remaining values are truncated (the default is 256 KiB)
+        notice_format : str or format, optional
+            'xml' for errbit's notifier v2 API or 'json' for the Airbrake v3
+            API, or an object like those in errbit_reporter.formats (the
+            default is 'xml')
+        project_id : str, optional
+            Project id in the url of the Airbrake v3 API, which errbit ignores
+            (the default is the api key)
+
+        Setting any of the limits to None removes it.
     """
 
-    def __init__(self, api_key, errbit_url, project_root=None, environment_name='production', server_name=None):
+    __slots__ = (
+        'api_key', 'errbit_url', 'notifier_name', 'notifier_version', 'notifier_url',
+        'project_root', 'environment_name', 'server_name', 'gzip_threshold', 'gzip_level',
+        'max_depth', 'max_keys', 'max_list_items', 'max_string_length', 'max_payload_bytes',
+        'notice_format', 'project_id', '_xml_fragments',
+    )
+
+    XML_FRAGMENT_ATTRIBUTES = frozenset([
+        'api_key', 'notifier_name', 'notifier_version', 'notifier_url',
+        'project_root', 'environment_name', 'server_name',
+    ])
+
+    def __init__(self, api_key, errbit_url, project_root=None, environment_name='production', server_name=None,
+                 gzip_threshold=None, gzip_level=6, max_depth=10, max_keys=200, max_list_items=200,
+                 max_string_length=4096, max_payload_bytes=256 * 1024, notice_format='xml',
+                 project_id=None):
+        self._xml_fragments = None
         self.api_key = api_key
         self.errbit_url = errbit_url
 
@@ -32,4 +86,54 @@ class Configuration(object):
         if not self.project_root.endswith('/'):
             self.project_root += '/'
         self.environment_name = environment_name
-        self.server_name = server_name or socket.gethostname()
+        self.server_name = server_name or _hostname()
+        self.gzip_threshold = gzip_threshold
+        self.gzip_level = gzip_level
+        self.max_depth = max_depth
+        self.max_keys = max_keys
+        self.max_list_items = max_list_items
+        self.max_string_length = max_string_length
+        self.max_payload_bytes = max_payload_bytes
+        self.notice_format = notice_format
+        self.project_id = project_id
+
+    def __setattr__(self, name, value):
+        if name in self.XML_FRAGMENT_ATTRIBUTES:
+            object.__setattr__(self, '_xml_fragments', None)
+        object.__setattr__(self, name, value)
+
+    @property
+    def xml_fragments(self):
+        """The encoded xml that is the same for every notice
+
+        Returns:
+            (bytes, bytes)
+                The start of the notice up to the error element, and the end
+                of the notice from the end of the request element. These are
+                cached until one of the attributes they contain is reassigned.
+        """
+        fragments = self._xml_fragments
+        if fragments is None:
+            element = xmlwriter.element
+            head = ''.join([
+                xmlwriter.XML_DECLARATION,
+                '<notice version="2.4">',
+                element('api-key', self.api_key),
+                '<notifier>',
+                element('name', self.notifier_name),
+                element('version', self.notifier_version),
+                element('url', self.notifier_url),
+                '</notifier>',
+            ])
+            tail = ''.join([
+                '</request>',
+                '<server-environment>',
+                element('project-root', self.project_root),
+                element('environment-name', self.environment_name),
+                element('hostname', self.server_name),
+                '</server-environment>',
+                '</notice>',
+            ])
+            fragments = (xmlwriter.encode(head), xmlwriter.encode(tail))
+            self._xml_fragments = fragments
+        return fragments
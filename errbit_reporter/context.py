@@ -0,0 +1,101 @@
+"""Ambient context for the notices of the current request
+
+Frameworks set the context once per request, or per asyncio task, and it
+fills the fields of notices that notify wasn't given. Values can be
+callables, which are only called when an error is reported, so setting
+the context doesn't need to build the params, session or cgi_data.
+"""
+import threading
+from contextlib import contextmanager
+
+try:
+    import contextvars
+except ImportError:  # python < 3.7
+    contextvars = None
+
+FIELDS = frozenset(['request_url', 'component', 'action', 'params', 'session', 'cgi_data'])
+
+if contextvars is not None:
+    _context = contextvars.ContextVar('errbit_reporter_context', default=None)
+
+    def _get():
+        return _context.get()
+
+    def _set(fields):
+        return _context.set(fields)
+
+    def _reset(token):
+        _context.reset(token)
+else:
+    _local = threading.local()
+
+    def _get():
+        return getattr(_local, 'fields', None)
+
+    def _set(fields):
+        token = _get()
+        _local.fields = fields
+        return token
+
+    def _reset(token):
+        _local.fields = token
+
+
+def set_context(**fields):
+    """Set fields of the context for the current thread or asyncio task
+
+    Takes the keyword arguments of Client.notify that describe the request
+    (request_url, component, action, params, session and cgi_data), whose
+    values may be callables that return the value. New asyncio tasks start
+    with a copy of the context, while new threads start without one.
+
+    Returns:
+        object
+            A token for reset_context to restore the previous context
+    """
+    unknown = set(fields) - FIELDS
+    if unknown:
+        raise TypeError("unknown context fields: %s" % ', '.join(sorted(unknown)))
+    current = _get()
+    if current:
+        merged = current.copy()
+        merged.update(fields)
+        fields = merged
+    return _set(fields)
+
+
+def reset_context(token):
+    "Restore the context from before the set_context call that returned token"
+    _reset(token)
+
+
+@contextmanager
+def request_context(**fields):
+    """Context manager that sets context fields for the code it wraps
+
+    Usage:
+        with errbit.request_context(request_url=request.url, params=lambda: dict(request.args)):
+            handle(request)
+    """
+    token = set_context(**fields)
+    try:
+        yield
+    finally:
+        reset_context(token)
+
+
+def apply_context(notice):
+    "Fill the fields of the notice that aren't set from the current context"
+    fields = _get()
+    if not fields:
+        return
+    for name, value in fields.items():
+        if getattr(notice, name):
+            continue
+        if callable(value):
+            try:
+                value = value()
+            except Exception as e:
+                # a broken callable shouldn't stop the error from being reported
+                value = "[error getting %s: %r]" % (name, e)
+        setattr(notice, name, value)
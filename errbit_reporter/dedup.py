@@ -0,0 +1,213 @@
+import copy
+import hashlib
+import re
+import threading
+from collections import deque
+
+from errbit_reporter._compat import monotonic, reset_after_fork
+from errbit_reporter.cache import LRUCache
+
+OCCURRENCES_KEY = 'occurrences'
+
+MESSAGE_VARIABLES = re.compile(r"""'[^']*'|"[^"]*"|\b0x[0-9a-fA-F]+\b|\d+""")
+
+
+def message_template(message):
+    "Replaces quoted strings and numbers in an error message with placeholders"
+    if not message:
+        return ''
+    return MESSAGE_VARIABLES.sub('?', message)
+
+
+def fingerprint(notice, frames=5):
+    """Identifies notices for the same error
+
+    Notices have the same fingerprint when they have the same error class,
+    the same error message apart from quoted strings and numbers, and the
+    same innermost backtrace frames.
+    """
+    parts = [notice.error_class or '', message_template(notice.error_message)]
+    for frame in notice.backtrace[-frames:] if frames else ():
+        parts.append('%s:%s:%s' % tuple(frame[:3]))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class _Occurrences(object):
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.count = 0
+        self.notice = None
+
+
+class Deduplicator(object):
+    """Collapses repeats of an error into a single follow-up notice
+
+    The first notice with a fingerprint is sent immediately. Notices with the
+    same fingerprint within the following window are counted instead of
+    sent, then the last of them is sent when the window ends with the count
+    stored in its cgi_data under the 'occurrences' key. Once started, a
+    background thread sends each follow-up as its window ends, otherwise
+    they are returned by the next call to filter or drain.
+
+    Parameters:
+        window : float, optional
+            Seconds during which repeats of an error are collapsed (the
+            default is 60 seconds)
+        max_entries : int, optional
+            Maximum number of fingerprints tracked, least recently seen
+            errors are forgotten first (the default is 1000)
+        frames : int, optional
+            Number of innermost backtrace frames in the fingerprint (the
+            default is 5)
+    """
+
+    def __init__(self, window=60.0, max_entries=1000, frames=5):
+        self.window = window
+        self.frames = frames
+        self._entries = LRUCache(max_entries)
+        self._windows = deque()
+        self._send = None
+        self._reset()
+        reset_after_fork(self)
+
+    def start(self, send):
+        """Send follow-up notices from a background thread as their windows end
+
+        Parameters:
+            send : callable
+                Called with each follow-up notice
+        """
+        with self._lock:
+            self._send = send
+            self._stopped = False
+            if self._windows:
+                self._ensure_thread()
+
+    def stop(self, timeout=None):
+        """Stop the background thread, leaving the remaining follow-ups to drain
+
+        Parameters:
+            timeout : float, optional
+                Seconds to wait for the thread to finish sending a follow-up
+                (the default is to wait until it has)
+        """
+        with self._lock:
+            self._stopped = True
+            self._changed.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def filter(self, notice, now=None):
+        """Decide what to send for a new notice
+
+        Returns:
+            list of errbit_reporter.Notice
+                Follow-up notices for windows that have ended, followed by the
+                notice itself if it isn't a repeat within its window
+        """
+        if now is None:
+            now = monotonic()
+        key = fingerprint(notice, self.frames)
+        with self._lock:
+            notices = self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                evicted = self._entries.set(key, _Occurrences(now))
+                self._windows.append((now + self.window, key))
+                if len(self._windows) > 2 * self._entries.maxsize:
+                    # windows of evicted fingerprints would otherwise stay
+                    # until they end, whatever max_entries is
+                    self._windows = deque(item for item in self._windows if self._is_current(*item))
+                if self._send is not None:
+                    self._ensure_thread()
+                if evicted is not None:
+                    self._add_follow_up(notices, evicted[1])
+                notices.append(notice)
+            else:
+                entry.count += 1
+                entry.notice = notice
+        return notices
+
+    def drain(self):
+        """Ends all the windows
+
+        Returns:
+            list of errbit_reporter.Notice
+                Follow-up notices for errors that had repeats
+        """
+        with self._lock:
+            entries = [entry for key, entry in self._entries.items()]
+            self._entries.clear()
+            self._windows.clear()
+        notices = []
+        for entry in entries:
+            self._add_follow_up(notices, entry)
+        return notices
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._stopped = False
+        self._thread = None
+
+    def _after_fork(self):
+        # the parent sends the follow-ups for the repeats it has counted, and
+        # the child's thread is started again by its next window
+        self._reset()
+        self._entries.clear()
+        self._windows.clear()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._send_follow_ups, name='errbit-dedup')
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self._changed.notify()
+
+    def _send_follow_ups(self):
+        while True:
+            with self._lock:
+                while True:
+                    if self._stopped:
+                        return
+                    if not self._windows:
+                        self._changed.wait()
+                        continue
+                    remaining = self._windows[0][0] - monotonic()
+                    if remaining > 0:
+                        self._changed.wait(remaining)
+                        continue
+                    notices = self._expire(monotonic())
+                    send = self._send
+                    break
+            for notice in notices:
+                try:
+                    send(notice)
+                except Exception:
+                    # the follow-up is lost, like a notice that failed to send,
+                    # but the thread keeps sending the others
+                    pass
+
+    def _expire(self, now):
+        notices = []
+        while self._windows and self._windows[0][0] <= now:
+            deadline, key = self._windows.popleft()
+            if self._is_current(deadline, key):
+                self._add_follow_up(notices, self._entries.pop(key))
+        return notices
+
+    def _is_current(self, deadline, key):
+        "Whether the window is that of the fingerprint's tracked entry"
+        entry = self._entries.peek(key)
+        return entry is not None and entry.started_at + self.window == deadline
+
+    def _add_follow_up(self, notices, entry):
+        if not entry.count:
+            return
+        notice = copy.copy(entry.notice)
+        notice.cgi_data = dict(notice.cgi_data)
+        notice.cgi_data[OCCURRENCES_KEY] = entry.count
+        notices.append(notice)
@@ -0,0 +1,270 @@
+import threading
+from collections import deque
+
+from errbit_reporter._compat import monotonic, reset_after_fork
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+
+class DeliveryError(Exception):
+    "Base class for errors reported through a NoticeFuture"
+
+
+class NoticeDropped(DeliveryError):
+    "The notice was discarded before it was sent to errbit"
+
+
+class DeliveryTimeout(DeliveryError):
+    "Waiting for the outcome of a notice timed out"
+
+
+class NoticeFuture(object):
+    """Handle for a notice that is delivered in the background
+
+    The result is the errbit_reporter.NoticeMetadata returned by errbit, or
+    the exception raised while trying to send the notice.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        "Returns True once the notice has been sent, failed or been dropped"
+        with self._condition:
+            return self._done
+
+    def result(self, timeout=None):
+        """Wait for the notice to be delivered and return its metadata
+
+        Raises the exception from the delivery attempt if it failed, or
+        DeliveryTimeout if it isn't done within timeout seconds.
+        """
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+    def exception(self, timeout=None):
+        "Wait for the notice to be delivered and return the exception it failed with"
+        with self._condition:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise DeliveryTimeout("notice wasn't delivered within %s seconds" % timeout)
+            return self._exception
+
+    def add_done_callback(self, fn):
+        "Call fn with this future once it is done (immediately if it already is)"
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _follow(self, other):
+        "Finish with the outcome of the done future other"
+        self._finish(other._result, other._exception)
+
+    def _finish(self, result, exception):
+        with self._condition:
+            if self._done:
+                return
+            self._result = result
+            self._exception = exception
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notify_all()
+        for callback in callbacks:
+            callback(self)
+
+
+class DeliveryQueue(object):
+    """Bounded queue of notices sent to errbit by background worker threads
+
+    Parameters:
+        maxsize : int, optional
+            Maximum number of notices waiting to be sent (the default is 1000)
+        workers : int, optional
+            Number of worker threads sending notices (the default is 1)
+        overflow : str, optional
+            What to do with a notice when the queue is full: DROP_NEWEST
+            discards it, DROP_OLDEST discards the oldest queued notice instead
+            and BLOCK waits up to block_timeout for room before discarding it
+            (the default is DROP_NEWEST)
+        block_timeout : float, optional
+            Seconds to wait for room in the queue with the BLOCK policy
+            (the default is 1 second)
+    """
+
+    def __init__(self, maxsize=1000, workers=1, overflow=DROP_NEWEST, block_timeout=1.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("unknown overflow policy %r" % (overflow,))
+        if maxsize < 1 or workers < 1:
+            raise ValueError("maxsize and workers must be positive")
+        self.maxsize = maxsize
+        self.workers = workers
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._closed = False
+        self._reset()
+        reset_after_fork(self)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a call to fn(*args, **kwargs) on a worker thread
+
+        Returns:
+            errbit_reporter.delivery.NoticeFuture
+                Resolved with the return value of fn, or with the outcome of
+                the NoticeFuture fn returns, or with NoticeDropped if the call
+                was discarded by the overflow policy.
+        """
+        return self._submit(fn, args, kwargs, self.overflow)
+
+    def submit_nowait(self, fn, *args, **kwargs):
+        """Queue a call like submit, without ever waiting for room in the queue
+
+        With the BLOCK overflow policy, a call that finds the queue full is
+        discarded like with DROP_NEWEST, so this can be called while holding
+        a lock, e.g. logging's handler lock.
+        """
+        overflow = DROP_NEWEST if self.overflow == BLOCK else self.overflow
+        return self._submit(fn, args, kwargs, overflow)
+
+    def _submit(self, fn, args, kwargs, overflow):
+        future = NoticeFuture()
+        item = (future, fn, args, kwargs)
+        dropped = None
+        with self._lock:
+            if self._closed:
+                dropped = future
+            elif len(self._items) >= self.maxsize:
+                if overflow == DROP_OLDEST:
+                    dropped = self._items.popleft()[0]
+                    self._unfinished -= 1
+                elif overflow == BLOCK:
+                    deadline = monotonic() + self.block_timeout
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            break
+                        self._not_full.wait(remaining)
+                    if len(self._items) >= self.maxsize or self._closed:
+                        dropped = future
+                else:
+                    dropped = future
+            if dropped is not future:
+                self._items.append(item)
+                self._unfinished += 1
+                self._ensure_workers()
+                self._not_empty.notify()
+            if dropped is not None:
+                self.dropped += 1
+        if dropped is not None:
+            reason = "delivery queue is closed" if self._closed else "delivery queue is full"
+            dropped.set_exception(NoticeDropped(reason))
+        return future
+
+    def flush(self, timeout=None):
+        """Wait until every queued notice has been sent
+
+        Returns:
+            bool
+                False if notices were still pending after timeout seconds
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._lock:
+            while self._unfinished:
+                if deadline is None:
+                    self._idle.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._idle.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """Stop accepting notices, send the queued ones and stop the workers
+
+        Returns:
+            bool
+                False if notices were still pending after timeout seconds
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+            threads = list(self._threads)
+        for thread in threads:
+            if deadline is None:
+                thread.join()
+            else:
+                thread.join(max(0, deadline - monotonic()))
+        with self._lock:
+            return not self._unfinished
+
+    def _reset(self):
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._unfinished = 0
+        self._threads = []
+
+    def _after_fork(self):
+        # notices queued in the parent are still sent by the parent, and
+        # workers are started again by the next submit
+        self._reset()
+
+    def _ensure_workers(self):
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name='errbit-delivery')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._items and not self._closed:
+                    self._not_empty.wait()
+                if not self._items:
+                    return
+                future, fn, args, kwargs = self._items.popleft()
+                self._not_full.notify()
+            try:
+                result = fn(*args, **kwargs)
+                if isinstance(result, NoticeFuture):
+                    # the notice was handed off, e.g. to be retried later
+                    result.add_done_callback(future._follow)
+                else:
+                    future.set_result(result)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._unfinished -= 1
+                    if not self._unfinished:
+                        self._idle.notify_all()
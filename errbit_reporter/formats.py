@@ -0,0 +1,114 @@
+import six
+
+from errbit_reporter import compression
+from errbit_reporter.notice import NoticeMetadata
+
+XML = 'xml'
+JSON = 'json'
+
+NOTICES_PATH = "/notifier_api/v2/notices/"
+NOTICE_HEADERS = (
+    ('Content-Type', 'text/xml'),
+    ('Accept', 'text/xml, application/xml'),
+)
+GZIP_NOTICE_HEADERS = NOTICE_HEADERS + (('Content-Encoding', 'gzip'),)
+
+JSON_NOTICES_PATH = "/api/v3/projects/%s/notices?key=%s"
+JSON_NOTICE_HEADERS = (
+    ('Content-Type', 'application/json'),
+    ('Accept', 'application/json'),
+)
+GZIP_JSON_NOTICE_HEADERS = JSON_NOTICE_HEADERS + (('Content-Encoding', 'gzip'),)
+
+
+class XmlFormat(object):
+    "Notices as xml for errbit's notifier v2 API"
+
+    headers = NOTICE_HEADERS
+    gzip_headers = GZIP_NOTICE_HEADERS
+
+    def path(self, api_key, project_id):
+        return NOTICES_PATH
+
+    def encode(self, notice):
+        return notice.serialize()
+
+    def iter_encode(self, notice):
+        return notice.iter_serialize()
+
+    def parse_response(self, config, body):
+        return NoticeMetadata.from_notice_xml(config, body)
+
+    def matches(self, payload):
+        return payload[:1] == b'<'
+
+
+class JsonFormat(object):
+    """Notices as json for the Airbrake v3 API, which errbit also accepts
+
+    The api key is sent in the query string instead of the notice.
+    """
+
+    headers = JSON_NOTICE_HEADERS
+    gzip_headers = GZIP_JSON_NOTICE_HEADERS
+
+    def path(self, api_key, project_id):
+        return JSON_NOTICES_PATH % (project_id or api_key, api_key)
+
+    def encode(self, notice):
+        return notice.serialize_json()
+
+    def iter_encode(self, notice):
+        yield notice.serialize_json()
+
+    def parse_response(self, config, body):
+        return NoticeMetadata.from_notice_json(config, body)
+
+    def matches(self, payload):
+        return payload[:1] == b'{'
+
+
+FORMATS = {
+    XML: XmlFormat(),
+    JSON: JsonFormat(),
+}
+
+
+def get(notice_format):
+    "The format for a Configuration's notice_format, which is a name or a format"
+    if isinstance(notice_format, six.string_types):
+        return FORMATS[notice_format]
+    return notice_format
+
+
+def for_payload(payload):
+    """The format of a request body from encode_notice, e.g. from the spool
+
+    Payloads that no format matches are assumed to be xml.
+    """
+    if compression.is_gzipped(payload):
+        payload = compression.peek(payload, 1)
+    for notice_format in FORMATS.values():
+        if notice_format.matches(payload):
+            return notice_format
+    return FORMATS[XML]
+
+
+def encode_notice(config, notice):
+    """Serialize a notice into a request body, compressed if configured
+
+    Returns:
+        (bytes, tuple of (str, str))
+            The body and the headers for the request
+    """
+    notice_format = get(config.notice_format)
+    if config.gzip_threshold is None:
+        return notice_format.encode(notice), notice_format.headers
+    body, compressed = compression.gzip_chunks(
+        notice_format.iter_encode(notice), config.gzip_threshold, config.gzip_level)
+    return body, notice_format.gzip_headers if compressed else notice_format.headers
+
+
+def payload_headers(notice_format, body):
+    "The request headers for a notice body from encode_notice"
+    return notice_format.gzip_headers if compression.is_gzipped(body) else notice_format.headers
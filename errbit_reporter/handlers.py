@@ -0,0 +1,116 @@
+import logging
+import sys
+
+from errbit_reporter.cache import LRUCache
+from errbit_reporter.context import apply_context
+from errbit_reporter.delivery import DeliveryQueue
+from errbit_reporter.notice import Notice
+from errbit_reporter.ratelimit import TokenBucket
+
+
+class ErrbitHandler(logging.Handler):
+    """Logging handler that notifies errbit of log records without blocking
+
+    A notice is built from each record, from its exc_info when it has one
+    and from the stack of the logging call otherwise, and handed off to a
+    bounded delivery queue, so emit never waits on errbit while the logging
+    lock is held. The client's delivery queue is used if it has one, and
+    notices that find it full are dropped even with the BLOCK overflow
+    policy.
+
+    Parameters:
+        client : errbit_reporter.Client
+            The client used to notify errbit
+        level : int, optional
+            Records below this level are ignored (the default is
+            logging.ERROR)
+        rate : float, optional
+            Notices per second allowed for each logger, beyond which records
+            are dropped (the default is 1)
+        burst : int, optional
+            Notices allowed in a burst for each logger (the default is 10)
+        max_loggers : int, optional
+            Number of loggers whose rate is tracked (the default is 1000)
+        maxsize : int, optional
+            Maximum number of notices waiting to be sent when the handler
+            has its own delivery queue, beyond which they are dropped (the
+            default is 1000)
+        timeout : int, optional
+            The timeout in seconds for the request to errbit (the default is
+            no timeout)
+        close_timeout : float, optional
+            Seconds close waits for the queued notices to be sent, which
+            logging.shutdown calls at exit, or None to wait until they are
+            (the default is 5 seconds)
+    """
+
+    def __init__(self, client, level=logging.ERROR, rate=1.0, burst=10, max_loggers=1000, maxsize=1000,
+                 timeout=None, close_timeout=5.0):
+        logging.Handler.__init__(self, level)
+        self.client = client
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.close_timeout = close_timeout
+        self.dropped = 0
+        self.delivery = None
+        if client.delivery is None:
+            self.delivery = DeliveryQueue(maxsize=maxsize)
+        self._buckets = LRUCache(max_loggers)
+
+    def emit(self, record):
+        # called with the handler's lock held, which protects the buckets
+        if not self.client.config.errbit_url:
+            return
+        bucket = self._buckets.get(record.name)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets.set(record.name, bucket)
+        if not bucket.consume():
+            self.dropped += 1
+            return
+        try:
+            notice = self.notice(record)
+            if self.delivery is None:
+                self.client.queue_notice(notice, self.timeout)
+            else:
+                notice._detach()
+                self.delivery.submit_nowait(self.client.queue_notice, notice, self.timeout)
+        except Exception:
+            self.handleError(record)
+
+    def notice(self, record):
+        "Build the notice for a log record, filling the rest from the request context"
+        config = self.client.config
+        message = record.getMessage()
+        if record.exc_info and record.exc_info[1] is not None:
+            notice = Notice.from_exception(config, record.exc_info)
+        else:
+            notice = Notice(config, record.levelname, message, _logging_frame(record))
+        notice.component = record.name
+        notice.action = record.funcName
+        notice.params = {
+            'message': message,
+            'level': record.levelname,
+            'logger': record.name,
+        }
+        apply_context(notice)
+        return notice
+
+    def close(self):
+        "Send the queued notices and stop the handler's delivery queue"
+        if self.delivery is not None:
+            self.delivery.close(self.close_timeout)
+        logging.Handler.close(self)
+
+
+def _logging_frame(record):
+    "The frame of the logging call for record, or the caller of emit if it isn't found"
+    frame = sys._getframe(2)
+    caller = frame
+    while caller is not None:
+        code = caller.f_code
+        if caller.f_lineno == record.lineno and code.co_name == record.funcName:
+            return caller
+        caller = caller.f_back
+    return frame
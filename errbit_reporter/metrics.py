@@ -0,0 +1,180 @@
+import math
+import threading
+
+from errbit_reporter._compat import reset_after_fork
+
+# timings in seconds
+CAPTURE_SECONDS = 'capture.seconds'
+SERIALIZE_SECONDS = 'serialize.seconds'
+SEND_SECONDS = 'send.seconds'
+PARSE_SECONDS = 'parse.seconds'
+# sizes in bytes
+PAYLOAD_BYTES = 'payload.bytes'
+# counts of notices
+SENT = 'notices.sent'
+FAILED = 'notices.failed'
+SPOOLED = 'notices.spooled'
+SPOOL_DROPPED = 'notices.spool_dropped'
+RETRIED = 'notices.retried'
+SHORT_CIRCUITED = 'notices.short_circuited'
+RATE_LIMITED = 'notices.rate_limited'
+DEDUPLICATED = 'notices.deduplicated'
+QUEUE_DROPPED = 'notices.queue_dropped'
+# gauges
+QUEUE_DEPTH = 'queue.depth'
+SPOOL_BYTES = 'spool.bytes'
+RETRY_PENDING = 'retry.pending'
+
+
+class Metrics(object):
+    """Receives measurements of the reporter's own work and ignores them
+
+    The default metrics of a Client. Subclasses override increment, observe
+    and gauge to record the counts, the timings and sizes, and the current
+    levels named by the constants in this module.
+    """
+
+    def increment(self, name, value=1):
+        "Add value to the counter name"
+
+    def observe(self, name, value):
+        "Record a timing in seconds or a size in bytes for the histogram name"
+
+    def gauge(self, name, value):
+        "Set the current value of name, e.g. the length of a queue"
+
+
+class CallbackMetrics(Metrics):
+    """Passes each measurement to a callback, e.g. to export it to statsd
+
+    Parameters:
+        callback : callable
+            Called with the kind of measurement ('increment', 'observe' or
+            'gauge'), its name and its value
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def increment(self, name, value=1):
+        self.callback('increment', name, value)
+
+    def observe(self, name, value):
+        self.callback('observe', name, value)
+
+    def gauge(self, name, value):
+        self.callback('gauge', name, value)
+
+
+class Histogram(object):
+    """Distribution of observed values in logarithmic buckets
+
+    Each bucket covers values within a factor of 2**(1/8) of each other, so
+    percentiles are within about 5% of the observed values whatever their
+    unit.
+    """
+
+    BUCKETS_PER_DOUBLING = 8
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        bucket = int(math.floor(math.log(value, 2) * self.BUCKETS_PER_DOUBLING)) if value > 0 else None
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction):
+        "Estimate of the value below which the fraction of observations fall"
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self._buckets, key=lambda b: float('-inf') if b is None else b):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                if bucket is None:
+                    return min(self.min, 0)
+                upper = 2 ** (float(bucket + 1) / self.BUCKETS_PER_DOUBLING)
+                return max(self.min, min(upper, self.max))
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+
+class InMemoryMetrics(Metrics):
+    """Aggregates the measurements in memory to be read with snapshot
+
+    Counters are summed, the last value of each gauge is kept and timings
+    and sizes are kept in histograms.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        reset_after_fork(self)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(value)
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self):
+        """The measurements so far
+
+        Returns:
+            dict
+                'counters' and 'gauges' dicts of values by name, and a
+                'histograms' dict of the count, sum, min, max, p50, p90 and
+                p99 of each histogram by name
+        """
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'histograms': dict((name, histogram.summary())
+                                   for name, histogram in self._histograms.items()),
+            }
+
+    def reset(self):
+        "Forget the measurements so far"
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
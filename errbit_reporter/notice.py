@@ -1,16 +1,195 @@
 import sys
 import types
-import traceback
 import re
 import os.path
-from xml.etree import cElementTree as ET
+import threading
 
 import six
 from six.moves import urllib
 
+from errbit_reporter import xmlwriter
+from errbit_reporter._compat import monotonic, reset_after_fork
+from errbit_reporter.cache import LRUCache
+
+_path_lock = threading.Lock()
+_abspaths = LRUCache(1024)
+_project_paths = LRUCache(1024)
+# shared backtrace entries, by (filename, line number, function name) and by
+# the same with the code's filename for entries extracted from frames
+_frames = LRUCache(8192)
+_code_frames = LRUCache(8192)
+
+
+class _PathLockReset(object):
+    "Replaces _path_lock after a fork, since modules can't be weakly referenced on python 2"
+
+    def _after_fork(self):
+        # another thread of the parent could have been holding the lock
+        global _path_lock
+        _path_lock = threading.Lock()
+
+
+_path_lock_reset = _PathLockReset()
+reset_after_fork(_path_lock_reset)
+
+
+def _abspath(filename):
+    "os.path.abspath for code filenames, cached since they are few and repeat"
+    with _path_lock:
+        path = _abspaths.get(filename)
+    if path is None:
+        path = os.path.abspath(filename)
+        with _path_lock:
+            _abspaths.set(filename, path)
+    return path
+
+
+def _project_path(project_root, filename):
+    "Replaces the project root at the start of filename with [PROJECT_ROOT]/"
+    key = (project_root, filename)
+    with _path_lock:
+        path = _project_paths.get(key)
+    if path is None:
+        path = filename
+        if filename.startswith(project_root):
+            path = "[PROJECT_ROOT]/" + filename[len(project_root):]
+        with _path_lock:
+            _project_paths.set(key, path)
+    return path
+
+
+def _capture_stack(frame):
+    "Returns the (code, line number) of frame and its callers, outermost first"
+    frames = []
+    while frame is not None:
+        frames.append((frame.f_code, frame.f_lineno))
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _traceback_stack(tb):
+    "Returns the (code, line number) of each level of a traceback, outermost first"
+    frames = []
+    while tb is not None:
+        frames.append((tb.tb_frame.f_code, tb.tb_lineno))
+        tb = tb.tb_next
+    return frames
+
+
+def _intern_frames(frames):
+    """The shared backtrace entries for (filename, line number, function name, ...) sequences
+
+    Notices with the same frames share the same entry tuples, whose text is
+    None instead of the source code.
+    """
+    entries = []
+    with _path_lock:
+        for frame in frames:
+            key = (frame[0], frame[1], frame[2])
+            entry = _frames.get(key)
+            if entry is None:
+                entry = key + (None,)
+                _frames.set(key, entry)
+            entries.append(entry)
+    return entries
+
+
+def _extract_frames(source):
+    "Builds the backtrace entries from a traceback or from _capture_stack"
+    if isinstance(source, types.TracebackType):
+        source = _traceback_stack(source)
+    keys = [(code.co_filename, lineno, code.co_name) for code, lineno in source]
+    with _path_lock:
+        entries = [_code_frames.get(key) for key in keys]
+    for i, entry in enumerate(entries):
+        if entry is None:
+            filename, lineno, function_name = keys[i]
+            entry = entries[i] = _intern_frames([(_abspath(filename), lineno, function_name)])[0]
+            with _path_lock:
+                _code_frames.set(keys[i], entry)
+    return entries
+
+
+TRUNCATED_TAG = '_truncated'
+DEPTH_EXCEEDED = '[max depth exceeded]'
+
+
+class _Marker(str):
+    "Truncation marker text, which isn't itself subject to the budget"
+
+
+class _PayloadBudget(object):
+    """Limits on the params, session and cgi_data of a notice
+
+    Tracks the configured limits while the request data is serialized, so
+    that values beyond them are replaced with truncation markers.
+    """
+
+    def __init__(self, config):
+        self.max_depth = config.max_depth
+        self.max_keys = config.max_keys
+        self.max_list_items = config.max_list_items
+        self.max_string_length = config.max_string_length
+        self.remaining = config.max_payload_bytes
+
+    def too_deep(self, depth):
+        return self.max_depth is not None and depth > self.max_depth
+
+    def charge(self, tag):
+        if self.remaining is not None:
+            self.remaining -= len(tag)
+
+    def children(self, value):
+        "Yields the (tag, value) children of a dict or list until a limit is reached"
+        if isinstance(value, dict):
+            items = six.iteritems(value)
+            limit = self.max_keys
+            marker = (TRUNCATED_TAG, "[%d more keys]")
+        else:
+            items = (('item', item) for item in value)
+            limit = self.max_list_items
+            marker = ('item', "[%d more items]")
+        count = 0
+        for tag, item in items:
+            if count == limit or (self.remaining is not None and self.remaining <= 0):
+                yield marker[0], _Marker(marker[1] % (len(value) - count))
+                return
+            yield tag, item
+            count += 1
+
+    def text(self, tag, value):
+        "Returns the text for a leaf value, truncated to the remaining budget"
+        if isinstance(value, _Marker):
+            return value
+        text = str(value)
+        limit = self.max_string_length
+        if self.remaining is not None:
+            self.remaining -= len(tag)
+            if limit is None or self.remaining < limit:
+                limit = max(self.remaining, 0)
+        if limit is not None and len(text) > limit:
+            text = text[:limit] + "... [%d more characters]" % (len(text) - limit)
+        if self.remaining is not None:
+            self.remaining -= len(text)
+        return text
+
 
 class Notice(object):
-    """The description of an exception that can be sent to errbit"""
+    """The description of an exception that can be sent to errbit
+
+    The backtrace is a list of (filename, line number, function name, text)
+    tuples, like those from traceback.extract_tb. The text is never sent, so
+    it is always None, and the tuples are shared between notices with the
+    same frames. When it is given as a traceback object or a frame, whose
+    stack is captured, or captured from the current stack when omitted, the
+    entries are only built when first needed.
+    """
+
+    __slots__ = (
+        'config', '_error_class', '_error_message', '_backtrace', '_backtrace_source',
+        'request_url', 'component', 'action', 'params', 'session', 'cgi_data',
+    )
 
     INVALID_TAG_CHARS = re.compile("[^a-zA-Z0-9_-]")
 
@@ -20,8 +199,11 @@ class Notice(object):
         self.error_class = error_class
         self.error_message = error_message
         if backtrace is None:
-            backtrace = traceback.extract_stack()
-        self.backtrace = backtrace
+            self._backtrace = None
+            # includes this frame, like traceback.extract_stack() did
+            self._backtrace_source = _capture_stack(sys._getframe())
+        else:
+            self.backtrace = backtrace
         self.request_url = None
         self.component = None
         self.action = None
@@ -51,18 +233,37 @@ class Notice(object):
 
     @property
     def backtrace(self):
+        if self._backtrace is None:
+            self._backtrace = _extract_frames(self._backtrace_source)
+            self._backtrace_source = None
         return self._backtrace
 
     @backtrace.setter
     def backtrace(self, value):
+        self._backtrace_source = None
         if isinstance(value, types.TracebackType):
-            value = traceback.extract_tb(value)
-            value = [(os.path.abspath(filename), lineno, func_name, text)
-                     for filename, lineno, func_name, text in value]
+            self._backtrace_source = value
+            value = None
+        elif isinstance(value, types.FrameType):
+            self._backtrace_source = _capture_stack(value)
+            value = None
         elif value is None:
             value = []
+        else:
+            value = _intern_frames(value)
         self._backtrace = value
 
+    def _detach(self):
+        """Builds the backtrace before the notice waits to be sent
+
+        The notice then no longer references the frames of a traceback, so
+        it doesn't keep their local variables alive, and holds just the
+        backtrace entries shared with other notices, which take less memory
+        than the code and line number of each frame.
+        """
+        if self._backtrace is None:
+            self.backtrace
+
     @classmethod
     def from_exception(cls, config, exc_info=None):
         "Creates a notice from an exception"
@@ -75,6 +276,64 @@ class Notice(object):
 
     def serialize(self):
         "Serialize the notice to xml which errbit accepts for notice creation"
+        head, tail = self.config.xml_fragments
+        return b''.join((head, xmlwriter.encode(''.join(self._iter_xml())), tail))
+
+    def iter_serialize(self):
+        "Serialize the notice to xml as a sequence of utf-8 encoded chunks"
+        head, tail = self.config.xml_fragments
+        yield head
+        for text in self._iter_xml():
+            yield xmlwriter.encode(text)
+        yield tail
+
+    def write(self, stream):
+        "Serialize the notice to xml into a writable binary file-like object"
+        for chunk in self.iter_serialize():
+            stream.write(chunk)
+
+    def serialize_json(self):
+        "Serialize the notice to json which errbit accepts through the Airbrake v3 API"
+        import json
+
+        config = self.config
+        budget = _PayloadBudget(config)
+        payload = {
+            'errors': [{
+                'type': self.error_class,
+                'message': self.error_message,
+                'backtrace': [
+                    {'file': filename, 'line': line_number, 'function': function_name}
+                    for filename, line_number, function_name in self._backtrace_lines()
+                ],
+            }],
+            'context': {
+                'notifier': {
+                    'name': config.notifier_name,
+                    'version': config.notifier_version,
+                    'url': config.notifier_url,
+                },
+                'environment': config.environment_name,
+                'hostname': config.server_name,
+                'rootDirectory': config.project_root,
+                'url': self.request_url,
+                'component': self.component,
+                'action': self.action,
+            },
+            'params': self._json_value('params', self.params, budget),
+            'session': self._json_value('session', self.session, budget),
+            'environment': self._json_value('cgi-data', self.cgi_data, budget),
+        }
+        return json.dumps(payload, separators=(',', ':')).encode('ascii')
+
+    def serialize_tree(self):
+        """Serialize the notice by building an ElementTree
+
+        Reference implementation for serialize, which writes the same
+        bytes without building a tree.
+        """
+        from xml.etree import cElementTree as ET
+
         root = ET.Element('notice', version="2.4")
 
         ET.SubElement(root, 'api-key').text = self.config.api_key
@@ -88,19 +347,20 @@ class Notice(object):
         ET.SubElement(error, 'class').text = self.error_class
         ET.SubElement(error, 'message').text = self.error_message
         backtrace = ET.SubElement(error, 'backtrace')
-        for filename, line_number, function_name, text in reversed(self.backtrace):
-            if filename.startswith(self.config.project_root):
-                filename = "[PROJECT_ROOT]/" + filename[len(self.config.project_root):]
+        for filename, line_number, function_name in self._backtrace_lines():
+            # attributes are passed in sorted order since older versions of
+            # ElementTree sort them and newer ones keep the given order
             ET.SubElement(
-                backtrace, 'line', number=str(line_number), file=filename, method=function_name)
+                backtrace, 'line', file=filename, method=function_name, number=str(line_number))
 
         request = ET.SubElement(root, 'request')
         ET.SubElement(request, 'url').text = self.request_url
         ET.SubElement(request, 'component').text = self.component
         ET.SubElement(request, 'action').text = self.action
-        self._add_xml_dict(ET.SubElement(request, 'params'), self.params)
-        self._add_xml_dict(ET.SubElement(request, 'session'), self.session)
-        self._add_xml_dict(ET.SubElement(request, 'cgi-data'), self.cgi_data)
+        budget = _PayloadBudget(self.config)
+        self._add_xml_value(ET.SubElement(request, 'params'), self.params, budget)
+        self._add_xml_value(ET.SubElement(request, 'session'), self.session, budget)
+        self._add_xml_value(ET.SubElement(request, 'cgi-data'), self.cgi_data, budget)
 
         server_env = ET.SubElement(root, 'server-environment')
         ET.SubElement(
@@ -116,6 +376,47 @@ class Notice(object):
         buffer.close()
         return xml_string
 
+    def _backtrace_lines(self):
+        project_root = self.config.project_root
+        for filename, line_number, function_name, text in reversed(self.backtrace):
+            yield _project_path(project_root, filename), line_number, function_name
+
+    def _iter_xml(self):
+        "Yields the xml text between the config's xml_fragments"
+        element = xmlwriter.element
+        escape_attrib = xmlwriter.escape_attrib
+
+        parts = [
+            '<error>',
+            element('class', self.error_class),
+            element('message', self.error_message),
+        ]
+        lines = [
+            '<line file="%s" method="%s" number="%s" />' % (
+                escape_attrib(filename), escape_attrib(function_name), escape_attrib(str(line_number)))
+            for filename, line_number, function_name in self._backtrace_lines()
+        ]
+        if lines:
+            parts.append('<backtrace>')
+            parts.extend(lines)
+            parts.append('</backtrace>')
+        else:
+            parts.append('<backtrace />')
+        parts.append('</error>')
+        yield ''.join(parts)
+
+        parts = [
+            '<request>',
+            element('url', self.request_url),
+            element('component', self.component),
+            element('action', self.action),
+        ]
+        budget = _PayloadBudget(self.config)
+        for tag, args in (('params', self.params), ('session', self.session), ('cgi-data', self.cgi_data)):
+            self._write_xml_value(parts.append, tag, args, budget)
+            yield ''.join(parts)
+            parts = []
+
     def _sanitize_tag(self, tag):
         "Sanitize tag string to avoid xml injection from user supplied params"
         if not tag:
@@ -125,53 +426,149 @@ class Notice(object):
             tag[0] = "_"
         return tag
 
-    def _add_xml_dict(self, parent, args):
-        for name, value in six.iteritems(args):
-            child = ET.SubElement(parent, name)
-            self._add_xml_value(child, value)
+    def _add_xml_value(self, parent, value, budget, depth=0):
+        from xml.etree import cElementTree as ET
 
-    def _add_xml_value(self, parent, value):
-        if isinstance(value, dict):
-            self._add_xml_dict(parent, value)
-        elif isinstance(value, list):
-            for item in value:
-                child = ET.SubElement(parent, 'item')
-                self._add_xml_value(child, item)
+        if isinstance(value, (dict, list)):
+            if value and budget.too_deep(depth):
+                parent.text = DEPTH_EXCEEDED
+                return
+            budget.charge(parent.tag)
+            for tag, item in budget.children(value):
+                self._add_xml_value(ET.SubElement(parent, tag), item, budget, depth + 1)
         else:
-            parent.text = str(value)
+            parent.text = budget.text(parent.tag, value)
+
+    def _json_value(self, tag, value, budget, depth=0):
+        if isinstance(value, (dict, list)):
+            if value and budget.too_deep(depth):
+                return DEPTH_EXCEEDED
+            budget.charge(tag)
+            if isinstance(value, dict):
+                return dict((str(name), self._json_value(str(name), item, budget, depth + 1))
+                            for name, item in budget.children(value))
+            return [self._json_value(name, item, budget, depth + 1) for name, item in budget.children(value)]
+        return budget.text(tag, value)
+
+    def _write_xml_value(self, write, tag, value, budget, depth=0):
+        if isinstance(value, (dict, list)):
+            if value and budget.too_deep(depth):
+                write(xmlwriter.element(tag, DEPTH_EXCEEDED))
+                return
+            budget.charge(tag)
+            if not value:
+                write("<%s />" % tag)
+                return
+            write("<%s>" % tag)
+            for name, item in budget.children(value):
+                self._write_xml_value(write, name, item, budget, depth + 1)
+            write("</%s>" % tag)
+        else:
+            write(xmlwriter.element(tag, budget.text(tag, value)))
+
+
+def _metadata_field(name):
+    "Property for a NoticeMetadata field that parses the response on first use"
+    def get(self):
+        if self._body is not None:
+            self._parse()
+        return getattr(self, name)
+
+    def set(self, value):
+        if self._body is not None:
+            self._parse()
+        setattr(self, name, value)
+
+    return property(get, set)
 
 
 class NoticeMetadata(object):
     """Metadata that returned by errbit that identifies a notice
 
     Can be used to get the url to see the error page for the notice in errbit.
+    When created from errbit's response, the response is only parsed once
+    one of its fields is first used. The json response of the Airbrake v3
+    API only has the id and the url.
     """
 
+    __slots__ = (
+        'config', '_body', '_json', '_url', '_on_parse',
+        '_id', '_err_id', '_problem_id', '_app_id', '_created_at', '_updated_at',
+    )
+
+    FIELDS = (
+        ('_id', './_id'),
+        ('_err_id', './err-id'),
+        ('_problem_id', './problem-id'),
+        ('_app_id', './app-id'),
+        ('_created_at', './created-at'),
+        ('_updated_at', './updated-at'),
+    )
+
     def __init__(self, config, id, err_id, problem_id, app_id, created_at, updated_at):
         self.config = config
-        self.id = id
-        self.err_id = err_id
-        self.problem_id = problem_id
-        self.app_id = app_id
-        self.created_at = created_at
-        self.updated_at = updated_at
+        self._body = None
+        self._json = False
+        self._url = None
+        # called with the seconds spent parsing the response
+        self._on_parse = None
+        self._id = id
+        self._err_id = err_id
+        self._problem_id = problem_id
+        self._app_id = app_id
+        self._created_at = created_at
+        self._updated_at = updated_at
+
+    id = _metadata_field('_id')
+    err_id = _metadata_field('_err_id')
+    problem_id = _metadata_field('_problem_id')
+    app_id = _metadata_field('_app_id')
+    created_at = _metadata_field('_created_at')
+    updated_at = _metadata_field('_updated_at')
 
     @classmethod
     def from_notice_xml(cls, config, body):
-        "Extracts the metadata from the response body of a notify request"
-        tree = ET.fromstring(body)
+        """Metadata from the response body of a notify request
+
+        The body isn't parsed until a field is used, so errors in it are
+        raised from the field access.
+        """
+        metadata = cls(config, None, None, None, None, None, None)
+        metadata._body = body
+        return metadata
 
-        id = tree.findtext('./_id')
-        err_id = tree.findtext('./err-id')
-        problem_id = tree.findtext('./problem-id')
-        app_id = tree.findtext('./app-id')
-        created_at = tree.findtext('./created-at')
-        updated_at = tree.findtext('./updated-at')
+    @classmethod
+    def from_notice_json(cls, config, body):
+        "Metadata from the response body of an Airbrake v3 API request, parsed when first used"
+        metadata = cls.from_notice_xml(config, body)
+        metadata._json = True
+        return metadata
+
+    def _parse(self):
+        started = monotonic()
+        if self._json:
+            import json
+
+            response = json.loads(self._body.decode('utf-8'))
+            self._id = response.get('id')
+            self._url = response.get('url')
+        else:
+            from xml.etree import cElementTree as ET
 
-        return cls(config, id, err_id, problem_id, app_id, created_at, updated_at)
+            tree = ET.fromstring(self._body)
+            for name, path in self.FIELDS:
+                setattr(self, name, tree.findtext(path))
+        self._body = None
+        if self._on_parse is not None:
+            self._on_parse(monotonic() - started)
+            self._on_parse = None
 
     @property
     def url(self):
         "Returns the url that shows the notice on errbit"
+        if self._body is not None:
+            self._parse()
+        if self._url is not None:
+            return self._url
         path = "/apps/%s/errs/%s/notices/%s" % (self.app_id, self.problem_id, self.id)
         return urllib.parse.urljoin(self.config.errbit_url, path)
@@ -0,0 +1,184 @@
+from __future__ import division
+
+import random
+import threading
+
+from errbit_reporter._compat import monotonic, reset_after_fork
+from errbit_reporter.cache import LRUCache
+from errbit_reporter.dedup import fingerprint
+
+DROPPED_SAMPLED = 'sampled'
+DROPPED_FINGERPRINT_RATE = 'fingerprint_rate'
+DROPPED_CLASS_RATE = 'class_rate'
+DROPPED_RATE = 'rate'
+
+
+class TokenBucket(object):
+    """Allows rate events per second on average, with bursts of up to burst events
+
+    It isn't thread-safe, so callers that share it between threads need to
+    hold a lock around its use.
+    """
+
+    def __init__(self, rate, burst=None, now=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self.tokens = self.burst
+        self.updated_at = now
+
+    def consume(self, now=None):
+        "Take a token if one is available, returning whether it was"
+        if now is None:
+            now = monotonic()
+        if self.updated_at is None:
+            self.updated_at = now
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class RateLimiter(object):
+    """Decides which notices are sent when errors happen at a high rate
+
+    A notice is first sampled with the rate for its error class, then has
+    to get a token from the bucket for its fingerprint, the bucket for its
+    error class and the global bucket, for those that are configured.
+
+    Parameters:
+        rate : float, optional
+            Notices per second allowed across all errors (the default is no
+            global limit)
+        burst : int, optional
+            Notices allowed in a burst by the global bucket (the default is
+            the rate, or 1 if the rate is lower)
+        per_class_rate : float, optional
+            Notices per second allowed for each error class
+        per_class_burst : int, optional
+            Burst size for the per error class buckets
+        per_fingerprint_rate : float, optional
+            Notices per second allowed for each error fingerprint, see
+            errbit_reporter.dedup.fingerprint
+        per_fingerprint_burst : int, optional
+            Burst size for the per fingerprint buckets
+        sample_rates : dict of str, float pairs, optional
+            Fraction of notices of an error class that are kept
+        default_sample_rate : float, optional
+            Fraction kept for error classes not in sample_rates (the default
+            is 1, which keeps all of them)
+        adaptive_target : float, optional
+            Notices per second above which the sample rates are lowered in
+            proportion to the observed rate of notices (the default is to
+            keep the sample rates fixed)
+        max_buckets : int, optional
+            Maximum number of per class and per fingerprint buckets kept,
+            least recently used ones are forgotten first (the default is 1000)
+    """
+
+    def __init__(self, rate=None, burst=None, per_class_rate=None, per_class_burst=None,
+                 per_fingerprint_rate=None, per_fingerprint_burst=None, sample_rates=None,
+                 default_sample_rate=1.0, adaptive_target=None, max_buckets=1000):
+        self.per_class_rate = per_class_rate
+        self.per_class_burst = per_class_burst
+        self.per_fingerprint_rate = per_fingerprint_rate
+        self.per_fingerprint_burst = per_fingerprint_burst
+        self.sample_rates = dict(sample_rates or {})
+        self.default_sample_rate = default_sample_rate
+        self.adaptive_target = adaptive_target
+        self.random = random.random
+
+        self.allowed = 0
+        self.dropped = {}
+        self.dropped_by_class = {}
+
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(rate, burst) if rate is not None else None
+        self._class_buckets = LRUCache(max_buckets)
+        self._fingerprint_buckets = LRUCache(max_buckets)
+        self._window_start = None
+        self._window_count = 0
+        self._observed_rate = 0.0
+        reset_after_fork(self)
+
+    @property
+    def observed_rate(self):
+        "Notices per second seen during the last full second"
+        return self._observed_rate
+
+    def allow(self, notice, now=None):
+        "Returns whether the notice should be sent, counting it as dropped if not"
+        if now is None:
+            now = monotonic()
+        error_class = notice.error_class
+        with self._lock:
+            self._observe(now)
+            reason = None
+            if not self._sampled(error_class):
+                reason = DROPPED_SAMPLED
+            elif (self.per_fingerprint_rate is not None and not self._consume(
+                    self._fingerprint_buckets, fingerprint(notice), self.per_fingerprint_rate,
+                    self.per_fingerprint_burst, now)):
+                reason = DROPPED_FINGERPRINT_RATE
+            elif (self.per_class_rate is not None and not self._consume(
+                    self._class_buckets, error_class, self.per_class_rate, self.per_class_burst, now)):
+                reason = DROPPED_CLASS_RATE
+            elif self._bucket is not None and not self._bucket.consume(now):
+                reason = DROPPED_RATE
+
+            if reason is None:
+                self.allowed += 1
+                return True
+            self.dropped[reason] = self.dropped.get(reason, 0) + 1
+            self.dropped_by_class[error_class] = self.dropped_by_class.get(error_class, 0) + 1
+            return False
+
+    def stats(self):
+        """Counts of the notices allowed and dropped so far
+
+        Returns:
+            dict
+                'allowed' count, 'dropped' counts by reason, 'dropped_by_class'
+                counts by error class and the 'observed_rate'
+        """
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'dropped': dict(self.dropped),
+                'dropped_by_class': dict(self.dropped_by_class),
+                'observed_rate': self._observed_rate,
+            }
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def _observe(self, now):
+        if self._window_start is None:
+            self._window_start = now
+        elapsed = now - self._window_start
+        if elapsed >= 1:
+            # windows without notices count as a rate of 0
+            self._observed_rate = self._window_count / elapsed if elapsed < 2 else 0.0
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+
+    def _sampled(self, error_class):
+        sample_rate = self.sample_rates.get(error_class, self.default_sample_rate)
+        if self.adaptive_target is not None:
+            observed = max(self._observed_rate, self._window_count)
+            if observed > self.adaptive_target:
+                sample_rate *= self.adaptive_target / observed
+        if sample_rate >= 1:
+            return True
+        return sample_rate > 0 and self.random() < sample_rate
+
+    def _consume(self, buckets, key, rate, burst, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst, now)
+            buckets.set(key, bucket)
+        return bucket.consume(now)
@@ -0,0 +1,322 @@
+"""Local relay that forwards notices from many processes to errbit
+
+The errbit-relay command listens on a unix datagram socket or a localhost
+UDP port for notices sent by Clients using a RelayClient transport, and
+forwards them to errbit over a few persistent connections.
+"""
+import argparse
+import errno
+import hashlib
+import os
+import signal
+import socket
+import threading
+from collections import deque
+
+from six.moves import urllib
+
+from errbit_reporter._compat import monotonic
+from errbit_reporter.cache import LRUCache
+from errbit_reporter import formats
+from errbit_reporter.transport import PooledTransport, is_transient_error
+
+DEFAULT_ADDRESS = 'unix:/tmp/errbit-relay.sock'
+MAX_DATAGRAM = 65536 * 4
+DROPPED_ERRNOS = frozenset([errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS, errno.EMSGSIZE,
+                            errno.ENOENT, errno.ECONNREFUSED])
+
+
+def parse_address(address):
+    """Parse 'unix:/path/to/socket' or 'udp:host:port'
+
+    Returns:
+        (int, str or (str, int))
+            The socket family and the address to bind or send to
+    """
+    scheme, _, rest = address.partition(':')
+    if scheme == 'unix' and rest:
+        return socket.AF_UNIX, rest
+    if scheme == 'udp' and rest:
+        host, _, port = rest.rpartition(':')
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    raise ValueError("relay address must be unix:PATH or udp:HOST:PORT, got %r" % (address,))
+
+
+class RelayClient(object):
+    """Transport that hands notices to a local errbit-relay without waiting
+
+    Each notice is a single non-blocking datagram, so sending never waits
+    on errbit or on the relay. Notices are dropped, and counted in dropped,
+    if the relay isn't running, isn't keeping up or the notice is larger
+    than a datagram. Since errbit's response isn't waited for, send_notice
+    returns None.
+
+    Parameters:
+        address : str, optional
+            'unix:PATH' or 'udp:HOST:PORT' the relay listens on (the
+            default is 'unix:/tmp/errbit-relay.sock')
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS):
+        self.family, self.address = parse_address(address)
+        self.dropped = 0
+        self._socket = None
+
+    def post(self, url, body, headers, timeout=None, read_response=True):
+        "Send the notice body to the relay, url and headers are up to the relay"
+        sock = self._socket
+        if sock is None:
+            sock = self._socket = socket.socket(self.family, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+        try:
+            sock.sendto(body, self.address)
+        except socket.error as e:
+            if e.errno not in DROPPED_ERRNOS:
+                raise
+            self.dropped += 1
+        return None
+
+    def close(self):
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            sock.close()
+
+
+class RelayServer(object):
+    """Receives notices from RelayClients and forwards them to errbit
+
+    Notices wait in a bounded queue, which drops the oldest notices when
+    full, and are forwarded in batches by a few threads sharing a pool of
+    persistent connections. Notices that errbit fails to accept are retried
+    with backoff, and identical notices received within the dedup window
+    are only forwarded once.
+
+    Parameters:
+        listen : str
+            'unix:PATH' or 'udp:HOST:PORT' to listen on
+        errbit_url : str
+            protocol and host of the errbit server
+        max_queue : int, optional
+            Maximum number of notices waiting to be forwarded (the default is
+            10000)
+        concurrency : int, optional
+            Number of notices forwarded at the same time (the default is 4)
+        batch_size : int, optional
+            Notices a forwarding thread takes from the queue at once (the
+            default is 100)
+        dedup_window : float, optional
+            Seconds during which identical notices are dropped (the default is
+            no deduplication)
+        timeout : float, optional
+            Timeout in seconds for each request to errbit (the default is 10)
+        max_backoff : float, optional
+            Upper bound in seconds for the wait after errbit fails (the
+            default is 60)
+        api_key : str, optional
+            Api key for json notices, which unlike xml notices don't contain
+            it (the default is to reject json notices)
+        project_id : str, optional
+            Project id in the url for json notices (the default is the api key)
+    """
+
+    def __init__(self, listen, errbit_url, max_queue=10000, concurrency=4, batch_size=100,
+                 dedup_window=None, timeout=10, max_backoff=60, api_key=None, project_id=None):
+        self.listen = listen
+        self.urls = {}
+        for notice_format in formats.FORMATS.values():
+            if api_key is not None or notice_format is formats.FORMATS[formats.XML]:
+                path = notice_format.path(api_key, project_id)
+                self.urls[notice_format] = urllib.parse.urljoin(errbit_url, path)
+        self.max_queue = max_queue
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.dedup_window = dedup_window
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.transport = PooledTransport(maxsize=concurrency)
+        self.counts = dict.fromkeys(
+            ['received', 'forwarded', 'duplicates', 'dropped', 'rejected', 'failures'], 0)
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        # set to stop receiving, then to stop forwarding
+        self._stopped = threading.Event()
+        self._done = threading.Event()
+        self._seen = LRUCache(max_queue)
+        self._threads = []
+
+        family, address = parse_address(listen)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.bind(address)
+        self.socket.settimeout(0.5)
+        self.address = self.socket.getsockname()
+
+    def stats(self):
+        "Counts of notices received, forwarded, dropped, etc. and the queue length"
+        with self._lock:
+            stats = dict(self.counts)
+            stats['queued'] = len(self._queue)
+        return stats
+
+    def start(self):
+        "Start receiving and forwarding notices from background threads"
+        for i in range(self.concurrency):
+            self._start_thread(self._forward, 'errbit-relay-forwarder')
+        self._start_thread(self._receive, 'errbit-relay-receiver')
+
+    def serve_forever(self):
+        "Forward notices until shutdown is called"
+        for i in range(self.concurrency):
+            self._start_thread(self._forward, 'errbit-relay-forwarder')
+        self._receive()
+
+    def shutdown(self, timeout=None):
+        """Stop receiving notices, and forward the queued ones before stopping
+
+        Parameters:
+            timeout : float, optional
+                Seconds to wait for the queue to be forwarded, after which the
+                notices left are counted as dropped (the default is to wait
+                until they are forwarded)
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        self._stopped.set()
+        with self._lock:
+            self._not_empty.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(None if deadline is None else max(deadline - monotonic(), 0))
+        self._done.set()
+        with self._lock:
+            self.counts['dropped'] += len(self._queue)
+            self._queue.clear()
+        # the family can't be read from a closed socket on python 2
+        family = self.socket.family
+        self.socket.close()
+        self.transport.close()
+        if family == socket.AF_UNIX and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def _receive(self):
+        while not self._stopped.is_set():
+            try:
+                payload = self.socket.recv(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except socket.error:
+                if self._stopped.is_set():
+                    return
+                raise
+            self._enqueue(payload, monotonic())
+
+    def _enqueue(self, payload, now):
+        with self._lock:
+            self.counts['received'] += 1
+            if self.dedup_window is not None:
+                key = hashlib.sha1(payload).digest()
+                seen_at = self._seen.get(key)
+                if seen_at is not None and now - seen_at < self.dedup_window:
+                    self.counts['duplicates'] += 1
+                    return
+                self._seen.set(key, now)
+            if len(self._queue) >= self.max_queue:
+                self._queue.popleft()
+                self.counts['dropped'] += 1
+            self._queue.append(payload)
+            self._not_empty.notify()
+
+    def _forward(self):
+        backoff = 0
+        while True:
+            if backoff:
+                self._done.wait(backoff)
+            with self._lock:
+                while not self._queue and not self._stopped.is_set():
+                    self._not_empty.wait()
+                if not self._queue or self._done.is_set():
+                    # stopped, with nothing left to forward or no time left
+                    return
+                batch = [self._queue.popleft() for i in range(min(self.batch_size, len(self._queue)))]
+            failed = self._forward_batch(batch)
+            if failed:
+                with self._lock:
+                    self.counts['failures'] += 1
+                    if self._done.is_set():
+                        self.counts['dropped'] += len(failed)
+                        return
+                    self._queue.extendleft(reversed(failed))
+                    while len(self._queue) > self.max_queue:
+                        self._queue.pop()
+                        self.counts['dropped'] += 1
+                backoff = min(max(backoff * 2, 0.5), self.max_backoff)
+            else:
+                backoff = 0
+
+    def _forward_batch(self, batch):
+        "Forward notices until errbit fails, returning the ones not forwarded"
+        for index, payload in enumerate(batch):
+            notice_format = formats.for_payload(payload)
+            url = self.urls.get(notice_format)
+            if url is None:
+                with self._lock:
+                    self.counts['rejected'] += 1
+                continue
+            headers = formats.payload_headers(notice_format, payload)
+            try:
+                self.transport.post(url, payload, headers, timeout=self.timeout)
+            except Exception as e:
+                if is_transient_error(e):
+                    return batch[index:]
+                with self._lock:
+                    self.counts['rejected'] += 1
+            else:
+                with self._lock:
+                    self.counts['forwarded'] += 1
+        return []
+
+
+def main(argv=None):
+    "Entry point of the errbit-relay command"
+    parser = argparse.ArgumentParser(
+        prog='errbit-relay', description="Forward notices from local processes to errbit")
+    parser.add_argument('--errbit-url', required=True,
+                        help="protocol and host of the errbit server")
+    parser.add_argument('--listen', default=DEFAULT_ADDRESS,
+                        help="unix:PATH or udp:HOST:PORT to listen on (default: %(default)s)")
+    parser.add_argument('--max-queue', type=int, default=10000,
+                        help="notices kept waiting before dropping the oldest (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="notices forwarded at the same time (default: %(default)s)")
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help="notices taken from the queue at once (default: %(default)s)")
+    parser.add_argument('--dedup-window', type=float, default=None,
+                        help="seconds during which identical notices are dropped")
+    parser.add_argument('--timeout', type=float, default=10,
+                        help="timeout in seconds for requests to errbit (default: %(default)s)")
+    parser.add_argument('--api-key', default=os.environ.get('ERRBIT_API_KEY'),
+                        help="api key for json notices (default: $ERRBIT_API_KEY)")
+    parser.add_argument('--project-id',
+                        help="project id in the url for json notices (default: the api key)")
+    args = parser.parse_args(argv)
+
+    server = RelayServer(args.listen, args.errbit_url, max_queue=args.max_queue,
+                         concurrency=args.concurrency, batch_size=args.batch_size,
+                         dedup_window=args.dedup_window, timeout=args.timeout,
+                         api_key=args.api_key, project_id=args.project_id)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server._stopped.set())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown(timeout=args.timeout)
+    return 0
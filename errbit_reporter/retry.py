@@ -0,0 +1,217 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from six.moves import urllib
+
+from errbit_reporter._compat import monotonic, reset_after_fork
+from errbit_reporter.transport import is_transient_error
+
+
+def retry_after(exc):
+    """Seconds to wait from the Retry-After header of a 429 or 503 response
+
+    Returns:
+        float
+            The delay in seconds, or None if exc isn't such a response or
+            doesn't have a valid Retry-After header
+    """
+    if not isinstance(exc, urllib.error.HTTPError) or exc.code not in (429, 503):
+        return None
+    # hdrs is set on python 2 as well, which only has headers when there is
+    # a response body
+    headers = getattr(exc, 'hdrs', None)
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    import email.utils
+
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(email.utils.mktime_tz(parsed) - time.time(), 0.0)
+
+
+class RetryScheduler(object):
+    """Calls functions after a delay from a single timer thread
+
+    Pending calls are kept in a heap ordered by when they are due, so
+    thousands of them cost just their heap entries, and the thread is only
+    started when the first call is scheduled. Calls are made one at a time
+    on the timer thread, so they should hand off slow work.
+    """
+
+    def __init__(self):
+        self._reset()
+        reset_after_fork(self)
+
+    def __len__(self):
+        with self._lock:
+            return self._pending
+
+    def call_later(self, delay, fn, *args):
+        """Call fn(*args) on the timer thread in delay seconds
+
+        Returns:
+            errbit_reporter.retry.Timer
+                Can be used to cancel the call
+        """
+        timer = Timer(fn, args)
+        with self._lock:
+            timer.scheduler = self
+            timer.generation = self._generation
+            heapq.heappush(self._heap, (monotonic() + delay, next(self._counter), timer))
+            self._pending += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='errbit-retry')
+                self._thread.daemon = True
+                self._thread.start()
+            self._changed.notify()
+        return timer
+
+    def _reset(self):
+        self._generation = getattr(self, '_generation', 0) + 1
+        self._heap = []
+        self._counter = itertools.count()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._thread = None
+
+    def _after_fork(self):
+        # calls scheduled in the parent are made by the parent
+        self._reset()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    if self._heap:
+                        due, seq, timer = self._heap[0]
+                        if timer.cancelled:
+                            heapq.heappop(self._heap)
+                            continue
+                        remaining = due - monotonic()
+                        if remaining <= 0:
+                            heapq.heappop(self._heap)
+                            timer.scheduler = None
+                            self._pending -= 1
+                            break
+                        self._changed.wait(remaining)
+                    else:
+                        self._changed.wait()
+            try:
+                timer.fn(*timer.args)
+            except Exception:
+                # the call reports its own outcome, this just keeps the
+                # thread alive for the other calls
+                pass
+
+
+class Timer(object):
+    "A call scheduled with RetryScheduler.call_later"
+
+    __slots__ = ('fn', 'args', 'cancelled', 'scheduler', 'generation')
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+        self.scheduler = None
+        self.generation = None
+
+    def cancel(self):
+        """Stop the call from being made
+
+        Returns:
+            bool
+                False if the call was already made or cancelled, or was
+                scheduled before a fork in the parent process
+        """
+        scheduler = self.scheduler
+        if scheduler is None:
+            return False
+        with scheduler._lock:
+            if self.cancelled or self.scheduler is None or self.generation != scheduler._generation:
+                return False
+            self.cancelled = True
+            self.scheduler = None
+            scheduler._pending -= 1
+        return True
+
+
+SCHEDULER = RetryScheduler()
+
+
+class RetryPolicy(object):
+    """When to send a notice again after a transient failure
+
+    Connection errors, timeouts, 429 and 5xx responses are retried with
+    exponential backoff, waiting for the Retry-After of 429 and 503
+    responses instead when they have one. The delays are jittered so that
+    clients that failed together don't all retry at the same moment.
+
+    Parameters:
+        max_attempts : int, optional
+            Number of times a notice is sent, including the first attempt,
+            before giving up (the default is 5)
+        max_age : float, optional
+            Seconds after the first attempt beyond which a notice isn't
+            retried, or None for no limit (the default is 5 minutes)
+        initial_backoff : float, optional
+            Seconds before the first retry, doubling for each further retry
+            (the default is 1 second)
+        max_backoff : float, optional
+            Maximum seconds between retries (the default is 60 seconds)
+        jitter : float, optional
+            Fraction of each delay that is randomly taken off it, from 0 for
+            no jitter to 1 for delays anywhere up to the backoff (the default
+            is 0.5)
+        scheduler : errbit_reporter.RetryScheduler, optional
+            Runs the retries (the default is a scheduler shared by the
+            process)
+    """
+
+    def __init__(self, max_attempts=5, max_age=300.0, initial_backoff=1.0, max_backoff=60.0, jitter=0.5,
+                 scheduler=None):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be positive")
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1")
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.scheduler = SCHEDULER if scheduler is None else scheduler
+        self.random = random.random
+
+    def delay(self, attempts, age, exc):
+        """Seconds to wait before sending a notice again
+
+        Parameters:
+            attempts : int
+                Number of times the notice has been sent
+            age : float
+                Seconds since the notice was first sent
+            exc : Exception
+                The error from the last attempt
+
+        Returns:
+            float
+                The delay, or None if the notice shouldn't be retried
+        """
+        if attempts >= self.max_attempts or not is_transient_error(exc):
+            return None
+        delay = retry_after(exc)
+        if delay is None:
+            delay = min(self.initial_backoff * 2 ** (attempts - 1), self.max_backoff)
+            delay -= delay * self.jitter * self.random()
+        if self.max_age is not None and age + delay > self.max_age:
+            return None
+        return delay
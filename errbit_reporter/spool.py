@@ -0,0 +1,478 @@
+import errno
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+from errbit_reporter._compat import monotonic, replace, reset_after_fork
+from errbit_reporter.transport import is_transient_error
+
+FSYNC_NEVER = 'never'
+FSYNC_INTERVAL = 'interval'
+FSYNC_ALWAYS = 'always'
+
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_INTERVAL, FSYNC_ALWAYS)
+
+SEGMENT_MAGIC = b'ERRBITSPOOL1\n'
+SEGMENT_SUFFIX = '.seg'
+RECORD_HEADER = struct.Struct('>II')
+CURSOR_FILENAME = 'cursor'
+DRAIN_LOCK_FILENAME = 'drain.lock'
+
+
+def _segment_name(sequence):
+    return '%020d%s' % (sequence, SEGMENT_SUFFIX)
+
+
+def _try_lock(fd):
+    "Take an exclusive flock on fd without waiting, returning whether it was taken"
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+            return False
+        raise
+    return True
+
+
+def read_records(f, offset):
+    """Yields (payload, next offset) for each intact record after offset
+
+    Stops at the end of the file or at the first torn or corrupt record.
+    """
+    f.seek(offset)
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        length, checksum = RECORD_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) & 0xffffffff != checksum:
+            return
+        offset += RECORD_HEADER.size + length
+        yield payload, offset
+
+
+class Spool(object):
+    """Append-only on-disk store for notices that couldn't be delivered
+
+    Serialized notices are appended as length and checksum framed records
+    to segment files in the spool directory, and replayed in order by a
+    background drainer once errbit accepts them again. The position of the
+    drainer, and its position in segments created behind it, is kept in a
+    cursor file, so after a crash delivery resumes where it left off and a
+    record torn by the crash is discarded.
+
+    Processes can share a spool directory, e.g. after forking. Each process
+    appends to its own segment file, which it holds a lock on, and a lock
+    file ensures only one process drains the spool at a time.
+
+    Parameters:
+        directory : str
+            Directory for the segment files, created if it doesn't exist
+        max_bytes : int, optional
+            Size of the spool above which the oldest segments are deleted
+            (the default is 64 MiB)
+        segment_bytes : int, optional
+            Size at which a new segment file is started (the default is 4 MiB)
+        fsync : str, optional
+            When appended records are flushed to disk: FSYNC_NEVER leaves it
+            to the OS, FSYNC_INTERVAL at most every fsync_interval seconds
+            and FSYNC_ALWAYS after every record (the default is FSYNC_INTERVAL)
+        fsync_interval : float, optional
+            Seconds between flushes with FSYNC_INTERVAL (the default is 1 second)
+        min_backoff : float, optional
+            Seconds the drainer waits before retrying after errbit first fails
+            (the default is 1 second)
+        max_backoff : float, optional
+            Upper bound for the drainer's wait, which doubles after each
+            failure (the default is 300 seconds)
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, segment_bytes=4 * 1024 * 1024,
+                 fsync=FSYNC_INTERVAL, fsync_interval=1.0, min_backoff=1.0, max_backoff=300.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("unknown fsync policy %r" % (fsync,))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.dropped = 0
+
+        self._file = None
+        self._file_sequence = None
+        self._file_size = 0
+        self._last_fsync = monotonic()
+        self._sizes = {}
+        self._next_sequence = 1
+        self._send = None
+        self._closed = False
+        self._drain_lock_fd = None
+        self._reset()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._recover()
+        reset_after_fork(self)
+
+    @property
+    def pending_bytes(self):
+        "Size of the segment files in the spool"
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def append(self, payload):
+        """Append a serialized notice to the spool
+
+        Returns:
+            bool
+                False if the notice was dropped because the spool is full
+        """
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+        with self._lock:
+            if self._closed:
+                self.dropped += 1
+                return False
+            if self._file is None or self._file_size + len(record) > self.segment_bytes:
+                self._rotate()
+            if not self._make_room(len(record)):
+                self.dropped += 1
+                return False
+            self._file.write(record)
+            self._file_size += len(record)
+            self._sizes[self._file_sequence] = self._file_size
+            if self.fsync == FSYNC_ALWAYS:
+                os.fsync(self._file.fileno())
+            elif self.fsync == FSYNC_INTERVAL and monotonic() - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._last_fsync = monotonic()
+            wakeup = self._drainer_waiting
+            restart = self._send is not None and self._drainer is None
+        if restart:
+            self.start(self._send)
+        elif wakeup:
+            self._wakeup.set()
+        return True
+
+    def drain(self, send):
+        """Replay spooled notices in order until one can't be delivered
+
+        A notice that errbit rejects with an error that won't go away by
+        retrying (see is_transient_error) is discarded. Nothing is replayed
+        while another process is draining the spool.
+
+        Parameters:
+            send : callable
+                Called with each serialized notice, raising to report failure
+
+        Returns:
+            (int, bool)
+                The number of notices replayed, and whether a delivery failed
+        """
+        lock_fd = os.open(os.path.join(self.directory, DRAIN_LOCK_FILENAME), os.O_RDWR | os.O_CREAT)
+        self._drain_lock_fd = lock_fd
+        try:
+            if not _try_lock(lock_fd):
+                return 0, False
+            return self._drain(send)
+        finally:
+            self._drain_lock_fd = None
+            os.close(lock_fd)
+
+    def start(self, send):
+        "Start a background thread that drains the spool with send"
+        with self._lock:
+            self._send = send
+            if self._drainer is not None and self._drainer.is_alive():
+                return
+            self._closed = False
+            self._drainer = threading.Thread(target=self._drain_loop, args=(send,),
+                                             name='errbit-spool-drainer')
+            self._drainer.daemon = True
+            self._drainer.start()
+
+    def close(self, timeout=None):
+        "Stop the drainer and close the current segment file"
+        with self._lock:
+            self._closed = True
+            drainer = self._drainer
+            self._close_file()
+        self._wakeup.set()
+        if drainer is not None:
+            drainer.join(timeout)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._drainer = None
+        self._drainer_waiting = False
+
+    def _after_fork(self):
+        # the segment file and its lock stay with the parent, the child
+        # starts its own segment and drainer when it first appends
+        self._reset()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_sequence = None
+        if self._drain_lock_fd is not None:
+            # a drain was in progress in another thread of the parent, which
+            # would otherwise keep the drain lock held for the child's lifetime
+            os.close(self._drain_lock_fd)
+            self._drain_lock_fd = None
+
+    def _drain(self, send):
+        sent = 0
+        cursor = self._read_cursor()
+        cursor_sequence, cursor_offset, positions = cursor
+        sequences = self._scan()
+        # forget the positions of segments that have since been deleted
+        positions = dict(item for item in positions.items() if item[0] in sequences)
+        for sequence in sequences:
+            # a segment behind the cursor was created after the drainer
+            # passed its number, by a process that allocated the number
+            # before, so it is read without moving the cursor and its own
+            # position is kept with the cursor instead
+            behind = sequence < cursor_sequence
+            offset = self._start_offset(sequence, cursor)
+            path = os.path.join(self.directory, _segment_name(sequence))
+            try:
+                f = open(path, 'rb')
+            except IOError:
+                continue
+            with f:
+                for payload, next_offset in read_records(f, offset):
+                    try:
+                        send(payload)
+                    except Exception as e:
+                        if is_transient_error(e):
+                            return sent, True
+                    else:
+                        sent += 1
+                    offset = next_offset
+                    if behind:
+                        positions[sequence] = offset
+                    else:
+                        cursor_sequence, cursor_offset = sequence, offset
+                    cursor = (cursor_sequence, cursor_offset, positions)
+                    self._write_cursor(*cursor)
+                if not self._finish_segment(sequence, offset, f):
+                    if behind:
+                        continue
+                    # still being appended to, later segments have to wait
+                    break
+                positions.pop(sequence, None)
+        return sent, False
+
+    def _start_offset(self, sequence, cursor):
+        "The offset of the first record of a segment that hasn't been replayed"
+        cursor_sequence, cursor_offset, positions = cursor
+        if sequence == cursor_sequence:
+            return cursor_offset
+        if sequence < cursor_sequence:
+            return positions.get(sequence, len(SEGMENT_MAGIC))
+        return len(SEGMENT_MAGIC)
+
+    def _drain_loop(self, send):
+        backoff = self.min_backoff
+        delay = 0
+        while True:
+            with self._lock:
+                self._drainer_waiting = delay is None
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            with self._lock:
+                self._drainer_waiting = False
+                if self._closed:
+                    return
+            try:
+                sent, failed = self.drain(send)
+            except Exception:
+                failed = True
+            if failed:
+                delay = backoff
+                backoff = min(backoff * 2, self.max_backoff)
+            else:
+                delay = None
+                backoff = self.min_backoff
+
+    def _recover(self):
+        sequences = self._scan()
+        if sequences:
+            # only the last segment can have been torn by a crash while
+            # appending, unless another process is still appending to it
+            last = sequences[-1]
+            path = os.path.join(self.directory, _segment_name(last))
+            with open(path, 'r+b') as f:
+                if _try_lock(f.fileno()):
+                    if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                        end = 0
+                    else:
+                        end = len(SEGMENT_MAGIC)
+                        for payload, end in read_records(f, end):
+                            pass
+                    if end != self._sizes[last]:
+                        f.truncate(end)
+                        self._sizes[last] = end
+        self._next_sequence = max(sequences + [self._read_cursor()[0]]) + 1
+
+    def _list_segments(self):
+        "The sizes of the segment files in the directory by sequence"
+        sizes = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    sizes[int(name[:-len(SEGMENT_SUFFIX)])] = os.path.getsize(os.path.join(self.directory, name))
+                except (ValueError, OSError):
+                    pass
+        return sizes
+
+    def _scan(self):
+        "Update the segment sizes from the directory, which other processes append to"
+        sizes = self._list_segments()
+        with self._lock:
+            if self._file_sequence is not None:
+                sizes[self._file_sequence] = self._file_size
+            self._sizes = sizes
+            return sorted(sizes)
+
+    def _rotate(self):
+        self._close_file()
+        # other processes, e.g. forked from this one, allocate from their own
+        # copy of _next_sequence, and the drainer may have deleted segments
+        # since, so numbers at or behind the cursor would be read late
+        sequences = [self._next_sequence - 1, self._read_cursor()[0]] + list(self._list_segments())
+        self._next_sequence = max(sequences) + 1
+        while True:
+            sequence = self._next_sequence
+            self._next_sequence += 1
+            path = os.path.join(self.directory, _segment_name(sequence))
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    continue
+                raise
+            break
+        # the lock tells other processes the segment is still being appended to
+        _try_lock(fd)
+        self._file = os.fdopen(fd, 'ab', 0)
+        self._file.write(SEGMENT_MAGIC)
+        self._file_sequence = sequence
+        self._file_size = len(SEGMENT_MAGIC)
+        self._sizes[sequence] = self._file_size
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        self._file_sequence = None
+
+    def _make_room(self, size):
+        total = sum(self._sizes.values())
+        for sequence in sorted(self._sizes):
+            if total + size <= self.max_bytes:
+                break
+            size_of_segment = self._sizes[sequence]
+            if sequence == self._file_sequence:
+                break
+            records = self._delete_idle_segment(sequence)
+            if records is None:
+                break
+            # the notices in the segment that hadn't been replayed are lost
+            self.dropped += records
+            total -= size_of_segment
+        return total + size <= self.max_bytes
+
+    def _finish_segment(self, sequence, offset, f):
+        """Delete a segment the drainer has read to the end of
+
+        A segment that is no longer appended to is also deleted when reading
+        stopped early at a corrupt record.
+
+        Returns:
+            bool
+                False if the segment is still being appended to
+        """
+        with self._lock:
+            if sequence == self._file_sequence:
+                if self._sizes.get(sequence) != offset:
+                    return False
+                self._close_file()
+                self._delete_segment(sequence)
+                return True
+            if not _try_lock(f.fileno()):
+                return False
+            self._delete_segment(sequence)
+            return True
+
+    def _delete_idle_segment(self, sequence):
+        """Delete a segment unless another process is appending to it
+
+        Returns:
+            int
+                The number of records in the segment that hadn't been
+                replayed, or None if it is still being appended to
+        """
+        try:
+            with open(os.path.join(self.directory, _segment_name(sequence)), 'rb') as f:
+                if not _try_lock(f.fileno()):
+                    return None
+                records = sum(1 for record in read_records(f, self._start_offset(sequence, self._read_cursor())))
+                self._delete_segment(sequence)
+        except IOError:
+            self._sizes.pop(sequence, None)
+            return 0
+        return records
+
+    def _delete_segment(self, sequence):
+        self._sizes.pop(sequence, None)
+        try:
+            os.remove(os.path.join(self.directory, _segment_name(sequence)))
+        except OSError:
+            pass
+
+    def _read_cursor(self):
+        """The drainer's position, from the cursor file
+
+        Returns:
+            (int, int, dict)
+                The sequence and offset of the drainer, and the offsets it
+                has read to in segments behind it by sequence
+        """
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILENAME)) as f:
+                values = [int(value) for value in f.read().split()]
+        except (IOError, OSError, ValueError):
+            return 0, 0, {}
+        if len(values) < 2 or len(values) % 2:
+            return 0, 0, {}
+        positions = dict(zip(values[2::2], values[3::2]))
+        return values[0], values[1], positions
+
+    def _write_cursor(self, sequence, offset, positions):
+        path = os.path.join(self.directory, CURSOR_FILENAME)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        line = '%d %d' % (sequence, offset)
+        for item in sorted(positions.items()):
+            line += ' %d %d' % item
+        with open(tmp_path, 'w') as f:
+            f.write(line + '\n')
+            if self.fsync != FSYNC_NEVER:
+                # a cursor lost in a crash would replay delivered notices
+                f.flush()
+                os.fsync(f.fileno())
+        replace(tmp_path, path)
@@ -0,0 +1,193 @@
+import threading
+
+import six
+from six.moves import urllib
+
+from errbit_reporter._compat import monotonic, reset_after_fork
+from errbit_reporter.breaker import CircuitOpenError
+
+
+def is_transient_error(exc):
+    """Whether sending a notice again later could succeed after it raised exc
+
+    Connection errors, timeouts, 429 Too Many Requests and 5xx responses are
+    transient, as is an open circuit breaker, while other error responses
+    mean errbit rejected the notice.
+    """
+    from six.moves import http_client
+
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code == 429 or exc.code >= 500
+    return isinstance(exc, (EnvironmentError, http_client.HTTPException, CircuitOpenError))
+
+
+class UrllibTransport(object):
+    """Sends each request to errbit with urllib.request.urlopen
+
+    A new connection is opened for every request, which keeps this transport
+    compatible with any installed urllib opener.
+    """
+
+    def post(self, url, body, headers, timeout=None, read_response=True):
+        """POST body to url and return the response body
+
+        Returns None without reading the response body if read_response is
+        false. Raises urllib.error.HTTPError for an error response.
+        """
+        request = urllib.request.Request(url, body)
+        for name, value in headers:
+            request.add_header(name, value)
+        response = urllib.request.urlopen(request, timeout=timeout)
+        try:
+            return response.read() if read_response else None
+        finally:
+            response.close()
+
+    def close(self):
+        pass
+
+
+class PooledTransport(object):
+    """Sends requests over persistent HTTP/1.1 connections
+
+    Idle connections are kept per host and shared between threads, and a
+    request that fails on a reused connection which the server had already
+    closed is retried once on a new connection.
+
+    Parameters:
+        maxsize : int, optional
+            Maximum number of idle connections kept per host (the default is 4)
+        idle_timeout : float, optional
+            Seconds after which an idle connection is closed instead of being
+            reused (the default is 30 seconds)
+    """
+
+    def __init__(self, maxsize=4, idle_timeout=30.0):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._targets = {}
+        reset_after_fork(self)
+
+    def post(self, url, body, headers, timeout=None, read_response=True):
+        """POST body to url and return the response body
+
+        Returns None if read_response is false, although the body is still
+        drained so that the connection can be reused. Raises
+        urllib.error.HTTPError for an error response.
+        """
+        import socket
+        from six.moves import http_client
+
+        key, path = self._target(url)
+        conn, reused = self._acquire(key, timeout)
+        try:
+            response = self._request(conn, path, body, headers)
+        except socket.timeout:
+            conn.close()
+            raise
+        except (socket.error, http_client.HTTPException):
+            conn.close()
+            if not reused:
+                raise
+            conn = self._connect(key, timeout)
+            try:
+                response = self._request(conn, path, body, headers)
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        try:
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason,
+                                         response.msg, six.BytesIO(data))
+        return data if read_response else None
+
+    def close(self):
+        "Close all the idle connections"
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for pool in pools.values():
+            for conn, last_used in pool:
+                conn.close()
+
+    def _after_fork(self):
+        # the idle connections' sockets are shared with the parent, so the
+        # child closes its copies and connects again
+        self._lock = threading.Lock()
+        pools, self._idle = self._idle, {}
+        for pool in pools.values():
+            for conn, last_used in pool:
+                conn.close()
+
+    def _target(self, url):
+        target = self._targets.get(url)
+        if target is None:
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise ValueError("unsupported url scheme %r" % (parts.scheme,))
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            target = ((parts.scheme, parts.netloc), path)
+            self._targets[url] = target
+        return target
+
+    def _acquire(self, key, timeout):
+        now = monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            pool = self._idle.get(key)
+            while pool:
+                candidate, last_used = pool.pop()
+                if now - last_used > self.idle_timeout:
+                    stale.append(candidate)
+                else:
+                    conn = candidate
+                    break
+        for candidate in stale:
+            candidate.close()
+        if conn is None:
+            return self._connect(key, timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _release(self, key, conn):
+        with self._lock:
+            pool = self._idle.setdefault(key, [])
+            if len(pool) < self.maxsize:
+                pool.append((conn, monotonic()))
+                return
+        conn.close()
+
+    def _connect(self, key, timeout):
+        from six.moves import http_client
+
+        scheme, netloc = key
+        if scheme == 'https':
+            return http_client.HTTPSConnection(netloc, timeout=timeout)
+        return http_client.HTTPConnection(netloc, timeout=timeout)
+
+    def _request(self, conn, path, body, headers):
+        conn.putrequest('POST', path, skip_accept_encoding=True)
+        for name, value in headers:
+            conn.putheader(name, value)
+        conn.putheader('Content-Length', str(len(body)))
+        conn.endheaders(body)
+        return conn.getresponse()
@@ -0,0 +1,170 @@
+import inspect
+import re
+import sys
+
+FILTERED = '[FILTERED]'
+# environ keys whose value is the request uri, including its query string
+URI_KEYS = ('REQUEST_URI', 'RAW_URI')
+DEFAULT_FILTERS = ('password', 'passwd', 'secret', 'token', 'api_key', 'authorization', 'cookie', 'session')
+
+
+class ErrbitMiddleware(object):
+    """WSGI middleware that notifies errbit of exceptions raised by an app
+
+    Exceptions raised while calling the app, iterating its response or
+    closing the response are reported and then re-raised. The request url,
+    query string params and the environ's string values as cgi_data are only
+    derived from the environ once an exception is raised, so a successful
+    request costs a try/except, plus a wrapper object around responses that
+    have a close method, like generators. Responses without one, such as
+    lists, are returned as is, as are instances of the server's
+    wsgi.file_wrapper so that it can still send files with sendfile, and
+    errors from iterating those aren't reported.
+
+    Parameters:
+        app : callable
+            The WSGI application
+        client : errbit_reporter.Client
+            The client used to notify errbit
+        filters : iterable of str, optional
+            Case insensitive substrings of param and environ keys whose values
+            are replaced by [FILTERED], including in the query string of the
+            request url and of the environ (the default filters passwords,
+            secrets, tokens, api keys, authorization, cookies and sessions)
+        timeout : int, optional
+            The timeout in seconds for the request to errbit (the default is
+            no timeout)
+    """
+
+    def __init__(self, app, client, filters=DEFAULT_FILTERS, timeout=None):
+        self.app = app
+        self.client = client
+        self.filters = tuple(filters)
+        self.timeout = timeout
+        self._filter_pattern = None
+        if self.filters:
+            self._filter_pattern = re.compile('|'.join(map(re.escape, self.filters)), re.IGNORECASE)
+
+    def __call__(self, environ, start_response):
+        try:
+            response = self.app(environ, start_response)
+        except Exception:
+            self._notify(environ)
+            raise
+        if getattr(response, 'close', None) is None:
+            return response
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if inspect.isclass(file_wrapper) and isinstance(response, file_wrapper):
+            return response
+        return _NotifyingResponse(self, environ, response)
+
+    def _notify(self, environ):
+        if not self.client.config.errbit_url:
+            return
+        exc_info = sys.exc_info()
+        try:
+            self.client.notify(exc_info, timeout=self.timeout, **self.context(environ))
+        except Exception:
+            # failing to report the error mustn't replace the app's exception
+            pass
+
+    def context(self, environ):
+        """The notify keyword arguments for a request
+
+        Returns:
+            dict
+                The request_url, params parsed from the query string and
+                cgi_data from the environ's string values, with filtered
+                values replaced
+        """
+        from wsgiref.util import request_uri
+
+        query = environ.get('QUERY_STRING', '')
+        params, filtered_query = self._filter_query(query)
+        cgi_data = dict((name, self._filter(name, value))
+                        for name, value in environ.items() if isinstance(value, str))
+        if filtered_query != query:
+            cgi_data['QUERY_STRING'] = filtered_query
+            for name in URI_KEYS:
+                uri = cgi_data.get(name)
+                if uri is not None and '?' in uri:
+                    cgi_data[name] = uri.split('?', 1)[0] + '?' + filtered_query
+        try:
+            request_url = request_uri(environ, include_query=False)
+        except KeyError:
+            request_url = None
+        else:
+            if filtered_query:
+                request_url += '?' + filtered_query
+        return {
+            'request_url': request_url,
+            'params': params,
+            'cgi_data': cgi_data,
+        }
+
+    def _filter_query(self, query):
+        """Parse a query string, filtering its values
+
+        Returns:
+            (dict, str)
+                The params, and the query string with the filtered values
+                replaced, which is query itself if none were
+        """
+        from six.moves import urllib
+
+        params = {}
+        pairs = []
+        filtered = False
+        for name, value in urllib.parse.parse_qsl(query, keep_blank_values=True):
+            if self._filter(name, value) is FILTERED:
+                filtered = True
+                pairs.append(urllib.parse.quote_plus(name) + '=' + FILTERED)
+            else:
+                pairs.append(urllib.parse.quote_plus(name) + '=' + urllib.parse.quote_plus(value))
+            params.setdefault(name, []).append(value)
+        for name, values in params.items():
+            params[name] = self._filter(name, values[0] if len(values) == 1 else values)
+        return params, '&'.join(pairs) if filtered else query
+
+    def _filter(self, name, value):
+        if self._filter_pattern is not None and self._filter_pattern.search(name):
+            return FILTERED
+        return value
+
+
+class _NotifyingResponse(object):
+    "Response iterator that notifies errbit of errors from iterating or closing it"
+
+    __slots__ = ('_middleware', '_environ', '_response', '_iterator')
+
+    def __init__(self, middleware, environ, response):
+        self._middleware = middleware
+        self._environ = environ
+        self._response = response
+        self._iterator = None
+
+    def __iter__(self):
+        try:
+            self._iterator = iter(self._response)
+        except Exception:
+            self._middleware._notify(self._environ)
+            raise
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise
+        except Exception:
+            self._middleware._notify(self._environ)
+            raise
+
+    next = __next__  # python 2
+
+    def close(self):
+        try:
+            self._response.close()
+        except Exception:
+            self._middleware._notify(self._environ)
+            raise
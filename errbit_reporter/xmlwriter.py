@@ -0,0 +1,50 @@
+"""Helpers to write xml text directly, escaped the same way as ElementTree
+
+The output matches ElementTree on python 3.7+. Older versions (2.7 and
+3.6) leave carriage returns and tabs in attribute values unescaped, which
+parsers normalize to spaces, so escape_attrib escapes them like 3.7+.
+"""
+
+XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+
+def escape_cdata(text):
+    "Escape text for use as the content of an element"
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def escape_attrib(text):
+    "Escape text for use as an attribute value"
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if "\"" in text:
+        text = text.replace("\"", "&quot;")
+    if "\r" in text:
+        text = text.replace("\r", "&#13;")
+    if "\n" in text:
+        text = text.replace("\n", "&#10;")
+    if "\t" in text:
+        text = text.replace("\t", "&#09;")
+    return text
+
+
+def element(tag, text):
+    "Returns an element with only text content, which is empty for None or ''"
+    if not text:
+        return "<%s />" % tag
+    return "<%s>%s</%s>" % (tag, escape_cdata(text), tag)
+
+
+def encode(text):
+    "Encode xml text the way ElementTree does for the utf-8 encoding"
+    return text.encode('utf-8', 'xmlcharrefreplace')
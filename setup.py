@@ -10,6 +10,11 @@ setup(name='errbit-reporter',
       author_email='Dylan.Smith@shopify.com',
       url='https://github.com/dylanahsmith/errbit-reporter-python',
       packages=['errbit_reporter'],
+      entry_points={
+          'console_scripts': [
+              'errbit-relay = errbit_reporter.relay:main',
+          ],
+      },
       license='MIT License',
       install_requires=[
           'six',
@@ -0,0 +1,96 @@
+import sys
+import unittest
+
+from six.moves import urllib
+
+from errbit_reporter import Configuration, request_context
+
+from test.stub_server import StubServer
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from errbit_reporter import AsyncClient, AsyncTransport
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "asyncio client requires python 3.5")
+class AsyncClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.config = Configuration('apikey', self.server.url)
+        self.loop = asyncio.new_event_loop()
+        self.client = AsyncClient(self.config, concurrency=2)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.client.close())
+        self.loop.close()
+        self.server.stop()
+
+    def notify(self):
+        try:
+            int('a')
+        except Exception:
+            return self.loop.run_until_complete(self.client.notify(timeout=5))
+
+    def test_notify(self):
+        metadata = self.notify()
+        self.assertEqual(metadata.id, '87186dda0c1d88569a171698')
+        path, headers, body = self.server.requests[0]
+        self.assertEqual(path, '/notifier_api/v2/notices/')
+        self.assertEqual(headers['Content-Type'], 'text/xml')
+        self.assertIn(b'<class>ValueError</class>', body)
+
+    def test_reuses_connection(self):
+        self.notify()
+        self.notify()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_reconnects_after_connection_closed(self):
+        self.server.keep_alive = False
+        self.notify()
+        self.notify()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_concurrent_notifies(self):
+        try:
+            int('a')
+        except Exception:
+            tasks = [self.loop.create_task(self.client.notify(timeout=5)) for i in range(5)]
+        results = self.loop.run_until_complete(asyncio.gather(*tasks))
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertLessEqual(len(self.server.connections), 2)
+
+    def test_notify_on_exception(self):
+        context = self.client.notify_on_exception(component='worker')
+        self.loop.run_until_complete(context.__aenter__())
+        try:
+            int('a')
+        except Exception:
+            suppress = self.loop.run_until_complete(context.__aexit__(*sys.exc_info()))
+        self.assertFalse(suppress)
+        self.assertIn(b'<component>worker</component>', self.server.requests[0][2])
+
+    def test_request_context(self):
+        with request_context(component='worker', params=lambda: {'job': '1'}):
+            try:
+                int('a')
+            except Exception:
+                notified = self.client.notify(timeout=5)
+        self.loop.run_until_complete(notified)
+        body = self.server.requests[0][2]
+        self.assertIn(b'<component>worker</component>', body)
+        self.assertIn(b'<params><job>1</job></params>', body)
+
+    def test_error_response(self):
+        self.server.responses.append((500, {}))
+        with self.assertRaises(urllib.error.HTTPError):
+            self.notify()
+
+    def test_disabled(self):
+        client = AsyncClient(Configuration('apikey', None), transport=AsyncTransport())
+        try:
+            int('a')
+        except Exception:
+            self.assertIsNone(self.loop.run_until_complete(client.notify()))
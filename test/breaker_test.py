@@ -0,0 +1,51 @@
+import unittest
+
+from errbit_reporter import CircuitBreaker
+from errbit_reporter.breaker import CLOSED, OPEN, HALF_OPEN
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        breaker.record_failure(now=0)
+        breaker.record_success()
+        breaker.record_failure(now=0)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure(now=0)
+        self.assertEqual(breaker.stats()['trips'], 1)
+        self.assertFalse(breaker.allow(now=5))
+        self.assertEqual(breaker.stats()['short_circuited'], 1)
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure(now=0)
+        self.assertTrue(breaker.allow(now=10))
+        self.assertFalse(breaker.allow(now=10))
+        breaker.record_failure(now=11)
+        self.assertFalse(breaker.allow(now=12))
+        self.assertTrue(breaker.allow(now=21))
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow(now=21))
+        self.assertEqual(breaker.stats()['trips'], 2)
+
+    def test_cancelled_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure(now=0)
+        self.assertTrue(breaker.allow(now=10))
+        breaker.cancel()
+        self.assertTrue(breaker.allow(now=10))
+        self.assertFalse(breaker.allow(now=10))
+
+    def test_slow_responses_count_as_failures(self):
+        breaker = CircuitBreaker(failure_threshold=1, slow_threshold=1)
+        breaker.record_success(0.5)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_success(2)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_state_after_reset_timeout(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, HALF_OPEN)
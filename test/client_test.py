@@ -1,12 +1,21 @@
+import gzip
+import json
 import os.path
+import shutil
 import sys
+import tempfile
+import time
 import unittest
 import traceback
 
 import six
 from six.moves import urllib
 
-from errbit_reporter import Configuration, Client, Notice
+from errbit_reporter import (Configuration, Client, Notice, DeliveryQueue, NoticeFuture, PooledTransport,
+                             Deduplicator, Spool, RateLimiter, CircuitBreaker, CircuitOpenError,
+                             InMemoryMetrics, request_context)
+
+from test.stub_server import StubServer
 
 
 class FakeResponse(object):
@@ -28,13 +37,13 @@ class FakeResponse(object):
 
 class TestHandler(urllib.request.HTTPHandler):
     request = None
-    response = None
+    response_body = None
     response_filename = os.path.join(os.path.dirname(__file__), 'fixtures', 'response.xml')
 
     def do_open(self, http_class, request, **http_conn_args):
         cls = self.__class__
         cls.request = request
-        return cls.response
+        return FakeResponse(cls.response_body)
 
 opener = urllib.request.build_opener(TestHandler)
 urllib.request.install_opener(opener)
@@ -45,14 +54,14 @@ class ClientTest(unittest.TestCase):
         response_filename = os.path.join(os.path.dirname(__file__), 'fixtures', 'response.xml')
         with open(response_filename, 'rb') as f:
             body = f.read()
-        TestHandler.response = FakeResponse(body)
+        TestHandler.response_body = body
 
         self.config = Configuration('apikey', 'http://localhost')
         self.client = Client(self.config)
 
     def tearDown(self):
         TestHandler.request = None
-        TestHandler.response = None
+        TestHandler.response_body = None
 
     def test_notify(self):
         try:
@@ -67,6 +76,51 @@ class ClientTest(unittest.TestCase):
         self.assertEqual(metadata.err_id, '7eafc85735047f2e5c9272b7')
         self.assertEqual(metadata.problem_id, '4886aba098109edbeb67a7f0')
 
+    def test_notify_with_json_format(self):
+        TestHandler.response_body = b'{"id": "1", "url": "http://localhost/locate/1"}'
+        self.config.notice_format = 'json'
+        try:
+            int('a')
+        except Exception:
+            metadata = self.client.notify()
+        request = TestHandler.request
+        self.assertEqual(request.get_full_url(), "http://localhost/api/v3/projects/apikey/notices?key=apikey")
+        self.assertEqual(request.get_header('Content-type'), 'application/json')
+        self.assertEqual(json.loads(request.data.decode('utf-8'))['errors'][0]['type'], 'ValueError')
+        self.assertEqual(metadata.url, "http://localhost/locate/1")
+
+    def test_notify_fire_and_forget(self):
+        client = Client(self.config, fire_and_forget=True)
+        try:
+            int('a')
+        except Exception:
+            expected_body = Notice.from_exception(self.config, sys.exc_info()).serialize()
+            self.assertIsNone(client.notify())
+        self.assertEqual(TestHandler.request.data, expected_body)
+
+    def test_notify_without_errbit_url(self):
+        self.config.errbit_url = None
+        try:
+            int('a')
+        except Exception:
+            self.assertIsNone(self.client.notify())
+        with self.assertRaises(ValueError):
+            with self.client.notify_on_exception():
+                int('a')
+        self.assertIsNone(TestHandler.request)
+
+    def test_notify_with_request_context(self):
+        with request_context(request_url='http://example.com/users', component='users',
+                             params=lambda: {'id': '1'}):
+            try:
+                int('a')
+            except Exception:
+                self.client.notify(action='show')
+        self.assertIn(b'<url>http://example.com/users</url>', TestHandler.request.data)
+        self.assertIn(b'<component>users</component>', TestHandler.request.data)
+        self.assertIn(b'<action>show</action>', TestHandler.request.data)
+        self.assertIn(b'<params><id>1</id></params>', TestHandler.request.data)
+
     def test_notify_on_exception(self):
         inner_exc_info = None
         try:
@@ -86,5 +140,261 @@ class ClientTest(unittest.TestCase):
         top_frame = '<line file="%s" method="%s" number="%d" />' % (filename, function_name, line_number)
         self.assertIn(top_frame.encode('utf-8'), TestHandler.request.data)
 
+    def test_notify_with_delivery_queue(self):
+        client = Client(self.config, delivery=DeliveryQueue())
+        try:
+            int('a')
+        except Exception:
+            future = client.notify()
+        self.assertIsInstance(future, NoticeFuture)
+        self.assertTrue(client.close(5))
+        self.assertEqual(future.result(0).id, '87186dda0c1d88569a171698')
+        self.assertEqual(TestHandler.request.get_full_url(), "http://localhost/notifier_api/v2/notices/")
+
+    def test_notify_with_pooled_transport(self):
+        server = StubServer()
+        client = Client(Configuration('apikey', server.url), transport=PooledTransport())
+        try:
+            for i in range(2):
+                try:
+                    int('a')
+                except Exception:
+                    metadata = client.notify(timeout=5)
+            self.assertEqual(metadata.id, '87186dda0c1d88569a171698')
+            self.assertEqual([r[0] for r in server.requests], ["/notifier_api/v2/notices/"] * 2)
+            self.assertEqual(len(server.connections), 1)
+        finally:
+            client.close()
+            server.stop()
+
+    def test_notify_with_deduplicator(self):
+        client = Client(self.config, deduplicator=Deduplicator())
+        results = []
+        for i in range(3):
+            try:
+                int('a')
+            except Exception:
+                results.append(client.notify())
+        self.assertEqual(results[0].id, '87186dda0c1d88569a171698')
+        self.assertEqual(results[1:], [None, None])
+
+        TestHandler.request = None
+        client.flush()
+        self.assertIn(b'<occurrences>2</occurrences>', TestHandler.request.data)
+
+    def test_close_with_deduplicator_while_errbit_is_unreachable(self):
+        server = StubServer()
+        server.stop()
+        metrics = InMemoryMetrics()
+        closed = []
+
+        class ClosingTransport(PooledTransport):
+            def close(self):
+                closed.append(True)
+                PooledTransport.close(self)
+
+        client = Client(Configuration('apikey', server.url), transport=ClosingTransport(),
+                        deduplicator=Deduplicator(), metrics=metrics)
+        for i in range(3):
+            try:
+                int('a')
+            except Exception:
+                if i == 0:
+                    self.assertRaises(EnvironmentError, client.notify, timeout=5)
+                else:
+                    self.assertIsNone(client.notify(timeout=5))
+        started = time.time()
+        self.assertTrue(client.close(5))
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual(metrics.snapshot()['counters']['notices.failed'], 2)
+        self.assertEqual(closed, [True])
+
+    def test_send_notices(self):
+        server = StubServer()
+        server.responses = [(200, {}), (500, {})]
+        client = Client(Configuration('apikey', server.url))
+        notices = [Notice(self.config, 'ValueError', str(i), []) for i in range(10)]
+        try:
+            results = client.send_notices(iter(notices), concurrency=2, timeout=5)
+        finally:
+            server.stop()
+        self.assertEqual(len(results), 10)
+        errors = [r for r in results if isinstance(r, Exception)]
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], urllib.error.HTTPError)
+        self.assertEqual(sum(1 for r in results if r is not errors[0] and r.id == '87186dda0c1d88569a171698'), 9)
+        self.assertEqual(sorted(r[2] for r in server.requests), sorted(n.serialize() for n in notices))
+        self.assertLessEqual(len(server.connections), 2)
+
+    def test_send_notices_keeps_order(self):
+        notices = [Notice(self.config, 'ValueError', str(i), []) for i in range(3)]
+        server = StubServer()
+        server.responses = [(200, {}), (500, {}), (200, {})]
+        client = Client(Configuration('apikey', server.url), transport=PooledTransport())
+        try:
+            results = client.send_notices(notices, concurrency=1)
+        finally:
+            client.close()
+            server.stop()
+        self.assertIsInstance(results[1], urllib.error.HTTPError)
+        self.assertEqual([r.id for r in (results[0], results[2])], ['87186dda0c1d88569a171698'] * 2)
+
+    def test_spools_notice_while_errbit_is_down(self):
+        directory = tempfile.mkdtemp()
+        server = StubServer()
+        server.responses = [(503, {})]
+        client = Client(Configuration('apikey', server.url), transport=PooledTransport(),
+                        spool=Spool(directory, min_backoff=0.01))
+        try:
+            try:
+                int('a')
+            except Exception:
+                self.assertIsNone(client.notify(timeout=5))
+            deadline = time.time() + 5
+            while len(server.requests) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(server.requests), 2)
+            self.assertEqual(server.requests[0][2], server.requests[1][2])
+        finally:
+            client.close(5)
+            server.stop()
+            shutil.rmtree(directory)
+
+    def test_counts_notices_the_spool_drops(self):
+        directory = tempfile.mkdtemp()
+        server = StubServer()
+        server.responses = [(503, {})]
+        metrics = InMemoryMetrics()
+        # too small for the notice
+        client = Client(Configuration('apikey', server.url), transport=PooledTransport(),
+                        spool=Spool(directory, max_bytes=100), metrics=metrics)
+        try:
+            try:
+                int('a')
+            except Exception:
+                self.assertIsNone(client.notify(timeout=5))
+        finally:
+            client.close(5)
+            server.stop()
+            shutil.rmtree(directory)
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters.get('notices.spool_dropped'), 1)
+        self.assertNotIn('notices.spooled', counters)
+
+    def test_notify_with_gzip(self):
+        self.config.gzip_threshold = 100
+        try:
+            int('a')
+        except Exception:
+            expected_body = Notice.from_exception(self.config, sys.exc_info()).serialize()
+            self.client.notify()
+        self.assertEqual(TestHandler.request.get_header('Content-encoding'), 'gzip')
+        body = gzip.GzipFile(fileobj=six.BytesIO(TestHandler.request.data)).read()
+        self.assertEqual(body, expected_body)
+
+    def test_notify_with_rate_limiter(self):
+        client = Client(self.config, rate_limiter=RateLimiter(rate=1, burst=1))
+        results = []
+        for i in range(2):
+            try:
+                int('a')
+            except Exception:
+                results.append(client.notify())
+        self.assertEqual(results[0].id, '87186dda0c1d88569a171698')
+        self.assertIsNone(results[1])
+        self.assertEqual(client.rate_limiter.stats()['dropped'], {'rate': 1})
+
+    def test_send_notices_with_rate_limiter(self):
+        server = StubServer()
+        metrics = InMemoryMetrics()
+        client = Client(Configuration('apikey', server.url), transport=PooledTransport(),
+                        rate_limiter=RateLimiter(rate=1, burst=2), metrics=metrics)
+        notices = [Notice(self.config, 'ValueError', str(i), []) for i in range(3)]
+        try:
+            self.assertEqual(client.send_notice(notices[0], timeout=5).id, '87186dda0c1d88569a171698')
+            results = client.send_notices(notices[1:], concurrency=1, timeout=5)
+        finally:
+            client.close()
+            server.stop()
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(results[0].id, '87186dda0c1d88569a171698')
+        self.assertIsNone(results[1])
+        self.assertIsNone(client.send_notice(notices[0]))
+        self.assertEqual(metrics.snapshot()['counters']['notices.rate_limited'], 2)
+
+    def test_circuit_breaker(self):
+        server = StubServer()
+        server.responses = [(503, {}), (503, {})]
+        fallen_back = []
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        metrics = InMemoryMetrics()
+        client = Client(Configuration('apikey', server.url), transport=PooledTransport(),
+                        circuit_breaker=breaker, metrics=metrics)
+        notice = Notice(self.config, 'ValueError', 'oops', [])
+        try:
+            for i in range(2):
+                self.assertRaises(urllib.error.HTTPError, client.send_notice, notice, timeout=5)
+            self.assertRaises(CircuitOpenError, client.send_notice, notice, timeout=5)
+            breaker.fallback = fallen_back.append
+            self.assertIsNone(client.send_notice(notice, timeout=5))
+        finally:
+            client.close()
+            server.stop()
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(fallen_back, [notice])
+        self.assertEqual(breaker.stats()['short_circuited'], 2)
+        # short-circuited notices aren't serialized
+        self.assertEqual(metrics.snapshot()['histograms']['serialize.seconds']['count'], 2)
+
+    def test_serialization_error_releases_circuit_breaker_probe(self):
+        class Unprintable(object):
+            def __str__(self):
+                raise ValueError("can't print")
+            __unicode__ = __str__
+
+        server = StubServer()
+        server.responses = [(503, {})]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        client = Client(Configuration('apikey', server.url), transport=PooledTransport(),
+                        circuit_breaker=breaker)
+        notice = Notice(self.config, 'ValueError', 'oops', [])
+        try:
+            self.assertRaises(urllib.error.HTTPError, client.send_notice, notice, timeout=5)
+            time.sleep(0.02)
+            bad_notice = Notice(self.config, 'ValueError', 'oops', [])
+            bad_notice.params = {'x': Unprintable()}
+            self.assertRaises(ValueError, client.send_notice, bad_notice, timeout=5)
+            self.assertEqual(client.send_notice(notice, timeout=5).id, '87186dda0c1d88569a171698')
+        finally:
+            client.close()
+            server.stop()
+        self.assertEqual(breaker.stats()['state'], 'closed')
+
+    def test_flush_without_delivery_queue(self):
+        self.assertTrue(self.client.flush())
+        self.assertTrue(self.client.close())
+
+    def test_notify_with_metrics(self):
+        metrics = InMemoryMetrics()
+        client = Client(self.config, metrics=metrics, rate_limiter=RateLimiter(rate=1, burst=1))
+        results = []
+        for i in range(2):
+            try:
+                int('a')
+            except Exception:
+                results.append(client.notify())
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'notices.sent': 1, 'notices.rate_limited': 1})
+        histograms = snapshot['histograms']
+        self.assertEqual(histograms['capture.seconds']['count'], 2)
+        for name in ('serialize.seconds', 'send.seconds'):
+            self.assertEqual(histograms[name]['count'], 1)
+        # the response is only parsed once the metadata is used
+        self.assertNotIn('parse.seconds', histograms)
+        results[0].id
+        results[0].url
+        self.assertEqual(metrics.snapshot()['histograms']['parse.seconds']['count'], 1)
+        self.assertEqual(histograms['payload.bytes']['sum'], len(TestHandler.request.data))
+
 if __name__ == '__main__':
     unittest.main()
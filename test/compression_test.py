@@ -0,0 +1,20 @@
+import gzip
+import unittest
+
+import six
+
+from errbit_reporter.compression import gzip_chunks, is_gzipped
+
+
+class GzipChunksTest(unittest.TestCase):
+
+    def test_below_threshold(self):
+        self.assertEqual(gzip_chunks([b'<notice>', b'</notice>'], 100), (b'<notice></notice>', False))
+
+    def test_at_threshold(self):
+        chunks = [b'<notice>', b'x' * 100, b'</notice>']
+        body, compressed = gzip_chunks(iter(chunks), 100, level=1)
+        self.assertTrue(compressed)
+        self.assertTrue(is_gzipped(body))
+        self.assertEqual(gzip.GzipFile(fileobj=six.BytesIO(body)).read(), b''.join(chunks))
+        self.assertFalse(is_gzipped(b''.join(chunks)))
@@ -9,3 +9,20 @@ class ConfigTest(unittest.TestCase):
                                errbit_url="http://localhost:3000")
         self.assertEqual(config.api_key, "c577a99769c12efee8637aa6caf81d5e")
         self.assertEqual(config.errbit_url, "http://localhost:3000")
+
+    def test_xml_fragments_are_cached(self):
+        config = Configuration(api_key="apikey", errbit_url="http://localhost:3000",
+                               project_root="/app", server_name="web1")
+        head, tail = config.xml_fragments
+        self.assertIs(config.xml_fragments[0], head)
+        self.assertIn(b'<api-key>apikey</api-key>', head)
+        self.assertIn(b'<project-root>/app/</project-root>', tail)
+        self.assertIn(b'<hostname>web1</hostname>', tail)
+
+    def test_xml_fragments_invalidated_on_reassignment(self):
+        config = Configuration(api_key="apikey", errbit_url="http://localhost:3000")
+        config.xml_fragments
+        config.environment_name = 'staging & test'
+        self.assertIn(b'<environment-name>staging &amp; test</environment-name>', config.xml_fragments[1])
+        config.api_key = 'other'
+        self.assertIn(b'<api-key>other</api-key>', config.xml_fragments[0])
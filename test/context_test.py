@@ -0,0 +1,91 @@
+import threading
+import unittest
+
+from errbit_reporter import Configuration, Notice, request_context, reset_context, set_context
+from errbit_reporter.context import apply_context
+
+
+def make_notice():
+    try:
+        raise ValueError("bad value")
+    except ValueError:
+        return Notice.from_exception(Configuration('apikey', 'http://localhost'))
+
+
+class RequestContextTest(unittest.TestCase):
+
+    def test_fills_unset_fields(self):
+        with request_context(request_url='http://example.com/a', component='users', params={'id': '1'}):
+            notice = make_notice()
+            notice.component = 'explicit'
+            apply_context(notice)
+        self.assertEqual(notice.request_url, 'http://example.com/a')
+        self.assertEqual(notice.component, 'explicit')
+        self.assertEqual(notice.params, {'id': '1'})
+        self.assertEqual(notice.session, {})
+
+    def test_callables_only_called_on_error(self):
+        calls = []
+
+        def params():
+            calls.append(1)
+            return {'id': '2'}
+
+        with request_context(params=params):
+            self.assertEqual(calls, [])
+            notice = make_notice()
+            apply_context(notice)
+        self.assertEqual(calls, [1])
+        self.assertEqual(notice.params, {'id': '2'})
+
+    def test_failing_callable(self):
+        def session():
+            raise KeyError('user')
+
+        with request_context(session=session):
+            notice = make_notice()
+            apply_context(notice)
+        self.assertIn("KeyError", notice.session)
+
+    def test_nesting_and_reset(self):
+        token = set_context(component='outer', action='index')
+        try:
+            with request_context(action='show'):
+                notice = make_notice()
+                apply_context(notice)
+                self.assertEqual((notice.component, notice.action), ('outer', 'show'))
+            notice = make_notice()
+            apply_context(notice)
+            self.assertEqual((notice.component, notice.action), ('outer', 'index'))
+        finally:
+            reset_context(token)
+        notice = make_notice()
+        apply_context(notice)
+        self.assertEqual((notice.component, notice.action), (None, None))
+
+    def test_unknown_field(self):
+        self.assertRaises(TypeError, set_context, user='bob')
+
+    def test_threads_are_isolated(self):
+        seen = {}
+
+        def work(name):
+            with request_context(component=name):
+                barrier.wait()
+                notice = make_notice()
+                apply_context(notice)
+                seen[name] = notice.component
+
+        barrier = threading.Barrier(2) if hasattr(threading, 'Barrier') else None
+        if barrier is None:
+            self.skipTest("needs threading.Barrier")
+        threads = [threading.Thread(target=work, args=(name,)) for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(seen, {'a': 'a', 'b': 'b'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import threading
+import unittest
+
+from errbit_reporter import Configuration, Notice, Deduplicator
+from errbit_reporter.cache import LRUCache
+from errbit_reporter.dedup import fingerprint, message_template
+
+
+class DeduplicatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Configuration('apikey', 'http://localhost:3000')
+        self.backtrace = [('foo/main.py', 5, 'foo', None), ('foo/main.py', 8, 'bar', None)]
+
+    def notice(self, message="invalid literal for int() with base 10: 'a'", backtrace=None):
+        return Notice(self.config, 'ValueError', message, backtrace or self.backtrace)
+
+    def test_message_template(self):
+        self.assertEqual(message_template("user 42 not found at 0xdeadbeef: 'bob'"),
+                         "user ? not found at ?: ?")
+        self.assertEqual(message_template(None), '')
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint(self.notice("id 1")), fingerprint(self.notice("id 2")))
+        self.assertNotEqual(fingerprint(self.notice("id 1")), fingerprint(self.notice("key 1")))
+        other_backtrace = [('foo/main.py', 9, 'baz', None)]
+        self.assertNotEqual(fingerprint(self.notice()), fingerprint(self.notice(backtrace=other_backtrace)))
+
+    def test_collapses_repeats_within_window(self):
+        dedup = Deduplicator(window=10)
+        first = self.notice()
+        self.assertEqual(dedup.filter(first, now=0), [first])
+        self.assertEqual(dedup.filter(self.notice(), now=1), [])
+        last = self.notice()
+        self.assertEqual(dedup.filter(last, now=2), [])
+
+        after_window = self.notice()
+        follow_up, notice = dedup.filter(after_window, now=10)
+        self.assertIs(notice, after_window)
+        self.assertEqual(follow_up.cgi_data, {'occurrences': 2})
+        self.assertEqual(last.cgi_data, {})
+
+    def test_window_without_repeats(self):
+        dedup = Deduplicator(window=10)
+        dedup.filter(self.notice(), now=0)
+        notice = self.notice()
+        self.assertEqual(dedup.filter(notice, now=10), [notice])
+
+    def test_eviction_sends_follow_up(self):
+        dedup = Deduplicator(max_entries=1)
+        dedup.filter(self.notice(), now=0)
+        dedup.filter(self.notice(), now=1)
+        other = self.notice(backtrace=[('foo/main.py', 9, 'baz', None)])
+        follow_up, notice = dedup.filter(other, now=2)
+        self.assertIs(notice, other)
+        self.assertEqual(follow_up.cgi_data['occurrences'], 1)
+
+    def test_windows_are_bounded_by_max_entries(self):
+        dedup = Deduplicator(max_entries=10)
+        for i in range(1000):
+            dedup.filter(self.notice(backtrace=[('foo/main.py', i, 'foo', None)]), now=i / 1000.0)
+        self.assertLessEqual(len(dedup._windows), 20)
+        dedup.filter(self.notice(backtrace=[('foo/main.py', 999, 'foo', None)]), now=1)
+        follow_up, notice = dedup.filter(self.notice(), now=100)
+        self.assertEqual(follow_up.cgi_data['occurrences'], 1)
+
+    def test_drain(self):
+        dedup = Deduplicator()
+        dedup.filter(self.notice(), now=0)
+        dedup.filter(self.notice(), now=1)
+        self.assertEqual([n.cgi_data['occurrences'] for n in dedup.drain()], [1])
+        self.assertEqual(dedup.drain(), [])
+
+    def test_sends_follow_up_when_window_ends(self):
+        dedup = Deduplicator(window=0.05)
+        sent = []
+        done = threading.Event()
+        dedup.start(lambda notice: (sent.append(notice), done.set()))
+        self.addCleanup(dedup.stop)
+        for i in range(3):
+            dedup.filter(self.notice())
+        self.assertTrue(done.wait(5))
+        self.assertEqual([notice.cgi_data['occurrences'] for notice in sent], [2])
+        self.assertEqual(dedup.drain(), [])
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        self.assertEqual(cache.set('c', 3), ('b', 2))
+        self.assertEqual(sorted(cache.items()), [('a', 1), ('c', 3)])
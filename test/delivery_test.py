@@ -0,0 +1,95 @@
+import threading
+import unittest
+
+from errbit_reporter.delivery import (DeliveryQueue, NoticeFuture, NoticeDropped, DeliveryTimeout,
+                                      DROP_OLDEST, BLOCK)
+
+
+class DeliveryQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gate = threading.Event()
+        self.started = threading.Event()
+
+    def blocked(self, value):
+        self.started.set()
+        self.gate.wait(5)
+        return value
+
+    def test_submit_returns_result(self):
+        queue = DeliveryQueue()
+        future = queue.submit(lambda a, b: a + b, 1, b=2)
+        self.assertEqual(future.result(5), 3)
+        self.assertTrue(queue.close(5))
+
+    def test_exception_is_reported_through_future(self):
+        queue = DeliveryQueue()
+        future = queue.submit(int, 'a')
+        self.assertIsInstance(future.exception(5), ValueError)
+        self.assertRaises(ValueError, future.result, 5)
+        queue.close(5)
+
+    def test_drop_newest(self):
+        queue = DeliveryQueue(maxsize=1)
+        first = queue.submit(self.blocked, 1)
+        self.started.wait(5)
+        second = queue.submit(self.blocked, 2)
+        third = queue.submit(self.blocked, 3)
+        self.assertIsInstance(third.exception(0), NoticeDropped)
+        self.gate.set()
+        self.assertEqual([first.result(5), second.result(5)], [1, 2])
+        self.assertEqual(queue.dropped, 1)
+        queue.close(5)
+
+    def test_drop_oldest(self):
+        queue = DeliveryQueue(maxsize=1, overflow=DROP_OLDEST)
+        first = queue.submit(self.blocked, 1)
+        self.started.wait(5)
+        second = queue.submit(self.blocked, 2)
+        third = queue.submit(self.blocked, 3)
+        self.assertIsInstance(second.exception(0), NoticeDropped)
+        self.gate.set()
+        self.assertEqual([first.result(5), third.result(5)], [1, 3])
+        queue.close(5)
+
+    def test_block_with_deadline(self):
+        queue = DeliveryQueue(maxsize=1, overflow=BLOCK, block_timeout=0.01)
+        queue.submit(self.blocked, 1)
+        self.started.wait(5)
+        queue.submit(self.blocked, 2)
+        self.assertIsInstance(queue.submit(self.blocked, 3).exception(0), NoticeDropped)
+        self.gate.set()
+        self.assertTrue(queue.flush(5))
+        queue.close(5)
+
+    def test_submit_nowait_doesnt_block(self):
+        queue = DeliveryQueue(maxsize=1, overflow=BLOCK, block_timeout=5)
+        queue.submit(self.blocked, 1)
+        self.started.wait(5)
+        queue.submit_nowait(self.blocked, 2)
+        self.assertIsInstance(queue.submit_nowait(self.blocked, 3).exception(0), NoticeDropped)
+        self.gate.set()
+        self.assertTrue(queue.flush(5))
+        queue.close(5)
+
+    def test_flush_timeout(self):
+        queue = DeliveryQueue()
+        queue.submit(self.blocked, 1)
+        self.assertFalse(queue.flush(0.01))
+        self.gate.set()
+        self.assertTrue(queue.flush(5))
+        queue.close(5)
+
+    def test_submit_after_close(self):
+        queue = DeliveryQueue()
+        queue.close()
+        self.assertIsInstance(queue.submit(int, '1').exception(0), NoticeDropped)
+
+    def test_future_timeout(self):
+        future = NoticeFuture()
+        self.assertRaises(DeliveryTimeout, future.result, 0)
+        calls = []
+        future.add_done_callback(calls.append)
+        future.set_result(1)
+        self.assertEqual(calls, [future])
+        self.assertEqual(future.result(), 1)
@@ -0,0 +1,162 @@
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import unittest
+
+from errbit_reporter import (Configuration, Client, Notice, DeliveryQueue, PooledTransport, RetryPolicy,
+                             RetryScheduler, Spool)
+
+from test.stub_server import StubServer
+
+
+def fork(child):
+    """Run child in a forked process, returning its pid
+
+    The child exits with status 0 if child returns True.
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = child()
+        except BaseException:
+            ok = False
+        os._exit(0 if ok else 1)
+    return pid
+
+
+@unittest.skipUnless(hasattr(os, 'fork') and hasattr(os, 'register_at_fork'),
+                     "fork safety requires os.register_at_fork")
+class ForkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.config = Configuration('apikey', self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def notice(self, message):
+        return Notice(self.config, 'ValueError', message, [])
+
+    def wait(self, pid):
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def messages(self):
+        return sorted(body.split(b'<message>')[1].split(b'</message>')[0]
+                      for path, headers, body in self.server.requests)
+
+    def test_backtraces_after_fork_while_path_lock_is_held(self):
+        from errbit_reporter import notice
+
+        def child():
+            # killed by the alarm if the lock is still held
+            signal.alarm(5)
+            return len(Notice(self.config, 'ValueError', 'child').backtrace) > 0
+        with notice._path_lock:
+            pid = fork(child)
+        self.wait(pid)
+
+    def test_concurrent_sends_after_fork(self):
+        client = Client(self.config, transport=PooledTransport())
+        client.send_notice(self.notice('parent-0'), timeout=5)
+
+        def child():
+            for i in range(10):
+                client.send_notice(self.notice('child-%d' % i), timeout=5)
+            return True
+        pids = [fork(child) for i in range(3)]
+        for i in range(1, 11):
+            client.send_notice(self.notice('parent-%d' % i), timeout=5)
+        for pid in pids:
+            self.wait(pid)
+        client.close()
+        self.assertEqual(len(self.server.requests), 41)
+        self.assertEqual(self.messages().count(b'child-0'), 3)
+
+    def test_queued_notices_are_only_sent_by_parent(self):
+        client = Client(self.config, transport=PooledTransport(), delivery=DeliveryQueue())
+        gate = threading.Event()
+        client.delivery.submit(gate.wait, 5)
+        queued = client.delivery.submit(client.send_notice, self.notice('queued'), timeout=5)
+
+        def child():
+            future = client.delivery.submit(client.send_notice, self.notice('child'), timeout=5)
+            future.result(5)
+            return client.close(5)
+        pid = fork(child)
+        self.wait(pid)
+        gate.set()
+        queued.result(5)
+        client.close(5)
+        self.assertEqual(self.messages(), [b'child', b'queued'])
+
+    def test_pending_retries_are_only_sent_by_parent(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        scheduler = RetryScheduler()
+        self.server.responses.append((503, {}))
+        client = Client(self.config, transport=PooledTransport(), spool=Spool(directory), retry_policy=RetryPolicy(
+            initial_backoff=0.5, jitter=0, scheduler=scheduler))
+        future = client.send_notice(self.notice('retried'), timeout=5)
+
+        def child():
+            closed = client.close(5)
+            return closed and len(scheduler) == 0
+        pid = fork(child)
+        self.wait(pid)
+        self.assertEqual(len(scheduler), 1)
+        future.result(5)
+        client.close(5)
+        self.assertEqual(self.messages(), [b'retried', b'retried'])
+        spooled = []
+        Spool(directory).drain(spooled.append)
+        self.assertEqual(spooled, [])
+
+    def test_spool_shared_after_fork(self):
+        directory = tempfile.mkdtemp()
+        try:
+            spool = Spool(directory)
+            spool.append(self.notice('parent-before').serialize())
+
+            def child():
+                spool.append(self.notice('child').serialize())
+                spool.close()
+                return True
+            pid = fork(child)
+            spool.append(self.notice('parent-after').serialize())
+            self.wait(pid)
+            spool.close()
+
+            sent = []
+            Spool(directory).drain(sent.append)
+            self.assertEqual(len(sent), 3)
+            self.assertEqual(len(set(sent)), 3)
+
+            # a child that appends only after the parent drained segments
+            # must not reuse their numbers, which are behind the cursor
+            spool = Spool(directory)
+            ready, go = os.pipe()
+
+            def late_child():
+                os.read(ready, 1)
+                spool.append(self.notice('late-child').serialize())
+                spool.close()
+                return True
+            pid = fork(late_child)
+            try:
+                for message in ('parent-1', 'parent-2'):
+                    spool.append(self.notice(message).serialize())
+                    self.assertEqual(spool.drain(sent.append), (1, False))
+            finally:
+                os.write(go, b'x')
+                self.wait(pid)
+                os.close(ready)
+                os.close(go)
+
+            Spool(directory).drain(sent.append)
+            self.assertEqual(len(sent), 6)
+            self.assertIn(b'late-child', sent[-1])
+        finally:
+            shutil.rmtree(directory)
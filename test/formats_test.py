@@ -0,0 +1,26 @@
+import unittest
+
+from errbit_reporter import Configuration, Notice, formats
+
+
+class FormatsTest(unittest.TestCase):
+
+    def notice(self, **options):
+        config = Configuration('apikey', 'http://localhost:3000', **options)
+        notice = Notice(config, 'ValueError', 'oops', [])
+        notice.params = dict(('key%d' % i, 'value') for i in range(100))
+        return notice
+
+    def test_for_payload(self):
+        for notice_format in ('xml', 'json'):
+            for gzip_threshold in (None, 0):
+                notice = self.notice(notice_format=notice_format, gzip_threshold=gzip_threshold)
+                body, headers = formats.encode_notice(notice.config, notice)
+                detected = formats.for_payload(body)
+                self.assertIs(detected, formats.FORMATS[notice_format])
+                self.assertEqual(formats.payload_headers(detected, body), headers)
+
+    def test_json_path(self):
+        json_format = formats.get('json')
+        self.assertEqual(json_format.path('key', None), '/api/v3/projects/key/notices?key=key')
+        self.assertEqual(json_format.path('key', '42'), '/api/v3/projects/42/notices?key=key')
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+import unittest
+from xml.etree import cElementTree as ET
+
+from errbit_reporter import Client, Configuration, DeliveryQueue, ErrbitHandler
+from errbit_reporter.delivery import BLOCK
+
+
+class RecordingTransport(object):
+    def __init__(self):
+        self.bodies = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def post(self, url, body, headers, timeout=None, read_response=True):
+        self.release.wait()
+        self.bodies.append(body)
+        return None
+
+    def close(self):
+        pass
+
+
+class ErrbitHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = RecordingTransport()
+        self.client = Client(Configuration('apikey', 'http://localhost'), transport=self.transport)
+        self.logger = logging.getLogger('errbit_reporter.test.%s' % self._testMethodName)
+        self.logger.propagate = False
+
+    def add_handler(self, **kwargs):
+        handler = ErrbitHandler(self.client, **kwargs)
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        return handler
+
+    def notices(self, handler):
+        handler.close()
+        return [ET.fromstring(body) for body in self.transport.bodies]
+
+    def test_exception(self):
+        handler = self.add_handler()
+        try:
+            int('a')
+        except ValueError:
+            self.logger.exception("parsing %s", 'a')
+        notice, = self.notices(handler)
+        self.assertEqual(notice.findtext('./error/class'), 'ValueError')
+        self.assertEqual(notice.findtext('./request/component'), self.logger.name)
+        self.assertEqual(notice.findtext('./request/action'), 'test_exception')
+        self.assertEqual(notice.findtext('./request/params/message'), 'parsing a')
+
+    def test_record_without_exception(self):
+        handler = self.add_handler()
+        self.logger.error("something %s", 'failed')
+        self.logger.warning("ignored below the level")
+        notice, = self.notices(handler)
+        self.assertEqual(notice.findtext('./error/class'), 'ERROR')
+        self.assertEqual(notice.findtext('./error/message'), 'something failed')
+        line = notice.find('./error/backtrace/line')
+        self.assertEqual(line.attrib['method'], 'test_record_without_exception')
+
+    def test_rate_per_logger(self):
+        handler = self.add_handler(rate=0, burst=2)
+        for i in range(3):
+            self.logger.error("error %d", i)
+        other = logging.getLogger(self.logger.name + '.other')
+        other.propagate = False
+        other.addHandler(handler)
+        self.addCleanup(other.removeHandler, handler)
+        other.error("other logger")
+        self.assertEqual(len(self.notices(handler)), 3)
+        self.assertEqual(handler.dropped, 1)
+
+    def test_emit_does_not_wait_on_errbit(self):
+        handler = self.add_handler()
+        self.transport.release.clear()
+        started = time.time()
+        self.logger.error("errbit is slow")
+        self.assertLess(time.time() - started, 0.5)
+        self.transport.release.set()
+        self.assertEqual(len(self.notices(handler)), 1)
+
+    def test_emit_does_not_block_on_full_client_queue(self):
+        delivery = DeliveryQueue(maxsize=1, overflow=BLOCK, block_timeout=5)
+        self.client = Client(self.client.config, delivery=delivery, transport=self.transport)
+        self.add_handler()
+        self.transport.release.clear()
+        started = time.time()
+        for i in range(3):
+            self.logger.error("errbit is slow %d", i)
+        self.assertLess(time.time() - started, 0.5)
+        self.assertGreaterEqual(delivery.dropped, 1)
+        self.transport.release.set()
+        self.client.close(5)
+
+    def test_close_doesnt_wait_on_errbit_past_timeout(self):
+        handler = self.add_handler(close_timeout=0.1)
+        self.transport.release.clear()
+        self.logger.error("errbit is down")
+        started = time.time()
+        handler.close()
+        self.assertLess(time.time() - started, 1)
+        self.transport.release.set()
@@ -0,0 +1,45 @@
+import ast
+import os
+import subprocess
+import sys
+import unittest
+
+from benchmarks.import_time import heavy_modules_loaded
+
+
+class ImportTest(unittest.TestCase):
+
+    @unittest.skipIf(sys.version_info < (3, 7), "names are imported eagerly before python 3.7")
+    def test_disabled_client_imports_no_slow_modules(self):
+        self.assertEqual(heavy_modules_loaded(), [])
+
+    @unittest.skipIf(sys.version_info >= (3, 7), "names are imported lazily on python 3.7+")
+    def test_import_under_hash_seeds(self):
+        # python 2 and 3.5 load the names in _EXPORTS order, which must not
+        # depend on string hashes
+        script = 'import errbit_reporter; [getattr(errbit_reporter, name) for name in errbit_reporter.__all__]'
+        for seed in ('0', '2', '3', '4', '6', '9', '10', '11'):
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            subprocess.check_call([sys.executable, '-c', script], env=env)
+
+    def test_exports_are_ordered_by_dependency(self):
+        # before python 3.7 each module is imported in _EXPORTS order, so
+        # names it imports from the package must have been loaded before it
+        import errbit_reporter
+        package_dir = os.path.dirname(errbit_reporter.__file__)
+        loaded = set()
+        for name, module in errbit_reporter._EXPORTS:
+            filename = os.path.join(package_dir, module.split('.')[-1] + '.py')
+            with open(filename) as f:
+                tree = ast.parse(f.read(), filename)
+            for node in ast.walk(tree):
+                if isinstance(node, ast.ImportFrom) and node.module == 'errbit_reporter':
+                    for alias in node.names:
+                        if alias.name in errbit_reporter._MODULES:
+                            self.assertIn(alias.name, loaded, "%s imports %s before it is loaded"
+                                          % (module, alias.name))
+            loaded.add(name)
+
+    def test_submodules_are_attributes(self):
+        script = 'import errbit_reporter; errbit_reporter.delivery.DROP_OLDEST; errbit_reporter.client.Client'
+        subprocess.check_call([sys.executable, '-c', script])
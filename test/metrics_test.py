@@ -0,0 +1,55 @@
+import unittest
+
+from errbit_reporter import CallbackMetrics, InMemoryMetrics
+from errbit_reporter.metrics import Histogram
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for value in range(1, 1001):
+            histogram.add(value / 1000.0)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 1000)
+        self.assertEqual((summary['min'], summary['max']), (0.001, 1.0))
+        self.assertAlmostEqual(summary['p50'], 0.5, delta=0.05)
+        self.assertAlmostEqual(summary['p99'], 0.99, delta=0.05)
+
+    def test_zero_and_empty(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(0.5))
+        histogram.add(0)
+        histogram.add(0)
+        histogram.add(10)
+        self.assertEqual(histogram.percentile(0.5), 0)
+        self.assertEqual(histogram.percentile(1), 10)
+
+
+class InMemoryMetricsTest(unittest.TestCase):
+
+    def test_snapshot(self):
+        metrics = InMemoryMetrics()
+        metrics.increment('notices.sent')
+        metrics.increment('notices.sent', 2)
+        metrics.gauge('queue.depth', 3)
+        metrics.gauge('queue.depth', 1)
+        metrics.observe('payload.bytes', 100)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'notices.sent': 3})
+        self.assertEqual(snapshot['gauges'], {'queue.depth': 1})
+        self.assertEqual(snapshot['histograms']['payload.bytes']['sum'], 100)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot()['counters'], {})
+
+
+class CallbackMetricsTest(unittest.TestCase):
+
+    def test_callback(self):
+        calls = []
+        metrics = CallbackMetrics(lambda *args: calls.append(args))
+        metrics.increment('notices.sent')
+        metrics.observe('send.seconds', 0.5)
+        metrics.gauge('queue.depth', 2)
+        self.assertEqual(calls, [('increment', 'notices.sent', 1), ('observe', 'send.seconds', 0.5),
+                                 ('gauge', 'queue.depth', 2)])
@@ -1,9 +1,13 @@
+import json
 import sys
 import os.path
 import traceback
 import unittest
+from collections import OrderedDict
 from xml.etree import cElementTree as ET
 
+import six
+
 from errbit_reporter import Configuration, Notice, NoticeMetadata
 
 
@@ -40,7 +44,52 @@ class NoticeTest(unittest.TestCase):
 
         self.assertEqual(notice.error_class, 'ValueError')
         self.assertEqual(notice.error_message, 'ValueError: oops')
-        self.assertEqual(notice.backtrace, traceback.extract_tb(exc_tb))
+        expect = [tuple(frame)[:3] + (None,) for frame in traceback.extract_tb(exc_tb)]
+        self.assertEqual(notice.backtrace, expect)
+
+    def test_backtrace_from_current_stack(self):
+        notice = Notice(self.config, 'RuntimeError', 'oops')
+        line_number = sys._getframe().f_lineno - 1
+        self.assertEqual(notice.backtrace[-2],
+                         (os.path.abspath(__file__.replace('.pyc', '.py')), line_number,
+                          'test_backtrace_from_current_stack', None))
+        # the innermost frame is Notice.__init__, as with traceback.extract_stack()
+        filename, line_number, function_name, text = notice.backtrace[-1]
+        self.assertEqual(os.path.basename(filename), 'notice.py')
+        self.assertEqual(function_name, '__init__')
+        self.assertEqual(len(notice.backtrace), len(traceback.extract_stack()) + 1)
+
+    def test_backtrace_entries_are_shared(self):
+        notices = []
+        for i in range(2):
+            try:
+                int('a')
+            except ValueError:
+                notices.append(Notice.from_exception(self.config))
+        first, second = [notice.backtrace for notice in notices]
+        self.assertEqual(first, second)
+        self.assertIs(first[0], second[0])
+
+        given = Notice(self.config, 'IndexError', 'oops', [('foo/main.py', 5, 'foo', 'bar([])')])
+        self.assertEqual(given.backtrace, [('foo/main.py', 5, 'foo', None)])
+
+    def test_detach_releases_frames(self):
+        try:
+            int('a')
+        except ValueError:
+            notice = Notice.from_exception(self.config)
+            expect = [tuple(frame)[:3] + (None,) for frame in traceback.extract_tb(sys.exc_info()[2])]
+        notice._detach()
+        self.assertIsNone(notice._backtrace_source)
+        self.assertIsNotNone(notice._backtrace)
+        self.assertEqual(notice.backtrace, expect)
+
+    def test_slots(self):
+        notice = Notice(self.config, 'RuntimeError', 'oops', [])
+        for obj in (notice, self.config, NoticeMetadata(self.config, '1', '2', '3', '4', None, None)):
+            self.assertFalse(hasattr(obj, '__dict__'))
+        with self.assertRaises(AttributeError):
+            notice.extra = 1
 
     def test_from_exception_without_exception(self):
         exc = None
@@ -63,6 +112,112 @@ class NoticeTest(unittest.TestCase):
         refs = [e.text for e in tree.findall('./request/params/attributes/refs/item')]
         self.assertEqual(refs, ['2', '3'])
 
+    def test_serialize_matches_tree_serializer(self):
+        backtrace = [
+            ('/app/foo/main.py', 11, '<module>', 'foo()'),
+            ('foo/"quoted" & <tagged>.py', '12', 'new\nline', None),
+        ]
+        notice = Notice(self.config, 'IndexError', u'list index out of range <\xe9> & \udc80', backtrace)
+        notice.request_url = 'http://example.com/?a=1&b=2'
+        notice.component = ''
+        notice.params = {
+            'empty': {},
+            'list': [1, [], {'nested': None}, 'snowman'],
+            'text': 'a > b',
+        }
+        notice.cgi_data = {'HTTP_USER_AGENT': 'curl'}
+        self.assertEqual(notice.serialize(), notice.serialize_tree())
+        self.assertEqual(b''.join(notice.iter_serialize()), notice.serialize())
+
+        empty = Notice(self.config, 'IndexError', None, [])
+        self.assertEqual(empty.serialize(), empty.serialize_tree())
+
+    def test_serialize_escapes_whitespace_in_attributes(self):
+        # like ElementTree on python 3.7+, while older versions don't
+        # escape carriage returns and tabs
+        backtrace = [('main.py', 1, 'tab\tnew\r\nline', None)]
+        notice = Notice(self.config, 'IndexError', 'oops', backtrace)
+        self.assertIn(b'method="tab&#09;new&#13;&#10;line"', notice.serialize())
+        tree = ET.fromstring(notice.serialize())
+        self.assertEqual(tree.find('./error/backtrace/line').attrib['method'], 'tab\tnew\r\nline')
+
+    def test_payload_limits(self):
+        config = Configuration('apikey', 'http://localhost:3000', max_depth=1, max_keys=2,
+                               max_list_items=2, max_string_length=5)
+        notice = Notice(config, 'IndexError', 'list index out of range', [])
+        # ordered, since which keys are beyond max_keys depends on the order
+        notice.params = OrderedDict([
+            ('deep', {'a': {'b': 1}}),
+            ('list', [1, 2, 3, 4]),
+            ('long', 'abcdefghij'),
+        ])
+        xml = notice.serialize()
+        self.assertEqual(xml, notice.serialize_tree())
+        tree = ET.fromstring(xml)
+        self.assertEqual(tree.findtext('./request/params/deep/a'), '[max depth exceeded]')
+        self.assertEqual([e.text for e in tree.findall('./request/params/list/item')],
+                         ['1', '2', '[2 more items]'])
+        self.assertIsNone(tree.find('./request/params/long'))
+        self.assertEqual(tree.findtext('./request/params/_truncated'), '[1 more keys]')
+
+        notice.params = {'long': 'abcdefghij'}
+        tree = ET.fromstring(notice.serialize())
+        self.assertEqual(tree.findtext('./request/params/long'), 'abcde... [5 more characters]')
+
+    def test_payload_byte_budget(self):
+        config = Configuration('apikey', 'http://localhost:3000', max_payload_bytes=100)
+        notice = Notice(config, 'IndexError', 'list index out of range', [])
+        notice.params = dict(('key%d' % i, 'x' * 30) for i in range(100))
+        notice.cgi_data = {'HTTP_USER_AGENT': 'curl'}
+        xml = notice.serialize()
+        self.assertEqual(xml, notice.serialize_tree())
+        tree = ET.fromstring(xml)
+        self.assertLess(len(xml), 1000)
+        self.assertEqual(len(tree.findall('./request/params/*')), 4)
+        self.assertEqual(tree.findtext('./request/params/_truncated'), '[97 more keys]')
+        self.assertEqual(tree.findtext('./request/cgi-data/_truncated'), '[1 more keys]')
+
+    def test_serialize_json(self):
+        backtrace = [
+            ('/app/main.py', 11, '<module>', None),
+            ('/app/foo.py', 8, 'bar', None),
+        ]
+        config = Configuration('apikey', 'http://localhost:3000', project_root='/app', server_name='web1',
+                               max_depth=1, max_keys=2, max_list_items=2)
+        notice = Notice(config, 'IndexError', 'list index out of range', backtrace)
+        notice.request_url = 'http://example.com/'
+        notice.params = OrderedDict([
+            ('deep', {'a': {'b': 1}}),
+            ('list', [1, 2, 3, 4]),
+            ('long', 'abcdefghij'),
+        ])
+        notice.cgi_data = {'HTTP_USER_AGENT': 'curl'}
+        payload = json.loads(notice.serialize_json().decode('utf-8'))
+
+        error, = payload['errors']
+        self.assertEqual((error['type'], error['message']), ('IndexError', 'list index out of range'))
+        self.assertEqual(error['backtrace'], [
+            {'file': '[PROJECT_ROOT]/foo.py', 'line': 8, 'function': 'bar'},
+            {'file': '[PROJECT_ROOT]/main.py', 'line': 11, 'function': '<module>'},
+        ])
+        context = payload['context']
+        self.assertEqual(context['url'], 'http://example.com/')
+        self.assertEqual(context['hostname'], 'web1')
+        self.assertEqual(context['rootDirectory'], '/app/')
+        self.assertEqual(context['notifier']['name'], config.notifier_name)
+        self.assertEqual(payload['params'], {
+            'deep': {'a': '[max depth exceeded]'},
+            'list': ['1', '2', '[2 more items]'],
+            '_truncated': '[1 more keys]',
+        })
+        self.assertEqual(payload['environment'], {'HTTP_USER_AGENT': 'curl'})
+
+    def test_write(self):
+        notice = Notice(self.config, 'IndexError', 'list index out of range', [])
+        buffer = six.BytesIO()
+        notice.write(buffer)
+        self.assertEqual(buffer.getvalue(), notice.serialize())
+
     def test_metadata_from_response(self):
         fixture_path = os.path.join(os.path.dirname(__file__), 'fixtures', 'response.xml')
         with open(fixture_path, 'rb') as f:
@@ -75,3 +230,18 @@ class NoticeTest(unittest.TestCase):
         self.assertEqual(metadata.created_at, '2014-07-14T10:50:02-04:00')
         self.assertEqual(metadata.updated_at, '2014-07-14T10:50:02-04:00')
         self.assertEqual(metadata.url, "http://localhost:3000/apps/ff283e00de6339078233c722/errs/4886aba098109edbeb67a7f0/notices/87186dda0c1d88569a171698")
+
+    def test_metadata_is_parsed_on_first_use(self):
+        metadata = NoticeMetadata.from_notice_xml(self.config, b'not xml')
+        with self.assertRaises(Exception):
+            metadata.id
+        metadata = NoticeMetadata.from_notice_xml(self.config, b'<notice><_id>1</_id></notice>')
+        metadata.app_id = '2'
+        self.assertEqual((metadata.id, metadata.app_id, metadata.err_id), ('1', '2', None))
+
+    def test_metadata_from_json_response(self):
+        body = b'{"id": "87186dda0c1d88569a171698", "url": "http://localhost:3000/locate/87186dda0c1d88569a171698"}'
+        metadata = NoticeMetadata.from_notice_json(self.config, body)
+        self.assertEqual(metadata.id, '87186dda0c1d88569a171698')
+        self.assertIsNone(metadata.app_id)
+        self.assertEqual(metadata.url, 'http://localhost:3000/locate/87186dda0c1d88569a171698')
@@ -0,0 +1,62 @@
+import unittest
+
+from errbit_reporter import Configuration, Notice, RateLimiter
+from errbit_reporter.ratelimit import TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_refills_at_rate(self):
+        bucket = TokenBucket(2, burst=2, now=0)
+        self.assertEqual([bucket.consume(now=0) for i in range(3)], [True, True, False])
+        self.assertTrue(bucket.consume(now=0.5))
+        self.assertFalse(bucket.consume(now=0.5))
+        self.assertEqual([bucket.consume(now=10) for i in range(3)], [True, True, False])
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Configuration('apikey', 'http://localhost:3000')
+
+    def notice(self, error_class='ValueError', line=1):
+        return Notice(self.config, error_class, 'oops', [('app.py', line, 'handler', None)])
+
+    def test_global_rate(self):
+        limiter = RateLimiter(rate=1, burst=2)
+        allowed = [limiter.allow(self.notice(), now=0) for i in range(3)]
+        self.assertEqual(allowed, [True, True, False])
+        self.assertTrue(limiter.allow(self.notice(), now=1))
+        self.assertEqual(limiter.stats()['dropped'], {'rate': 1})
+
+    def test_per_class_rate(self):
+        limiter = RateLimiter(per_class_rate=1)
+        self.assertTrue(limiter.allow(self.notice('ValueError'), now=0))
+        self.assertFalse(limiter.allow(self.notice('ValueError'), now=0))
+        self.assertTrue(limiter.allow(self.notice('KeyError'), now=0))
+        self.assertEqual(limiter.stats()['dropped_by_class'], {'ValueError': 1})
+
+    def test_per_fingerprint_rate(self):
+        limiter = RateLimiter(per_fingerprint_rate=1)
+        self.assertTrue(limiter.allow(self.notice(line=1), now=0))
+        self.assertFalse(limiter.allow(self.notice(line=1), now=0))
+        self.assertTrue(limiter.allow(self.notice(line=2), now=0))
+        self.assertEqual(limiter.dropped, {'fingerprint_rate': 1})
+
+    def test_sample_rates(self):
+        limiter = RateLimiter(sample_rates={'ValueError': 0.5}, default_sample_rate=0)
+        limiter.random = [0.6, 0.4].pop
+        self.assertTrue(limiter.allow(self.notice()))
+        self.assertFalse(limiter.allow(self.notice()))
+        self.assertFalse(limiter.allow(self.notice('KeyError')))
+        self.assertEqual(limiter.stats()['dropped'], {'sampled': 2})
+
+    def test_adaptive_sampling(self):
+        limiter = RateLimiter(adaptive_target=10)
+        limiter.random = lambda: 0.5
+        allowed = [limiter.allow(self.notice(), now=i / 100.0) for i in range(100)]
+        # the sample rate falls to 10/n once the n-th notice of the second is seen
+        self.assertEqual(sum(allowed), 19)
+        self.assertAlmostEqual(limiter.stats()['observed_rate'], 0)
+        limiter.allow(self.notice(), now=1.0)
+        self.assertAlmostEqual(limiter.observed_rate, 100)
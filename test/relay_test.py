@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from errbit_reporter import Client, Configuration, Notice, RelayClient
+from errbit_reporter.relay import RelayServer, parse_address
+
+from test.stub_server import StubServer
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("timed out waiting for condition")
+        time.sleep(0.01)
+
+
+class RelayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.errbit = StubServer()
+        self.directory = tempfile.mkdtemp()
+        self.listen = 'unix:' + os.path.join(self.directory, 'relay.sock')
+        self.relay = None
+
+    def tearDown(self):
+        if self.relay is not None:
+            self.relay.shutdown(timeout=5)
+        self.errbit.stop()
+        shutil.rmtree(self.directory)
+
+    def start_relay(self, **kwargs):
+        self.relay = RelayServer(self.listen, self.errbit.url, **kwargs)
+        self.relay.start()
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address('udp:127.0.0.1:9999')[1], ('127.0.0.1', 9999))
+        self.assertEqual(parse_address('unix:/tmp/relay.sock')[1], '/tmp/relay.sock')
+        with self.assertRaises(ValueError):
+            parse_address('tcp:localhost:80')
+
+    def test_forwards_notices(self):
+        self.start_relay()
+        config = Configuration('apikey', 'http://errbit.invalid')
+        client = Client(config, transport=RelayClient(self.listen))
+        self.assertIsNone(client.send_notice(Notice(config, 'Error', 'relayed')))
+        wait_for(lambda: self.relay.stats()['forwarded'] == 1)
+        path, headers, body = self.errbit.requests[0]
+        self.assertEqual(path, '/notifier_api/v2/notices/')
+        self.assertEqual(headers['Content-Type'], 'text/xml')
+        self.assertIn(b'<message>relayed</message>', body)
+        client.close()
+
+    def test_dedup_window(self):
+        self.start_relay(dedup_window=60)
+        transport = RelayClient(self.listen)
+        for body in (b'<notice>1</notice>', b'<notice>1</notice>', b'<notice>2</notice>'):
+            transport.post(None, body, None)
+        wait_for(lambda: self.relay.stats()['received'] == 3)
+        wait_for(lambda: self.relay.stats()['forwarded'] == 2)
+        self.assertEqual(self.relay.stats()['duplicates'], 1)
+        transport.close()
+
+    def test_json_notices_need_api_key(self):
+        self.start_relay(api_key='apikey')
+        transport = RelayClient(self.listen)
+        transport.post(None, b'{"errors": []}', None)
+        wait_for(lambda: self.relay.stats()['forwarded'] == 1)
+        path, headers, body = self.errbit.requests[0]
+        self.assertEqual(path, '/api/v3/projects/apikey/notices?key=apikey')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        transport.close()
+
+    def test_retries_while_errbit_fails(self):
+        self.errbit.responses.append((503, {}))
+        self.start_relay()
+        transport = RelayClient(self.listen)
+        transport.post(None, b'<notice />', None)
+        wait_for(lambda: self.relay.stats()['forwarded'] == 1)
+        self.assertEqual(len(self.errbit.requests), 2)
+        self.assertEqual(self.relay.stats()['failures'], 1)
+        transport.close()
+
+    def test_drops_oldest_when_full(self):
+        self.relay = RelayServer(self.listen, self.errbit.url, max_queue=2)
+        for body in (b'1', b'2', b'3'):
+            self.relay._enqueue(body, 0)
+        self.assertEqual(list(self.relay._queue), [b'2', b'3'])
+        self.assertEqual(self.relay.stats()['dropped'], 1)
+
+    def test_shutdown_forwards_queued_notices(self):
+        self.relay = RelayServer(self.listen, self.errbit.url)
+        for body in (b'<notice>1</notice>', b'<notice>2</notice>', b'<notice>3</notice>'):
+            self.relay._enqueue(body, 0)
+        # stopped before forwarding anything, as by SIGTERM
+        self.relay._stopped.set()
+        self.relay.start()
+        self.relay.shutdown(timeout=5)
+        stats = self.relay.stats()
+        self.relay = None
+        self.assertEqual((stats['forwarded'], stats['dropped'], stats['queued']), (3, 0, 0))
+
+    def test_shutdown_drops_notices_left_after_timeout(self):
+        self.errbit.responses.extend([(503, {})] * 100)
+        self.relay = RelayServer(self.listen, self.errbit.url, concurrency=1)
+        for body in (b'<notice>1</notice>', b'<notice>2</notice>'):
+            self.relay._enqueue(body, 0)
+        self.relay.start()
+        started = time.time()
+        self.relay.shutdown(timeout=0.2)
+        self.assertLess(time.time() - started, 2)
+        stats = self.relay.stats()
+        self.relay = None
+        self.assertEqual((stats['forwarded'], stats['dropped'], stats['queued']), (0, 2, 0))
+
+    def test_rejects_json_without_api_key(self):
+        self.relay = RelayServer(self.listen, self.errbit.url)
+        self.assertEqual(self.relay._forward_batch([b'{"errors": []}']), [])
+        self.assertEqual(self.relay.stats()['rejected'], 1)
+
+    def test_client_drops_without_relay(self):
+        transport = RelayClient(self.listen)
+        transport.post(None, b'<notice />', None)
+        self.assertEqual(transport.dropped, 1)
+        transport.close()
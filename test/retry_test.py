@@ -0,0 +1,244 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from six.moves import urllib
+
+from errbit_reporter import (Client, Configuration, DeliveryQueue, InMemoryMetrics, NoticeFuture, RetryPolicy,
+                             RetryScheduler, Spool)
+from errbit_reporter.delivery import BLOCK, NoticeDropped
+from errbit_reporter.retry import retry_after
+
+from test.stub_server import RESPONSE_FILENAME
+
+
+def http_error(code, headers=None):
+    return urllib.error.HTTPError('http://localhost/', code, 'error', headers or {}, None)
+
+
+class ScriptedTransport(object):
+    "Raises or returns the scripted outcomes in order, then returns the response"
+
+    def __init__(self, outcomes):
+        with open(RESPONSE_FILENAME, 'rb') as f:
+            self.response = f.read()
+        self.outcomes = list(outcomes)
+        self.attempts = 0
+
+    def post(self, url, body, headers, timeout=None, read_response=True):
+        self.attempts += 1
+        if self.outcomes:
+            outcome = self.outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+        return self.response if read_response else None
+
+    def close(self):
+        pass
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def policy(self, **kwargs):
+        policy = RetryPolicy(**kwargs)
+        policy.random = lambda: 1.0
+        return policy
+
+    def test_exponential_backoff(self):
+        policy = self.policy(max_attempts=10, jitter=0, initial_backoff=1, max_backoff=5)
+        error = http_error(502)
+        self.assertEqual([policy.delay(attempts, 0, error) for attempts in range(1, 6)], [1, 2, 4, 5, 5])
+
+    def test_jitter(self):
+        policy = self.policy(jitter=0.5, initial_backoff=2)
+        self.assertEqual(policy.delay(1, 0, IOError()), 1.0)
+        policy.random = lambda: 0.0
+        self.assertEqual(policy.delay(1, 0, IOError()), 2.0)
+
+    def test_gives_up(self):
+        policy = self.policy(max_attempts=3, max_age=10, jitter=0)
+        self.assertIsNone(policy.delay(3, 0, http_error(500)))
+        self.assertIsNone(policy.delay(1, 9.5, http_error(500)))
+        self.assertIsNone(policy.delay(1, 0, http_error(400)))
+        self.assertIsNone(policy.delay(1, 0, ValueError()))
+
+    def test_retry_after(self):
+        policy = self.policy(max_age=60)
+        self.assertEqual(policy.delay(1, 0, http_error(429, {'Retry-After': '30'})), 30)
+        self.assertIsNone(policy.delay(1, 0, http_error(503, {'Retry-After': '120'})))
+        self.assertIsNone(retry_after(http_error(500, {'Retry-After': '30'})))
+        self.assertIsNone(retry_after(http_error(503, {'Retry-After': 'soon'})))
+        date = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 20))
+        self.assertAlmostEqual(retry_after(http_error(503, {'Retry-After': date})), 20, delta=2)
+
+
+class RetrySchedulerTest(unittest.TestCase):
+
+    def test_calls_in_due_order(self):
+        scheduler = RetryScheduler()
+        calls = []
+        done = threading.Event()
+        scheduler.call_later(0.06, done.set)
+        scheduler.call_later(0.04, calls.append, 'second')
+        scheduler.call_later(0.02, calls.append, 'first')
+        cancelled = scheduler.call_later(0.03, calls.append, 'cancelled')
+        self.assertEqual(len(scheduler), 4)
+        self.assertTrue(cancelled.cancel())
+        self.assertFalse(cancelled.cancel())
+        self.assertTrue(done.wait(5))
+        self.assertEqual(calls, ['first', 'second'])
+        self.assertEqual(len(scheduler), 0)
+
+
+class ClientRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Configuration('apikey', 'http://localhost')
+        self.policy = RetryPolicy(initial_backoff=0.01, jitter=0, scheduler=RetryScheduler())
+
+    def notify(self, client):
+        try:
+            int('a')
+        except ValueError:
+            return client.notify()
+
+    def test_retries_transient_errors(self):
+        transport = ScriptedTransport([http_error(503), IOError("connection reset")])
+        metrics = InMemoryMetrics()
+        client = Client(self.config, transport=transport, retry_policy=self.policy, metrics=metrics)
+        future = self.notify(client)
+        self.assertIsInstance(future, NoticeFuture)
+        self.assertEqual(future.result(timeout=5).id, '87186dda0c1d88569a171698')
+        self.assertEqual(transport.attempts, 3)
+        self.assertEqual(metrics.snapshot()['counters']['notices.retried'], 2)
+
+    def test_retries_from_delivery_queue(self):
+        transport = ScriptedTransport([http_error(500)])
+        client = Client(self.config, delivery=DeliveryQueue(), transport=transport, retry_policy=self.policy)
+        future = self.notify(client)
+        self.assertEqual(future.result(timeout=5).id, '87186dda0c1d88569a171698')
+        self.assertEqual(transport.attempts, 2)
+        client.close(timeout=5)
+
+    def test_spools_retry_the_delivery_queue_drops(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.policy.initial_backoff = 0.1
+        metrics = InMemoryMetrics()
+        client = Client(self.config, delivery=DeliveryQueue(), transport=ScriptedTransport([http_error(503)]),
+                        retry_policy=self.policy, spool=Spool(directory), metrics=metrics)
+        future = self.notify(client)
+        deadline = time.time() + 5
+        while not len(self.policy.scheduler) and time.time() < deadline:
+            time.sleep(0.01)
+        # the retry finds the queue closed
+        client.delivery.close()
+        self.assertIsNone(future.result(timeout=5))
+        client.close(timeout=5)
+        counters = metrics.snapshot()['counters']
+        self.assertEqual((counters['notices.queue_dropped'], counters['notices.spooled']), (1, 1))
+
+    def test_full_blocking_queue_doesnt_hold_up_scheduler(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocked():
+            started.set()
+            release.wait(10)
+
+        self.policy.initial_backoff = 0.2
+        delivery = DeliveryQueue(maxsize=1, overflow=BLOCK, block_timeout=3)
+        client = Client(self.config, delivery=delivery, transport=ScriptedTransport([http_error(503)]),
+                        retry_policy=self.policy)
+        try:
+            future = self.notify(client)
+            # fill the queue once the notice has failed and its retry is scheduled
+            deadline = time.time() + 5
+            while not len(self.policy.scheduler) and time.time() < deadline:
+                time.sleep(0.001)
+            delivery.submit(blocked)
+            started.wait(5)
+            delivery.submit(blocked)
+            fired = threading.Event()
+            # due after the retry, which finds the queue full
+            self.policy.scheduler.call_later(0.3, fired.set)
+            self.assertTrue(fired.wait(1))
+            self.assertIsInstance(future.exception(timeout=1), NoticeDropped)
+        finally:
+            release.set()
+            client.close(5)
+
+    def test_slow_retry_doesnt_hold_up_other_clients(self):
+        self.policy.scheduler = RetryScheduler()
+        release = threading.Event()
+
+        class BlockingTransport(ScriptedTransport):
+            def post(self, url, body, headers, timeout=None, read_response=True):
+                if self.attempts:
+                    release.wait(10)
+                return ScriptedTransport.post(self, url, body, headers, timeout, read_response)
+
+        slow = Client(self.config, transport=BlockingTransport([http_error(503)]), retry_policy=self.policy)
+        fast = Client(self.config, transport=ScriptedTransport([http_error(503)]), retry_policy=RetryPolicy(
+            initial_backoff=0.05, jitter=0, scheduler=self.policy.scheduler))
+        try:
+            slow_future = self.notify(slow)
+            fast_future = self.notify(fast)
+            self.assertEqual(fast_future.result(timeout=2).id, '87186dda0c1d88569a171698')
+            self.assertFalse(slow_future.done())
+        finally:
+            release.set()
+        self.assertEqual(slow_future.result(timeout=5).id, '87186dda0c1d88569a171698')
+        slow.close(timeout=5)
+        fast.close(timeout=5)
+
+    def test_reports_last_error_after_giving_up(self):
+        self.policy.max_attempts = 2
+        transport = ScriptedTransport([http_error(500), http_error(502)])
+        client = Client(self.config, transport=transport, retry_policy=self.policy)
+        future = self.notify(client)
+        self.assertEqual(future.exception(timeout=5).code, 502)
+        self.assertEqual(transport.attempts, 2)
+
+    def test_rejected_notice_isnt_retried(self):
+        transport = ScriptedTransport([http_error(422)])
+        client = Client(self.config, transport=transport, retry_policy=self.policy)
+        with self.assertRaises(urllib.error.HTTPError):
+            self.notify(client)
+        self.assertEqual(transport.attempts, 1)
+
+    def test_close_fails_pending_retries(self):
+        self.policy.initial_backoff = 60
+        transport = ScriptedTransport([http_error(503)])
+        client = Client(self.config, transport=transport, retry_policy=self.policy)
+        future = self.notify(client)
+        self.assertFalse(future.done())
+        client.close()
+        self.assertEqual(future.exception(timeout=0).code, 503)
+        self.assertEqual(len(self.policy.scheduler), 0)
+
+    def test_no_retries_after_close(self):
+        transport = ScriptedTransport([http_error(503)])
+        client = Client(self.config, transport=transport, retry_policy=self.policy)
+        client.close()
+        with self.assertRaises(urllib.error.HTTPError):
+            self.notify(client)
+        self.assertEqual(len(self.policy.scheduler), 0)
+
+    def test_spools_notices_failing_after_close(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics = InMemoryMetrics()
+        client = Client(self.config, transport=ScriptedTransport([http_error(503)]), retry_policy=self.policy,
+                        spool=Spool(directory), metrics=metrics)
+        client.close()
+        self.assertIsNone(self.notify(client))
+        self.assertEqual(len(self.policy.scheduler), 0)
+        # the closed spool drops it
+        self.assertEqual(metrics.snapshot()['counters']['notices.spool_dropped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import six
+from six.moves import urllib
+
+from errbit_reporter import Spool
+from errbit_reporter.spool import FSYNC_ALWAYS, FSYNC_NEVER
+
+
+def http_error(code):
+    return urllib.error.HTTPError('http://localhost', code, 'error', {}, six.BytesIO(b''))
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sent = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.seg'))
+
+    def test_append_and_drain(self):
+        spool = Spool(self.directory, fsync=FSYNC_ALWAYS)
+        for payload in (b'one', b'two', b'three'):
+            self.assertTrue(spool.append(payload))
+        self.assertEqual(spool.drain(self.sent.append), (3, False))
+        self.assertEqual(self.sent, [b'one', b'two', b'three'])
+        self.assertEqual(self.segments(), [])
+        self.assertEqual(spool.pending_bytes, 0)
+        spool.append(b'four')
+        self.assertEqual(spool.drain(self.sent.append), (1, False))
+        self.assertEqual(self.sent[-1], b'four')
+
+    def test_drain_stops_at_transient_failure(self):
+        spool = Spool(self.directory)
+        spool.append(b'one')
+        spool.append(b'two')
+
+        def send(payload):
+            if payload == b'two':
+                raise http_error(503)
+            self.sent.append(payload)
+        self.assertEqual(spool.drain(send), (1, True))
+        self.assertEqual(spool.drain(self.sent.append), (1, False))
+        self.assertEqual(self.sent, [b'one', b'two'])
+
+    def test_drain_discards_rejected_notices(self):
+        spool = Spool(self.directory)
+        spool.append(b'one')
+        spool.append(b'two')
+
+        def send(payload):
+            if payload == b'one':
+                raise http_error(422)
+            self.sent.append(payload)
+        self.assertEqual(spool.drain(send), (1, False))
+        self.assertEqual(self.sent, [b'two'])
+
+    def test_segment_rotation_and_size_cap(self):
+        spool = Spool(self.directory, segment_bytes=64, max_bytes=160, fsync=FSYNC_NEVER)
+        for i in range(10):
+            spool.append(b'notice %02d ' % i + b'x' * 20)
+        self.assertLessEqual(spool.pending_bytes, 160)
+        self.assertGreater(len(self.segments()), 1)
+        spool.drain(self.sent.append)
+        self.assertEqual(self.sent[-1][:9], b'notice 09')
+        self.assertLess(len(self.sent), 10)
+
+    def test_resumes_from_cursor_after_restart(self):
+        spool = Spool(self.directory)
+        for payload in (b'one', b'two', b'three'):
+            spool.append(payload)
+
+        def send(payload):
+            if payload == b'two':
+                raise http_error(503)
+            self.sent.append(payload)
+        spool.drain(send)
+        spool.close()
+
+        spool = Spool(self.directory)
+        spool.drain(self.sent.append)
+        self.assertEqual(self.sent, [b'one', b'two', b'three'])
+
+    def test_recovers_from_torn_record(self):
+        spool = Spool(self.directory)
+        spool.append(b'one')
+        spool.append(b'two')
+        spool.close()
+        path = os.path.join(self.directory, self.segments()[0])
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 1)
+
+        spool = Spool(self.directory)
+        spool.append(b'three')
+        spool.drain(self.sent.append)
+        self.assertEqual(self.sent, [b'one', b'three'])
+
+    def test_drains_segment_behind_cursor(self):
+        spool = Spool(self.directory)
+        spool.append(b'one')
+        spool.close()
+        # as if another process had created the segment after the drainer
+        # moved past its number
+        with open(os.path.join(self.directory, 'cursor'), 'w') as f:
+            f.write('5 13\n')
+
+        spool = Spool(self.directory)
+        spool.append(b'two')
+        self.assertEqual(spool.drain(self.sent.append), (2, False))
+        self.assertEqual(self.sent, [b'one', b'two'])
+        self.assertEqual(self.segments(), [])
+        spool.close()
+
+    def test_resumes_segment_behind_cursor(self):
+        spool = Spool(self.directory)
+        spool.append(b'one')
+        spool.append(b'two')
+        spool.close()
+        with open(os.path.join(self.directory, 'cursor'), 'w') as f:
+            f.write('5 13\n')
+
+        def send(payload):
+            if payload == b'two':
+                raise http_error(503)
+            self.sent.append(payload)
+        spool = Spool(self.directory)
+        self.assertEqual(spool.drain(send), (1, True))
+        spool.close()
+
+        spool = Spool(self.directory)
+        self.assertEqual(spool.drain(self.sent.append), (1, False))
+        self.assertEqual(self.sent, [b'one', b'two'])
+        spool.close()
+
+    def test_size_cap_counts_deleted_notices(self):
+        spool = Spool(self.directory, segment_bytes=64, max_bytes=160, fsync=FSYNC_NEVER)
+        for i in range(10):
+            spool.append(b'notice %02d ' % i + b'x' * 20)
+        spool.drain(self.sent.append)
+        self.assertEqual(len(self.sent) + spool.dropped, 10)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['cursor', 'drain.lock'])
+
+    def test_background_drainer(self):
+        spool = Spool(self.directory, min_backoff=0.01)
+        failures = [http_error(503)]
+        done = threading.Event()
+
+        def send(payload):
+            if failures:
+                raise failures.pop()
+            self.sent.append(payload)
+            done.set()
+        spool.start(send)
+        spool.append(b'one')
+        self.assertTrue(done.wait(5))
+        spool.close(5)
+        self.assertEqual(self.sent, [b'one'])
@@ -0,0 +1,74 @@
+import os.path
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+
+RESPONSE_FILENAME = os.path.join(os.path.dirname(__file__), 'fixtures', 'response.xml')
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, which would otherwise wait
+    # on the client's delayed ack
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with server.lock:
+            # keep the message, whose header lookups are case insensitive, since
+            # python 2 lowercases the names in its items
+            server.requests.append((self.path, self.headers, body))
+            server.connections.add(self.client_address)
+            status, headers = server.responses.pop(0) if server.responses else (200, {})
+        if server.latency:
+            time.sleep(server.latency)
+        payload = server.body if status < 400 else b''
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if not server.keep_alive:
+            self.wfile.flush()
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server on a random local port that answers like errbit
+
+    Records each request as (path, headers, body) and the client addresses
+    of the connections used. Queue (status, headers) pairs on responses to
+    answer the next requests with an error, and clear keep_alive to have
+    the server close connections without telling the client, and set
+    latency to delay each response by that many seconds.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        with open(RESPONSE_FILENAME, 'rb') as f:
+            self.body = f.read()
+        self.lock = threading.Lock()
+        self.requests = []
+        self.responses = []
+        self.connections = set()
+        self.keep_alive = True
+        self.latency = 0
+        self.thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
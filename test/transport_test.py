@@ -0,0 +1,79 @@
+import threading
+import unittest
+
+from six.moves import urllib
+
+from errbit_reporter import PooledTransport
+
+from test.stub_server import StubServer
+
+HEADERS = (('Content-Type', 'text/xml'),)
+
+
+class PooledTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.url = self.server.url + '/notifier_api/v2/notices/'
+        self.transport = PooledTransport()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+
+    def test_reuses_connection(self):
+        for i in range(3):
+            body = self.transport.post(self.url, b'<notice />', HEADERS, timeout=5)
+            self.assertEqual(body, self.server.body)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(self.server.connections), 1)
+        path, headers, body = self.server.requests[0]
+        self.assertEqual(path, '/notifier_api/v2/notices/')
+        self.assertEqual(headers['Content-Type'], 'text/xml')
+        self.assertEqual(body, b'<notice />')
+
+    def test_reconnects_after_connection_closed(self):
+        self.server.keep_alive = False
+        self.transport.post(self.url, b'1', HEADERS, timeout=5)
+        self.transport.post(self.url, b'2', HEADERS, timeout=5)
+        self.assertEqual([r[2] for r in self.server.requests], [b'1', b'2'])
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_without_reading_response(self):
+        for i in range(2):
+            self.assertIsNone(self.transport.post(self.url, b'1', HEADERS, timeout=5, read_response=False))
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_idle_timeout(self):
+        transport = PooledTransport(idle_timeout=0)
+        transport.post(self.url, b'1', HEADERS, timeout=5)
+        transport.post(self.url, b'2', HEADERS, timeout=5)
+        transport.close()
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_error_response(self):
+        self.server.responses.append((503, {'Retry-After': '2'}))
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.transport.post(self.url, b'1', HEADERS, timeout=5)
+        self.assertEqual(cm.exception.code, 503)
+        self.assertEqual(cm.exception.headers['Retry-After'], '2')
+        self.transport.post(self.url, b'2', HEADERS, timeout=5)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_shared_between_threads(self):
+        errors = []
+
+        def send():
+            try:
+                for i in range(5):
+                    self.transport.post(self.url, b'x', HEADERS, timeout=5)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=send) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.server.requests), 20)
+        self.assertLessEqual(len(self.server.connections), 4)
@@ -0,0 +1,109 @@
+import unittest
+from wsgiref.util import FileWrapper, setup_testing_defaults
+from xml.etree import cElementTree as ET
+
+import six
+
+from errbit_reporter import Client, Configuration, ErrbitMiddleware
+
+
+class RecordingTransport(object):
+    def __init__(self):
+        self.bodies = []
+
+    def post(self, url, body, headers, timeout=None, read_response=True):
+        self.bodies.append(body)
+        return None
+
+    def close(self):
+        pass
+
+
+def ok_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+def failing_app(environ, start_response):
+    raise ValueError('oops')
+
+
+def failing_body_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    yield b'partial'
+    raise KeyError('missing')
+
+
+class ErrbitMiddlewareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = RecordingTransport()
+        self.client = Client(Configuration('apikey', 'http://localhost'), transport=self.transport)
+        self.environ = {
+            'PATH_INFO': '/items',
+            'QUERY_STRING': 'id=1&password=hunter2&tag=a&tag=b',
+            'HTTP_COOKIE': 'session=abc',
+            'REQUEST_URI': '/items?id=1&password=hunter2&tag=a&tag=b',
+        }
+        setup_testing_defaults(self.environ)
+
+    def start_response(self, status, headers, exc_info=None):
+        pass
+
+    def notices(self):
+        return [ET.fromstring(body) for body in self.transport.bodies]
+
+    def test_success(self):
+        app = ErrbitMiddleware(ok_app, self.client)
+        self.assertEqual(app(self.environ, self.start_response), [b'ok'])
+        self.assertEqual(self.transport.bodies, [])
+
+    def test_file_wrapper_response_is_not_wrapped(self):
+        self.environ['wsgi.file_wrapper'] = FileWrapper
+
+        def file_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return environ['wsgi.file_wrapper'](six.BytesIO(b'ok'))
+
+        app = ErrbitMiddleware(file_app, self.client)
+        response = app(self.environ, self.start_response)
+        self.assertIsInstance(response, FileWrapper)
+        self.assertEqual(list(response), [b'ok'])
+        response.close()
+
+    def test_error_calling_app(self):
+        app = ErrbitMiddleware(failing_app, self.client)
+        with self.assertRaises(ValueError):
+            app(self.environ, self.start_response)
+        notice, = self.notices()
+        self.assertEqual(notice.findtext('./error/class'), 'ValueError')
+        self.assertEqual(notice.findtext('./request/url'), 'http://127.0.0.1/items?id=1&password=[FILTERED]&tag=a&tag=b')
+        self.assertEqual(notice.findtext('./request/params/id'), '1')
+        self.assertEqual(notice.findtext('./request/params/password'), '[FILTERED]')
+        self.assertEqual([e.text for e in notice.findall('./request/params/tag/item')], ['a', 'b'])
+        self.assertEqual(notice.findtext('./request/cgi-data/PATH_INFO'), '/items')
+        self.assertEqual(notice.findtext('./request/cgi-data/HTTP_COOKIE'), '[FILTERED]')
+        self.assertIsNone(notice.find('./request/cgi-data/wsgi.input'))
+        self.assertEqual(notice.findtext('./request/cgi-data/QUERY_STRING'), 'id=1&password=[FILTERED]&tag=a&tag=b')
+        self.assertEqual(notice.findtext('./request/cgi-data/REQUEST_URI'), '/items?id=1&password=[FILTERED]&tag=a&tag=b')
+        self.assertNotIn(b'hunter2', self.transport.bodies[0])
+
+    def test_error_iterating_response(self):
+        app = ErrbitMiddleware(failing_body_app, self.client)
+        response = app(self.environ, self.start_response)
+        chunks = []
+        with self.assertRaises(KeyError):
+            for chunk in response:
+                chunks.append(chunk)
+        response.close()
+        self.assertEqual(chunks, [b'partial'])
+        notice, = self.notices()
+        self.assertEqual(notice.findtext('./error/class'), 'KeyError')
+
+    def test_reporting_error_keeps_app_error(self):
+        def failing_post(*args, **kwargs):
+            raise IOError('errbit is down')
+        self.transport.post = failing_post
+        app = ErrbitMiddleware(failing_app, self.client)
+        with self.assertRaises(ValueError):
+            app(self.environ, self.start_response)